@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+# Batch synchronization analysis of GEM data files (.gdf)
+#   - computes per-run, per-tapper summaries (see GEMMetrics) and the mean
+#     next_met_adjust for every .gdf file below a directory, only for the
+#     tappers requested in each file's header
+#   - files are processed in parallel across a process pool and the result is
+#     written as a single CSV table, grouped by the alpha and tempo of each run
+#   - a second table averages the per-tapper rows of each (alpha, tempo)
+#
+# Usage:
+#   python GEMAnalysis.py <data_dir> [--out summary.csv]
+#       [--group-out summary_groups.csv] [--workers N]
+'''
+
+import argparse
+import csv
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from GEMIO import GEMDataFile, GEM_MAX_TAPPERS
+from GEMMetrics import run_metrics
+
+# summary table columns in the order they are written
+COLUMNS = [
+    "alpha", "tempo", "file", "run_number", "tapper", "windows",
+    "mean_asynchrony", "mean_abs_asynchrony", "sd_asynchrony",
+    "lag1_autocorrelation", "no_response_rate", "mean_next_met_adjust",
+]
+
+# per-row summaries that are averaged over each (alpha, tempo) group
+GROUP_MEANS = [
+    "mean_asynchrony", "mean_abs_asynchrony", "sd_asynchrony",
+    "lag1_autocorrelation", "no_response_rate", "mean_next_met_adjust",
+]
+
+# grouped summary table columns in the order they are written
+GROUP_COLUMNS = ["alpha", "tempo", "runs", "tappers", "windows"] + GROUP_MEANS
+
+# ==============================================================================
+# summarize a single run
+# in: <hdr> the run header dict, <data> the run's structured packet array,
+#     <ntapper> the number of tappers requested for the session
+# out: a list of row dicts (one per tapper) with keys from COLUMNS
+def summarize_run(hdr, data, ntapper=GEM_MAX_TAPPERS):
+    metrics = run_metrics(data)
+
+    nwin = data.size
+    mean_adjust = data["next_met_adjust"].mean() if nwin else np.nan
+
+    rows = []
+    for k in range(0, ntapper):
+        rows.append({
+            "alpha": hdr["alpha"],
+            "tempo": hdr["tempo"],
+            "run_number": hdr.get("run_number"),
+            "tapper": k+1,
+            "windows": nwin,
+            "mean_asynchrony": metrics["mean_asynchrony"][0, k],
+            "mean_abs_asynchrony": metrics["mean_abs_asynchrony"][0, k],
+            "sd_asynchrony": metrics["sd_asynchrony"][0, k],
+            "lag1_autocorrelation": metrics["lag1_autocorrelation"][0, k],
+            "no_response_rate": 1.0 - metrics["response_rate"][0, k],
+            "mean_next_met_adjust": mean_adjust,
+        })
+
+    return rows
+
+# ==============================================================================
+# summarize every recorded run in a .gdf file
+def summarize_file(filepath):
+    df = GEMDataFile(filepath, mode="rb", memmap=True)
+    df.read_file_header()
+
+    # pads that were never connected only ever report NO_RESPONSE
+    ntapper = min(df.file_hdr.get("tappers_requested", GEM_MAX_TAPPERS), GEM_MAX_TAPPERS)
+
+    rows = []
+    for krun, hdr, data in df.iter_runs():
+        for row in summarize_run(hdr, data, ntapper):
+            row["file"] = filepath
+            rows.append(row)
+
+    df.close()
+
+    return rows
+
+# ==============================================================================
+# find all .gdf files below <data_dir>
+def find_data_files(data_dir):
+    files = []
+    for root, dirs, fnames in os.walk(data_dir):
+        dirs.sort()
+        for f in sorted(fnames):
+            if f.endswith(".gdf"):
+                files.append(os.path.join(root, f))
+
+    return files
+
+# ==============================================================================
+# summarize all .gdf files below <data_dir> across a process pool
+# out: list of row dicts, sorted so that runs sharing alpha and tempo are
+#      grouped together
+def summarize_archive(data_dir, workers=None):
+    files = find_data_files(data_dir)
+
+    print(f"[INFO]: Summarizing {len(files)} file(s)")
+
+    rows = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        jobs = {pool.submit(summarize_file, f): f for f in files}
+
+        for job in as_completed(jobs):
+            try:
+                rows.extend(job.result())
+            except Exception as err:
+                print(f"[WARN]: Failed to summarize file \"{jobs[job]}\" - {err}")
+
+    rows.sort(key=lambda r: (r["alpha"], r["tempo"], r["file"], r["run_number"] or 0, r["tapper"]))
+
+    return rows
+
+# ==============================================================================
+# average the summary rows of each (alpha, tempo)
+# in: <rows> as returned by summarize_archive
+# out: list of row dicts with keys from GROUP_COLUMNS, one per (alpha, tempo)
+def summarize_groups(rows):
+    groups = {}
+    for row in rows:
+        groups.setdefault((row["alpha"], row["tempo"]), []).append(row)
+
+    summary = []
+    for (alpha, tempo), group in sorted(groups.items()):
+        # windows of each run, counted once rather than once per tapper
+        runs = {(r["file"], r["run_number"]): r["windows"] for r in group}
+
+        row = {
+            "alpha": alpha,
+            "tempo": tempo,
+            "runs": len(runs),
+            "tappers": len(group),
+            "windows": sum(runs.values()),
+        }
+
+        with np.errstate(invalid="ignore"):
+            for name in GROUP_MEANS:
+                values = np.array([r[name] for r in group], dtype=float)
+                row[name] = np.nanmean(values) if np.isfinite(values).any() else np.nan
+
+        summary.append(row)
+
+    return summary
+
+# ==============================================================================
+# write summary rows to a CSV file
+def write_table(rows, outpath, columns=COLUMNS):
+    with open(outpath, "w", newline="") as io:
+        writer = csv.DictWriter(io, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+
+# ==============================================================================
+def main():
+    parser = argparse.ArgumentParser(description="Summarize synchronization in GEM .gdf files")
+    parser.add_argument("data_dir", help="directory to search (recursively) for .gdf files")
+    parser.add_argument("--out", default="gem_summary.csv",
+        help="path of the output CSV table (default: gem_summary.csv)")
+    parser.add_argument("--group-out", default="gem_summary_groups.csv",
+        help="path of the per (alpha, tempo) CSV table (default: gem_summary_groups.csv)")
+    parser.add_argument("--workers", type=int, default=None,
+        help="number of worker processes (default: number of CPUs)")
+
+    args = parser.parse_args()
+
+    rows = summarize_archive(args.data_dir, args.workers)
+    write_table(rows, args.out)
+
+    print(f"[INFO]: Wrote {len(rows)} row(s) to {args.out}")
+
+    groups = summarize_groups(rows)
+    write_table(groups, args.group_out, GROUP_COLUMNS)
+
+    print(f"[INFO]: Wrote {len(groups)} row(s) to {args.group_out}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+# Generated from GEM/GEMConstants.h by GEMIO.freeze_constants, do not edit.
+# Regenerate after changing the header with: python GEMIO.py
+
+SOURCE_DIGEST = '51c3a12db7eaa3f4c6c5937e66970117bc523b75'
+
+GEM_STOP = b'\x00'
+GEM_START = b'\x01'
+GEM_REQUEST_ACK = b'\x02'
+GEM_STATE_IDLE = b'\x03'
+GEM_STATE_RUN = b'\x04'
+GEM_METRONOME_HEURISTIC_AVERAGE = b'\x10'
+GEM_METRONOME_ALPHA = b'\x11'
+GEM_METRONOME_TEMPO = b'\x12'
+GEM_ERROR = b' '
+ERR_WAVEHC_CARD_INIT = b'!'
+ERR_WAVEHC_VOL_INIT = b'"'
+ERR_WAVEHC_ROOT_OPEN = b'#'
+ERR_WAVEHC_OPEN_BY_NAME = b'$'
+ERR_WAVEHC_OPEN_BY_INDEX = b'%'
+ERR_WAVEHC_WAVE_CREATE = b'&'
+MUTE_SOUND = b'0'
+UNMUTE_SOUND = b'1'
+GEM_DTP_RAW = b'\xf0'
+GEM_PACKET_SIZE = '17'
+GEM_MAX_TAPPERS = '4'
+NO_RESPONSE = '-32000'
+GEM_HANDSHAKE_TIMEOUT = '5'
+GEM_SERIAL_BAUDRATE = '115200'
+GEM_WRITE_DUR_MS = '1'
+
+CONSTANTS = {
+    'GEM_STOP': GEM_STOP,
+    'GEM_START': GEM_START,
+    'GEM_REQUEST_ACK': GEM_REQUEST_ACK,
+    'GEM_STATE_IDLE': GEM_STATE_IDLE,
+    'GEM_STATE_RUN': GEM_STATE_RUN,
+    'GEM_METRONOME_HEURISTIC_AVERAGE': GEM_METRONOME_HEURISTIC_AVERAGE,
+    'GEM_METRONOME_ALPHA': GEM_METRONOME_ALPHA,
+    'GEM_METRONOME_TEMPO': GEM_METRONOME_TEMPO,
+    'GEM_ERROR': GEM_ERROR,
+    'ERR_WAVEHC_CARD_INIT': ERR_WAVEHC_CARD_INIT,
+    'ERR_WAVEHC_VOL_INIT': ERR_WAVEHC_VOL_INIT,
+    'ERR_WAVEHC_ROOT_OPEN': ERR_WAVEHC_ROOT_OPEN,
+    'ERR_WAVEHC_OPEN_BY_NAME': ERR_WAVEHC_OPEN_BY_NAME,
+    'ERR_WAVEHC_OPEN_BY_INDEX': ERR_WAVEHC_OPEN_BY_INDEX,
+    'ERR_WAVEHC_WAVE_CREATE': ERR_WAVEHC_WAVE_CREATE,
+    'MUTE_SOUND': MUTE_SOUND,
+    'UNMUTE_SOUND': UNMUTE_SOUND,
+    'GEM_DTP_RAW': GEM_DTP_RAW,
+    'GEM_PACKET_SIZE': GEM_PACKET_SIZE,
+    'GEM_MAX_TAPPERS': GEM_MAX_TAPPERS,
+    'NO_RESPONSE': NO_RESPONSE,
+    'GEM_HANDSHAKE_TIMEOUT': GEM_HANDSHAKE_TIMEOUT,
+    'GEM_SERIAL_BAUDRATE': GEM_SERIAL_BAUDRATE,
+    'GEM_WRITE_DUR_MS': GEM_WRITE_DUR_MS,
+}
@@ -0,0 +1,430 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+# Stand-in for the Metronome Arduino, served on a pseudo terminal (pty)
+#   - MetronomeFirmware follows Metronome/Metronome.ino: the idle state accepts
+#     GEM_METRONOME_TEMPO/ALPHA (parsed like Stream::parseInt/parseFloat) and
+#     GEM_STATE_RUN, the run state accepts GEM_START/GEM_STOP (STOP returns to
+#     idle) and MUTE/UNMUTE, windows are scheduled with Metronome::scheduleNext
+#     (see GEMMetronome) and sent as 17-byte GEM_DTP_RAW packets
+#   - asynchronies come from synthetic tappers drawn around each scheduled
+#     metronome event
+#   - like the Arduino, the firmware resets whenever the port is (re)opened
+#   - EmulatedSerial runs the same firmware in-process behind a pyserial-like
+#     interface and follows a GEMIO clock, so whole sessions can run faster
+#     than real time (see presets["emulator"] and GEMHeadless --speed)
+#
+# Usage:
+#   python GEMEmulator.py [--tappers N] [--mean MS] [--sd MS] [--miss P]
+#       [--link PATH]
+#   then use the printed device (or PATH) as presets["serial"]["port"]
+'''
+
+import argparse
+import os
+import select
+import struct
+import tty
+from time import monotonic, sleep
+
+import numpy as np
+
+from GEMIO import GEM_MAX_TAPPERS, GEM_CONSTANTS_HFILE, NO_RESPONSE, SystemClock, load_constants
+from GEMMetronome import Metronome, parse_float, to_int16
+
+# Stream::setTimeout() default, how long parseInt/parseFloat wait for a char
+GEM_STREAM_TIMEOUT = 1.0
+
+# ==============================================================================
+# a tapper whose asynchrony to each metronome event is drawn from a normal
+# distribution, missing a window with probability <miss_rate>
+class SyntheticTapper:
+    def __init__(self, mean=-20.0, sd=20.0, miss_rate=0.05, rng=None):
+        self.mean = mean
+        self.sd = sd
+        self.miss_rate = miss_rate
+        self.rng = rng if rng is not None else np.random.default_rng()
+
+    # --------------------------------------------------------------------------
+    # asynchrony (ms) for the next event, taps outside the window around the
+    # event (+/- ioi/2) are not registered
+    def draw(self, ioi):
+        if self.rng.random() < self.miss_rate:
+            return NO_RESPONSE
+
+        asynch = int(round(self.rng.normal(self.mean, self.sd)))
+        if not -(ioi // 2) <= asynch < ioi // 2:
+            return NO_RESPONSE
+
+        return asynch
+
+# ==============================================================================
+# byte-level model of the Metronome sketch. Feed it what the ECC writes with
+# receive(), call step() regularly (see time_to_next_event()) and collect what
+# the metronome sends with read()
+class MetronomeFirmware:
+    def __init__(self, tappers, constants=None, clock=monotonic):
+        self.tappers = tappers[:GEM_MAX_TAPPERS]
+        self.constants = constants or load_constants(GEM_CONSTANTS_HFILE)
+        self.clock = clock
+
+        # one-byte codes as ints
+        self.codes = {k: v[0] for k, v in self.constants.items() if isinstance(v, bytes)}
+
+        self.reset()
+
+    # --------------------------------------------------------------------------
+    # power on / port open: everything starts over, including the window
+    # counter and millis()
+    def reset(self):
+        self.t0 = self.clock()
+
+        self.state = self.codes["GEM_STATE_IDLE"]
+        self.running = False
+
+        self.met = Metronome()
+        self.window = 0
+        self.window_ends = 0
+
+        # tapper handshake in setup()
+        self.connected = [k < len(self.tappers) for k in range(0, GEM_MAX_TAPPERS)]
+        self.asyncs = [NO_RESPONSE] * GEM_MAX_TAPPERS
+
+        self.inbuf = bytearray()
+        self.outbuf = bytearray()
+
+        # parameter code waiting for its (ASCII) value, and when the last
+        # byte arrived (for the parse timeout)
+        self.pending = None
+        self.last_rx = self.t0
+
+    # --------------------------------------------------------------------------
+    def millis(self):
+        return int((self.clock() - self.t0) * 1000) & 0xffffffff
+
+    # --------------------------------------------------------------------------
+    def receive(self, data):
+        self.inbuf += data
+        self.last_rx = self.clock()
+        self.process()
+
+    # --------------------------------------------------------------------------
+    def read(self):
+        out = bytes(self.outbuf)
+        self.outbuf.clear()
+        return out
+
+    # --------------------------------------------------------------------------
+    # scan an ASCII number at the start of the input buffer like
+    # Stream::parseInt/parseFloat: leading non-numeric characters are skipped
+    # (and lost), the number ends at the first other character (which is not
+    # consumed) or when no character arrives within GEM_STREAM_TIMEOUT
+    # out: the number's text, or None while still waiting for input
+    def scan_number(self, fraction):
+        buf = self.inbuf
+        timed_out = self.clock() - self.last_rx >= GEM_STREAM_TIMEOUT
+
+        def starts_number(c):
+            return chr(c).isdigit() or c == ord("-") or (fraction and c == ord("."))
+
+        i = 0
+        while i < len(buf) and not starts_number(buf[i]):
+            i += 1
+
+        j = i
+        if j < len(buf):
+            seen_dot = buf[j] == ord(".")
+            j += 1
+            while j < len(buf):
+                c = buf[j]
+                if chr(c).isdigit():
+                    j += 1
+                elif fraction and c == ord(".") and not seen_dot:
+                    seen_dot = True
+                    j += 1
+                else:
+                    break
+
+        if j == len(buf) and not timed_out:
+            return None
+
+        text = buf[i:j].decode("ascii")
+        del buf[:j]
+
+        return text
+
+    # --------------------------------------------------------------------------
+    # handle everything waiting in the input buffer
+    def process(self):
+        c = self.codes
+        while True:
+            if self.pending is not None:
+                text = self.scan_number(self.pending == c["GEM_METRONOME_ALPHA"])
+                if text is None:
+                    return
+
+                if self.pending == c["GEM_METRONOME_ALPHA"]:
+                    self.met.alpha = parse_float(text)
+                else:
+                    self.met.set_tempo(int(text) if text.lstrip("-") else 0)
+
+                self.pending = None
+                continue
+
+            if not self.inbuf:
+                return
+
+            msg = self.inbuf.pop(0)
+
+            if self.state == c["GEM_STATE_IDLE"]:
+                if msg == c["GEM_STATE_RUN"]:
+                    self.state = c["GEM_STATE_RUN"]
+                elif msg in (c["GEM_METRONOME_ALPHA"], c["GEM_METRONOME_TEMPO"]):
+                    self.pending = msg
+
+            else:
+                if msg == c["GEM_STOP"]:
+                    self.running = False
+                    self.state = c["GEM_STATE_IDLE"]
+                elif msg == c["GEM_START"]:
+                    self.running = True
+
+                # MUTE_SOUND/UNMUTE_SOUND are forwarded to the tappers, which
+                # does not affect the data
+
+    # --------------------------------------------------------------------------
+    # one pass of run(): close the window (and send its packet) once its end
+    # has passed
+    def step(self):
+        # a parameter value may be waiting on the parse timeout
+        if self.pending is not None:
+            self.process()
+
+        if not (self.state == self.codes["GEM_STATE_RUN"] and self.running):
+            return
+
+        now = self.millis()
+        if now < self.window_ends:
+            return
+
+        met = self.met
+        last_met = met.next
+
+        # Catch us up if we have fallen behind
+        if met.next + met.ioi + met.ioi // 2 < now:
+            met.next = (now - met.ioi // 2) & 0xffffffff
+
+        adjust = met.schedule_next(self.asyncs, self.connected)
+
+        self.window_ends = met.next + met.ioi // 2
+
+        # Only send data if this isn't the first window
+        if self.window > 0:
+            self.outbuf += struct.pack("<BHI4hh",
+                self.codes["GEM_DTP_RAW"], self.window, last_met,
+                *to_int16(self.asyncs).tolist(), int(to_int16(adjust)))
+
+            self.asyncs = [NO_RESPONSE] * GEM_MAX_TAPPERS
+
+        self.window = (self.window + 1) & 0xffff
+
+        # taps registered during the coming window, relative to met.next
+        for k, tapper in enumerate(self.tappers):
+            self.asyncs[k] = tapper.draw(met.ioi)
+
+    # --------------------------------------------------------------------------
+    # seconds until step() next has something to do (None: wait for input)
+    def time_to_next_event(self):
+        waits = []
+
+        if self.pending is not None:
+            waits.append(self.last_rx + GEM_STREAM_TIMEOUT - self.clock())
+
+        if self.state == self.codes["GEM_STATE_RUN"] and self.running:
+            waits.append((self.window_ends - self.millis()) / 1000)
+
+        return max(0.0, min(waits)) if waits else None
+
+# ==============================================================================
+# in-process stand-in for the metronome's serial port (pyserial interface as
+# used by GEMIO), all waiting follows <clock>
+class EmulatedSerial:
+    def __init__(self, clock=None, timeout=None, tappers=2, mean=-20.0, sd=20.0, miss=0.05, seed=None):
+        self.clock = clock or SystemClock()
+        self.timeout = timeout
+
+        rng = np.random.default_rng(seed)
+        self.firmware = MetronomeFirmware(
+            [SyntheticTapper(mean, sd, miss, rng) for k in range(0, tappers)],
+            clock=self.clock.time,
+        )
+
+        self.rxbuf = bytearray()
+        self.is_open = True
+
+    # --------------------------------------------------------------------------
+    def isOpen(self):
+        return self.is_open
+
+    def close(self):
+        self.is_open = False
+
+    def flush(self):
+        pass
+
+    def write(self, data):
+        self.firmware.receive(bytes(data))
+
+    # --------------------------------------------------------------------------
+    # run the firmware up to the current time
+    def poll(self):
+        self.firmware.step()
+        self.rxbuf += self.firmware.read()
+
+    # --------------------------------------------------------------------------
+    @property
+    def in_waiting(self):
+        self.poll()
+        return len(self.rxbuf)
+
+    # --------------------------------------------------------------------------
+    # wait (on the clock) until <done>() or the read timeout
+    def wait_for(self, done):
+        deadline = None if self.timeout is None else self.clock.time() + self.timeout
+
+        self.poll()
+        while not done():
+            now = self.clock.time()
+            if deadline is not None and now >= deadline:
+                break
+
+            # sleep until the firmware has something to do, or the deadline
+            wait = self.firmware.time_to_next_event()
+            target = now + (wait if wait is not None else 0.010)
+            if deadline is not None:
+                target = min(target, deadline)
+
+            self.clock.wait_until(target)
+            self.poll()
+
+    # --------------------------------------------------------------------------
+    def read(self, n=1):
+        self.wait_for(lambda: len(self.rxbuf) >= n)
+
+        out = bytes(self.rxbuf[:n])
+        del self.rxbuf[:n]
+        return out
+
+    # --------------------------------------------------------------------------
+    def readline(self):
+        self.wait_for(lambda: b"\n" in self.rxbuf)
+
+        k = self.rxbuf.find(b"\n") + 1 or len(self.rxbuf)
+        out = bytes(self.rxbuf[:k])
+        del self.rxbuf[:k]
+        return out
+
+# ==============================================================================
+# serve a MetronomeFirmware on the master side of a pty, the slave device is
+# what the ECC opens in place of the Arduino's port
+class PtyMetronome:
+    def __init__(self, firmware, link=None):
+        self.firmware = firmware
+
+        self.master, slave = os.openpty()
+        tty.setraw(slave)
+        self.device = os.ttyname(slave)
+
+        # the master sees a hangup while no one has the slave open, which is
+        # how we notice the port being (re)opened
+        os.close(slave)
+
+        self.link = link
+        if link:
+            if os.path.lexists(link):
+                os.remove(link)
+            os.symlink(self.device, link)
+
+        self.connected = False
+
+    # --------------------------------------------------------------------------
+    def serve_forever(self):
+        poller = select.poll()
+        poller.register(self.master, select.POLLIN)
+
+        while True:
+            wait = self.firmware.time_to_next_event() if self.connected else None
+            timeout = 50 if wait is None else min(50, 1000 * wait)
+
+            events = poller.poll(timeout)
+            hangup = any(ev & select.POLLHUP for fd, ev in events)
+
+            if hangup:
+                if self.connected:
+                    print("[INFO]: Port closed")
+                    self.connected = False
+                sleep(0.05)
+                continue
+
+            if not self.connected:
+                # opening the port resets the Arduino
+                print("[INFO]: Port opened, resetting metronome")
+                self.firmware.reset()
+                self.connected = True
+
+            if any(ev & select.POLLIN for fd, ev in events):
+                try:
+                    self.firmware.receive(os.read(self.master, 4096))
+                except OSError:
+                    continue
+
+            self.firmware.step()
+
+            out = self.firmware.read()
+            if out:
+                os.write(self.master, out)
+
+    # --------------------------------------------------------------------------
+    def close(self):
+        os.close(self.master)
+        if self.link and os.path.islink(self.link):
+            os.remove(self.link)
+
+# ==============================================================================
+def main():
+    parser = argparse.ArgumentParser(description="Emulate the GEM metronome on a pty")
+    parser.add_argument("--tappers", type=int, default=2,
+        help="number of connected tappers (default: 2)")
+    parser.add_argument("--mean", type=float, default=-20.0,
+        help="mean tapper asynchrony in ms (default: -20)")
+    parser.add_argument("--sd", type=float, default=20.0,
+        help="SD of tapper asynchrony in ms (default: 20)")
+    parser.add_argument("--miss", type=float, default=0.05,
+        help="probability that a tapper misses a window (default: 0.05)")
+    parser.add_argument("--seed", type=int, default=None,
+        help="random seed for the tappers")
+    parser.add_argument("--hfile", default=GEM_CONSTANTS_HFILE,
+        help="path to GEMConstants.h")
+    parser.add_argument("--link", default=None,
+        help="also make the device available at this path (symlink)")
+
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    tappers = [SyntheticTapper(args.mean, args.sd, args.miss, rng) for k in range(0, args.tappers)]
+
+    firmware = MetronomeFirmware(tappers, load_constants(args.hfile))
+    pty = PtyMetronome(firmware, args.link)
+
+    print(f"[INFO]: Emulated metronome on {pty.device}" + (f" ({args.link})" if args.link else ""), flush=True)
+
+    try:
+        pty.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pty.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+# Columnar export of GEM data files (.gdf)
+#   - converts each .gdf file into a long-format table with one row per window
+#     per requested tapper (tappers_requested in the file header), with the
+#     run header values broadcast onto each row
+#   - tables are written as Parquet (if pyarrow is installed) or as .npz
+#
+# Usage:
+#   python GEMExport.py <data_dir> [--format parquet|npz] [--workers N] [--force]
+'''
+
+import argparse
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from GEMIO import GEMDataFile, GEM_MAX_TAPPERS
+
+# output columns in the order they are written
+COLUMNS = [
+    "run_number", "alpha", "tempo", "start_time",
+    "window_num", "met_time", "next_met_adjust",
+    "tapper", "asynchrony",
+]
+
+EXTENSIONS = {"parquet": ".parquet", "npz": ".npz"}
+
+# ==============================================================================
+# default output format: parquet if pyarrow is available, npz otherwise
+def default_format():
+    try:
+        import pyarrow
+    except ImportError:
+        return "npz"
+
+    return "parquet"
+
+# ==============================================================================
+# read a .gdf file into a dict of equal-length column arrays
+# in: <filepath> the path to a .gdf file
+# out: (columns, file_hdr) where columns maps the names in COLUMNS to 1D arrays
+def read_columns(filepath):
+    df = GEMDataFile(filepath, mode="rb", memmap=True)
+
+    blocks = {k: [] for k in COLUMNS}
+
+    # pads that were never connected only ever report NO_RESPONSE
+    ntapper = min(df.file_hdr.get("tappers_requested", GEM_MAX_TAPPERS), GEM_MAX_TAPPERS)
+
+    for krun in range(0, df.nruns):
+        packets = df.read_run_array(krun)
+        if packets.size == 0:
+            continue
+
+        hdr = df.read_run_header(krun)
+
+        # one row per window per tapper: window fields repeat, tapper cycles
+        nrow = packets.size * ntapper
+
+        blocks["window_num"].append(np.repeat(packets["window_num"], ntapper))
+        blocks["met_time"].append(np.repeat(packets["met_time"], ntapper))
+        blocks["next_met_adjust"].append(np.repeat(packets["next_met_adjust"], ntapper))
+        blocks["tapper"].append(np.tile(np.arange(1, ntapper+1, dtype=np.uint8), packets.size))
+        blocks["asynchrony"].append(packets["asynchronies"][:, :ntapper].reshape(-1))
+
+        # broadcast the run header onto every row of the run
+        blocks["run_number"].append(np.full(nrow, hdr.get("run_number", krun+1), dtype=np.uint16))
+        blocks["alpha"].append(np.full(nrow, hdr["alpha"], dtype=np.float64))
+        blocks["tempo"].append(np.full(nrow, hdr["tempo"], dtype=np.float64))
+        blocks["start_time"].append(np.full(nrow, hdr.get("start_time", "")))
+
+    columns = dict()
+    for k in COLUMNS:
+        if blocks[k]:
+            columns[k] = np.concatenate(blocks[k])
+        else:
+            columns[k] = np.array([])
+
+    file_hdr = df.file_hdr
+    df.close()
+
+    return columns, file_hdr
+
+# ==============================================================================
+# write a dict of column arrays to <outpath> in format <fmt>
+def write_columns(columns, file_hdr, outpath, fmt):
+    # write to a temporary file first so an interrupted conversion never
+    # leaves behind an output that looks complete
+    tmppath = outpath + ".tmp"
+
+    if fmt == "parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.table({k: columns[k] for k in COLUMNS})
+        table = table.replace_schema_metadata({"gem_file_hdr": json.dumps(file_hdr)})
+        pq.write_table(table, tmppath)
+
+    elif fmt == "npz":
+        with open(tmppath, "wb") as io:
+            np.savez(io, file_hdr=np.array(json.dumps(file_hdr)), **columns)
+
+    else:
+        raise ValueError("\"%s\" is not a valid export format!" % fmt)
+
+    os.replace(tmppath, outpath)
+
+# ==============================================================================
+# load a converted table back into a dict of column arrays
+def load_columns(path):
+    if path.endswith(EXTENSIONS["parquet"]):
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(path)
+        file_hdr = json.loads(table.schema.metadata[b"gem_file_hdr"])
+        columns = {k: table[k].to_numpy() for k in COLUMNS}
+
+    else:
+        with np.load(path) as npz:
+            file_hdr = json.loads(str(npz["file_hdr"]))
+            columns = {k: npz[k] for k in COLUMNS}
+
+    return columns, file_hdr
+
+# ==============================================================================
+def output_path(filepath, fmt):
+    return os.path.splitext(filepath)[0] + EXTENSIONS[fmt]
+
+# ==============================================================================
+# check whether <filepath> already has an up-to-date converted table
+def is_converted(filepath, fmt):
+    outpath = output_path(filepath, fmt)
+    return os.path.exists(outpath) and os.path.getmtime(outpath) >= os.path.getmtime(filepath)
+
+# ==============================================================================
+# convert a single .gdf file
+# out: the path to the converted table, or None if it was already up to date
+def convert_file(filepath, fmt="npz", force=False):
+    if not force and is_converted(filepath, fmt):
+        return None
+
+    columns, file_hdr = read_columns(filepath)
+
+    outpath = output_path(filepath, fmt)
+    write_columns(columns, file_hdr, outpath, fmt)
+
+    return outpath
+
+# ==============================================================================
+# find all .gdf files within the yyyymmdd date folders of <data_dir>
+def find_data_files(data_dir):
+    date_pat = re.compile(r"^\d{8}$")
+
+    files = []
+    for d in sorted(os.listdir(data_dir)):
+        date_dir = os.path.join(data_dir, d)
+        if not (date_pat.match(d) and os.path.isdir(date_dir)):
+            continue
+
+        for f in sorted(os.listdir(date_dir)):
+            if f.endswith(".gdf"):
+                files.append(os.path.join(date_dir, f))
+
+    return files
+
+# ==============================================================================
+# convert all .gdf files in a <data_dir> date tree across a process pool
+# out: list of successfully converted table paths (skipped files excluded)
+def convert_files(data_dir, fmt=None, workers=None, force=False):
+    fmt = fmt or default_format()
+
+    files = find_data_files(data_dir)
+    if not force:
+        files = [f for f in files if not is_converted(f, fmt)]
+
+    print(f"[INFO]: Converting {len(files)} file(s) to {fmt}")
+
+    converted = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        jobs = {pool.submit(convert_file, f, fmt, force): f for f in files}
+
+        for job in as_completed(jobs):
+            try:
+                outpath = job.result()
+            except Exception as err:
+                print(f"[WARN]: Failed to convert file \"{jobs[job]}\" - {err}")
+                continue
+
+            if outpath:
+                converted.append(outpath)
+
+    return sorted(converted)
+
+# ==============================================================================
+def main():
+    parser = argparse.ArgumentParser(description="Convert GEM .gdf files to columnar tables")
+    parser.add_argument("data_dir", help="base directory containing yyyymmdd date folders")
+    parser.add_argument("--format", choices=sorted(EXTENSIONS.keys()), default=None,
+        help="output format (default: parquet if pyarrow is installed, else npz)")
+    parser.add_argument("--workers", type=int, default=None,
+        help="number of worker processes (default: number of CPUs)")
+    parser.add_argument("--force", action="store_true",
+        help="reconvert files that already have an up-to-date table")
+
+    args = parser.parse_args()
+
+    converted = convert_files(args.data_dir, args.format, args.workers, args.force)
+    print(f"[INFO]: Converted {len(converted)} file(s)")
+
+if __name__ == "__main__":
+    main()
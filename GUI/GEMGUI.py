@@ -16,35 +16,28 @@
 # --- this should wait until v2
 '''
 
-import tkinter
-from tkinter import Tk, Label, Button, Entry, StringVar, Frame, OptionMenu, Text
-from tkinter.messagebox import showerror, askyesno
-from threading import Timer
-from datetime import date, datetime
-from copy import copy
-import numpy as np
-import time
+from GEMStartup import startup
+
+from collections import deque
+from time import monotonic
 import os
 import re
-import requests
-import json
-
-import pdb
 
-from GEMIO import GEMDataFile, GEMAcquisition
-from GEMITC import ITC
+with startup.step("import tkinter"):
+    import tkinter
+    from tkinter import Tk, Label, Button, Entry, StringVar, Frame, OptionMenu, Text, Canvas
+    from tkinter.messagebox import showerror, askyesno
 
-def get_date():
-    return date.today().strftime("%Y%m%d")
+# GEMPyEnsemble (and requests) are only imported once a PyEnsemble session is
+# connected, see GroupSession
+with startup.step("import GEMIO (numpy, pyserial)"):
+    import numpy as np
+    from GEMIO import GEMAcquisition, NO_RESPONSE, load_constants
 
-def get_time():
-    return datetime.now().strftime("%H:%M:%S")
-
-def hours_since_trump():
-    now = time.time()
-    now_hr = now - np.fmod(now, 60**2)
-    now_str = "%06d" % int((now_hr - 1484910000) / (60**2))
-    return now_str
+with startup.step("import GEMITC, GEMSession"):
+    from GEMITC import ITC, coalesce_latest
+    import GEMSession
+    from GEMSession import get_time, hours_since_trump
 
 # ==============================================================================
 # Class of general utilities for constructing core aspects of GUI components
@@ -168,8 +161,13 @@ class ButtonGroup(Frame):
 
 # ==============================================================================
 # Class for viewing data received from Arduino
+#
+# show() may be called from any thread: it only appends lines to a ring buffer.
+# The Tk main loop drains that buffer every <refresh_ms> and appends just the
+# new lines to the Text widget (trimming old lines from the top), so the cost
+# of a message does not depend on how much is on screen.
 class DataViewer(GEMGUIComponent):
-    def __init__(self, parent):
+    def __init__(self, parent, max_lines=20, refresh_ms=50):
         GEMGUIComponent.__init__(self, parent, 1)
 
         self.set_title("Data Viewer")
@@ -182,8 +180,21 @@ class DataViewer(GEMGUIComponent):
         self.add_row("dv", dv)
 
         dv.bind("<Button-1>", self.callback)
-        self.nline = 0
-        self.buffer = ""
+
+        # ring buffer of lines waiting to be drawn, lines that would scroll off
+        # before the next refresh are discarded by the deque itself
+        self.max_lines = max_lines
+        self.lines = deque(maxlen=max_lines)
+
+        # number of lines currently in the Text widget (None until the
+        # greeting has been replaced by data)
+        self.nline = None
+
+        self.refresh_ms = refresh_ms
+        self.after(self.refresh_ms, self.refresh)
+
+        # number of tappers to show run statistics for
+        self.ntapper = parent["tappers_requested"]
 
     # --------------------------------------------------------------------------
     def callback(self, event):
@@ -192,31 +203,185 @@ class DataViewer(GEMGUIComponent):
         self.show("Click at [" + x + ", " + y + "]")
 
     # --------------------------------------------------------------------------
-    def draw(self):
-        # delete what is in data viewer now
-        self["dv"]["state"] = "normal"
-        self["dv"].delete(1.0, tkinter.END)
+    # Tk main loop only: append new lines to the widget
+    def refresh(self):
+        new = []
+        while self.lines:
+            new.append(self.lines.popleft())
 
-        # write to data viewer
-        self["dv"].insert("end", self.buffer)
-        self["dv"]["state"] = "disabled"
+        if new:
+            dv = self["dv"]
+            dv["state"] = "normal"
+
+            # the first data replaces the greeting
+            if self.nline is None:
+                dv.delete(1.0, tkinter.END)
+                self.nline = 0
+
+            dv.insert("end", "\n".join(new) + "\n")
+            self.nline += len(new)
+
+            # trim old lines from the top
+            if self.nline > self.max_lines:
+                dv.delete(1.0, "%d.0" % (self.nline - self.max_lines + 1))
+                self.nline = self.max_lines
+
+            dv["state"] = "disabled"
+
+        self.after(self.refresh_ms, self.refresh)
 
     # --------------------------------------------------------------------------
+    # thread safe: queue a message to be drawn on the next refresh
     def show(self, msg):
         if isinstance(msg, int):
             msg = "[REC]: %d bytes from arduino" % msg
 
-        if self.buffer and self.nline >= 20:
-            self.buffer = self.buffer[self.buffer.find('\n')+1:]
+        self.lines.extend(str(msg).rstrip("\n").split("\n")) # Python 3
+
+    # --------------------------------------------------------------------------
+    # show a GEMIO.RunStatistics snapshot as a single line, e.g.:
+    #   W12 adj-3 | 1:-14±9 2:+6±12(83%)
+    # a tapper that has not responded at all in the run is shown as "--"
+    def show_stats(self, stats):
+        msg = "W%d adj%+d |" % (stats["window_num"], stats["next_met_adjust"])
+
+        for k, t in enumerate(stats["tappers"][:self.ntapper]):
+            if t["n"] == 0:
+                msg += " %d:--" % (k+1)
+                continue
 
-        self.nline += 1
-        # self.buffer += msg
-        self.buffer += str(msg) # Python 3
+            msg += " %d:%+.0f" % (k+1, t["mean"])
+            if t["n"] > 1:
+                msg += "±%.0f" % t["sd"]
 
-        if not self.buffer.endswith('\n'):
-            self.buffer += '\n'
+            if t["response_rate"] < 1:
+                msg += "(%.0f%%)" % (100 * t["response_rate"])
 
-        self.draw()
+        self.show(msg)
+
+# ==============================================================================
+# Class for plotting asynchrony per tapper (top) and next_met_adjust (bottom)
+# live as windows are decoded
+#
+# add_windows() and reset() may be called from any thread, they only queue
+# work. The Tk main loop draws at most once every <refresh_ms>, and then only
+# the segments for new windows (the x axis spans the whole run, so nothing that
+# has already been drawn ever needs to move).
+class AsynchronyPlot(GEMGUIComponent):
+    COLORS = ["red", "blue", "green", "orange"]
+
+    def __init__(self, parent, width=360, height=320, refresh_ms=100):
+        GEMGUIComponent.__init__(self, parent, 1)
+        self.parent = parent
+
+        self.set_title("Synchronization")
+
+        self.width = width
+        self.height = height
+        self.margin = 30
+
+        cv = Canvas(self, width=width, height=height, borderwidth=2, background="white")
+        self.add_row("canvas", cv)
+
+        # queue of structured packet arrays waiting to be drawn, None marks the
+        # start of a new run
+        self.pending = deque()
+
+        self.refresh_ms = refresh_ms
+        self.after(self.refresh_ms, self.refresh)
+
+        self.ntapper = parent["tappers_requested"]
+        self.reset_axes()
+
+    # --------------------------------------------------------------------------
+    # thread safe: queue new windows (a list of structured packet arrays, as
+    # delivered to a batch ITC listener) / a new run
+    def add_windows(self, packet_arrays):
+        self.pending.extend(packet_arrays)
+
+    # NOTE: msg is just a placeholder for registering as an ITC listener
+    def reset(self, msg=""):
+        self.pending.append(None)
+
+    # --------------------------------------------------------------------------
+    # Tk main loop only: clear the plot and scale the axes for the current run
+    def reset_axes(self):
+        cv = self["canvas"]
+        cv.delete("all")
+
+        # one x position per window
+        self.nwin = max(self.parent["windows"], 2)
+
+        # asynchronies span +/- half an IOI, adjustments a quarter of an IOI
+        ioi = self.parent.presets.get("ioi", 500)
+        self.async_range = ioi / 2.0
+        self.adjust_range = ioi / 4.0
+
+        # panel extents: (top, bottom) in canvas coordinates
+        mid = self.height * 0.68
+        self.async_panel = (self.margin / 2, mid - self.margin / 2)
+        self.adjust_panel = (mid + self.margin / 2, self.height - self.margin / 2)
+
+        for (top, bottom), label in ((self.async_panel, "async (ms)"), (self.adjust_panel, "adjust (ms)")):
+            zero = (top + bottom) / 2.0
+            cv.create_rectangle(self.margin, top, self.width - 5, bottom, outline="gray")
+            cv.create_line(self.margin, zero, self.width - 5, zero, fill="gray", dash=(2, 2))
+            cv.create_text(self.margin - 2, top, text=label, anchor="nw", font=("Helvetica", 8))
+
+        for k in range(0, self.ntapper):
+            cv.create_text(self.margin + 40 * k, self.height - 2, text="T%d" % (k+1),
+                fill=self.COLORS[k], anchor="sw", font=("Helvetica", 8))
+
+        # last point drawn per tapper (None after a missed response) and for
+        # the adjustment trace
+        self.last = [None] * self.ntapper
+        self.last_adjust = None
+
+    # --------------------------------------------------------------------------
+    def to_canvas(self, window, value, panel, vrange):
+        top, bottom = panel
+        x = self.margin + (self.width - 5 - self.margin) * (window - 1) / (self.nwin - 1)
+        v = min(max(value / vrange, -1.0), 1.0)
+        y = (top + bottom) / 2.0 - v * (bottom - top) / 2.0
+        return x, y
+
+    # --------------------------------------------------------------------------
+    def draw_window(self, window_num, asynchronies, next_met_adjust):
+        cv = self["canvas"]
+
+        for k in range(0, self.ntapper):
+            if asynchronies[k] == NO_RESPONSE:
+                self.last[k] = None
+                continue
+
+            x, y = self.to_canvas(window_num, asynchronies[k], self.async_panel, self.async_range)
+            if self.last[k] is not None:
+                cv.create_line(*self.last[k], x, y, fill=self.COLORS[k])
+            cv.create_oval(x-2, y-2, x+2, y+2, fill=self.COLORS[k], outline="")
+            self.last[k] = (x, y)
+
+        x, y = self.to_canvas(window_num, next_met_adjust, self.adjust_panel, self.adjust_range)
+        if self.last_adjust is not None:
+            cv.create_line(*self.last_adjust, x, y, fill="black")
+        self.last_adjust = (x, y)
+
+    # --------------------------------------------------------------------------
+    # Tk main loop only: draw everything queued since the last refresh
+    def refresh(self):
+        while self.pending:
+            packets = self.pending.popleft()
+            if packets is None:
+                self.reset_axes()
+                continue
+
+            for window_num, asynchronies, next_met_adjust in zip(
+                packets["window_num"].tolist(),
+                packets["asynchronies"].tolist(),
+                packets["next_met_adjust"].tolist(),
+            ):
+                self.draw_window(window_num, asynchronies, next_met_adjust)
+
+        self.after(self.refresh_ms, self.refresh)
 
 # ==============================================================================
 # Class for controlling experiment and receiving data
@@ -249,6 +414,17 @@ class ExperimentControl(GEMGUIComponent):
 
         self.running = False
 
+        # a single Tk tick follows the acquisition's RunLifecycle, updating
+        # the countdown and ending the run once the acquisition is over
+        self.tick_ms = 200
+        self.after(self.tick_ms, self.tick)
+
+        # the next run, prepared in the background (see stage_run()), and
+        # staged runs waiting for their staging thread before their port is
+        # closed (see release_pending())
+        self.staged = None
+        self.releasing = []
+
     # --------------------------------------------------------------------------
     def check_user_input(self):
 
@@ -296,6 +472,9 @@ class ExperimentControl(GEMGUIComponent):
 
     # --------------------------------------------------------------------------
     def start_run(self):
+        # measured start latency is relative to the button press
+        start_requested = monotonic()
+
         if not self.check_user_input():
             return
 
@@ -325,45 +504,124 @@ class ExperimentControl(GEMGUIComponent):
         # Get current run number
         krun = self.nruns - self.counter
 
-        # Put our trial parameters into a dictionary
+        # Use the staged run if it is the one we are about to start
+        staged = self.staged
+        self.staged = None
+        self.parent.unregister_cleanup("staged_run")
+
+        if staged is None or staged["krun"] != krun:
+            if staged is not None:
+                self.releasing.append(staged["acq"])
+
+            staged = self.make_run(krun)
+
+        params = staged["params"]
+        params["start_time"] = get_time()
+
+        # Need to calculate and set the run_duration
+        self.parent.presets["run_duration"] = self.parent.presets["windows"] / params["tempo"] * 60.0
+        self.parent.get_ioi(params["tempo"])
+
+        self.launch_run(data_file, krun, params, staged["acq"], start_requested)
+
+        # If connected to PyEnsemble, send the parameters for this run using
+        # the prefetched trial form. This happens alongside the run, which is
+        # aborted if PyEnsemble does not accept the trial
+        if self.parent.use_pyensemble:
+            print('start_run: initializing and starting PyEnsemble trial')
+
+            def on_failure():
+                print('start_run: failed PyEnsemble initialization')
+                self.abort_run()
+
+            self.parent.group_session.initialize_trial(params,
+                lambda: None,
+                on_failure,
+                form_url=staged["form_url"],
+            )
+
+    # --------------------------------------------------------------------------
+    # build the parameters and acquisition thread for run <krun>
+    def make_run(self, krun):
+        # Put our trial parameters into a dictionary, start_time is filled in
+        # when the run starts
         params = {
                 "run_number": krun+1,
-                "start_time": get_time(),
+                "start_time": None,
                 "alpha": self.parent.alphas[krun],
                 "tempo": self.parent.tempos[krun],
             }
 
-        # Need to calculate and set the run_duration
-        self.parent.presets["run_duration"] = self.parent.presets["windows"] / params["tempo"] * 60.0
-        self.parent.get_ioi(params["tempo"])
+        # the actual IO thread, the data file is attached when the run starts
+        acq = GEMAcquisition(None,
+            self.parent.itc,
+            self.parent.presets,
+            params["alpha"],
+            params["tempo"],
+            self.parent.constants,
+        )
 
-        # If connected to PyEnsemble, send the parameters for this run
-        if self.parent.use_pyensemble:
+        return {"krun": krun, "params": params, "acq": acq, "form_url": None}
+
+    # --------------------------------------------------------------------------
+    # prepare the next run in the background: parameters, acquisition thread
+    # with the port open and tempo/alpha sent, and the PyEnsemble trial form.
+    # Only called once a run is over, the first run opens the port when Start
+    # Run is pressed
+    def stage_run(self):
+        if self.counter < 1:
+            return
 
-            # Initialize the trial in PyEnsemble. This can fail, so we need to wait for a response
-            print('start_run: initializing PyEnsemble trial')
-            initialized = self.parent.group_session.initialize_trial(params)
+        self.staged = self.make_run(self.nruns - self.counter)
+        self.staged["acq"].stage()
 
-            if not initialized:
-                print('start_run: failed PyEnsemble initialization')
-                self["ss"].enable(start_button_label)
-                return
+        self.parent.register_cleanup("staged_run", self.release_staged)
+
+        self.prefetch_trial_form()
+
+    # --------------------------------------------------------------------------
+    def prefetch_trial_form(self):
+        if not (self.parent.use_pyensemble and self.staged is not None):
+            return
+
+        if not self.parent.group_session.pyensemble["initialized_experiment"]:
+            return
+
+        staged = self.staged
+        self.parent.group_session.prefetch_trial_form(
+            lambda form_url: staged.update({"form_url": form_url}))
+
+    # --------------------------------------------------------------------------
+    # release the staged run without waiting for its staging thread on the Tk
+    # thread, tick() finishes the job. A run still staging when the app closes
+    # is left to its (daemon) thread
+    def release_staged(self):
+        if self.staged is not None:
+            self.releasing.append(self.staged["acq"])
+            self.staged = None
+
+        self.release_pending()
+
+        return True
+
+    # --------------------------------------------------------------------------
+    # close the ports of released runs whose staging thread has finished
+    def release_pending(self):
+        for acq in self.releasing:
+            if not acq.staging():
+                acq.release()
 
-            # Signal to PyEnsemble that we are in the running state
-            print('start_run: starting PyEnsemble trial')
-            self.parent.group_session.start_trial()
+        self.releasing = [acq for acq in self.releasing if acq.staging()]
 
+    # --------------------------------------------------------------------------
+    def launch_run(self, data_file, krun, params, acq, start_requested=None):
         # write run header
         print('start_run: writing header')
         data_file.write_header(krun, params)
 
-        # the actual IO thread
-        self.acq = GEMAcquisition(data_file,
-            self.parent.itc,
-            self.parent.presets,
-            self.parent.alphas[krun],
-            self.parent.tempos[krun],
-        )
+        self.acq = acq
+        self.acq.datafile = data_file
+        self.acq.start_requested = start_requested
 
         # make sure the itc is in the not-done state
         self.parent.itc.set_done(False)
@@ -371,8 +629,8 @@ class ExperimentControl(GEMGUIComponent):
         self.parent.unregister_cleanup("itc_thread")
         self.parent.register_cleanup("abort_run", self.close_request)
 
-        # begin countdown clock (in python)
-        self.time_remaining = self.parent["run_duration"]
+        # countdown starts from the nominal duration until windows arrive
+        self.time_remaining = self.acq.lifecycle.time_remaining()
 
         # starting thread is the last thing we should do
         self.acq.start()
@@ -389,15 +647,21 @@ class ExperimentControl(GEMGUIComponent):
     def abort_run(self):
         print("Calling itc.set_done()")
         self.parent.itc.set_done(True)
+
+        was_running = self.running
         self.clean_up()
 
+        # the aborted run is repeated, so stage it again. Without a run there
+        # is nothing to repeat and the port stays closed
+        if was_running and self.staged is None:
+            self.stage_run()
+
     # --------------------------------------------------------------------------
     def clean_up(self):
         print("clean_up: Asking IO thread to terminate")
         print(f"clean_up: Running: {self.running}")
         if self.running:
             self.acq.join()
-            self.timer.cancel()
             self.time_remaining = 0
             self["timeleft"].set_text("00:00")
             self.parent.unregister_cleanup("abort_run")
@@ -423,26 +687,46 @@ class ExperimentControl(GEMGUIComponent):
             if self.parent.use_pyensemble:
                 self.parent.group_session.exit_loop()
 
+        else:
+            self.stage_run()
+
+    # --------------------------------------------------------------------------
+    # a run that ended without its last window (stalled metronome, dead tapper
+    # box, IO error) does not count: like an abort the run is repeated
+    def fail_run(self, snap):
+        self.clean_up()
+
+        self.stage_run()
+
+        showerror("Run not completed",
+            f"The run ended ({snap['state']}) after {snap['window_num']} of {snap['windows']} windows. "
+            "Please check the equipment, the run will be repeated.")
+
     # --------------------------------------------------------------------------
     def format_time(self, t):
         mins, secs = divmod(int(np.floor(t)), 60)
         return "{:02d}:{:02d}".format(mins, secs)
 
     # --------------------------------------------------------------------------
-    # NOTE: msg is just a placeholder for registering as an ITC listener
-    def update_countdown(self, msg=""):
-        self["timeleft"].set_text(self.format_time(self.time_remaining))
-
-        if self.time_remaining > 0:
-            # timer only gets called every ~2 seconds, so decrement
-            # time_remaining by 2 and reset the timer
-            self.time_remaining -= 2
-            if self.time_remaining < 0:
-                self.time_remaining = 0
-            self.timer = Timer(2.0, self.update_countdown)
-            self.timer.start()
-        else:
-            self.end_run()
+    # countdown from the observed met_time/IOI, ends the run (on the Tk thread)
+    # once the acquisition has seen the last window or given up on a stall
+    def tick(self):
+        self.release_pending()
+
+        if self.running:
+            snap = self.acq.lifecycle.snapshot()
+
+            self.time_remaining = snap["time_remaining"]
+            self["timeleft"].set_text(self.format_time(self.time_remaining))
+
+            if not self.acq.is_alive():
+                print(f"tick: run {snap['state']} after {snap['window_num']} windows")
+                if snap["state"] == self.acq.lifecycle.FINISHED:
+                    self.end_run()
+                else:
+                    self.fail_run(snap)
+
+        self.after(self.tick_ms, self.tick)
 
 # ==============================================================================
 # Class to collect basic info required for GEM experiments
@@ -530,21 +814,22 @@ class GroupSession(GEMGUIComponent):
         # Create a dict for maintaining PyEnsemble information
         self.pyensemble = {"initialized_experiment": False}
 
-        # Define PyEnsemble endpoints
         self.pyensemble.update({
-            'urls': {
-                "connect": "/group/session/attach/experimenter/",
-                "update": "/group/session/participants/get/",
-                "init_experiment": "/experiments/gem_control/control/experiment/init/",
-                "end_experiment": "/experiments/gem_control/control/experiment/end/",
-                "init_trial": "/experiments/gem_control/control/trial/init/",
-                "start_trial": "/experiments/gem_control/control/trial/start/",
-                "end_trial": "/experiments/gem_control/control/trial/end/",
-                "exit_loop": "/experiments/gem_control/control/loop/exit/",
-            },
-            'verify_ssl': self.parent.presets.get('verify_ssl',True)
+            'verify_ssl': self.parent.presets.get('verify_ssl',True),
+
+            # (connect, read) timeout in seconds and number of retries used
+            # for every request
+            'timeout': self.parent.presets.get('pyensemble_timeout', (3.05, 10)),
+            'retries': self.parent.presets.get('pyensemble_retries', 3),
         })
 
+        # Background client, created when we connect. Requests run on the
+        # client's worker thread and results are delivered to callbacks by
+        # poll_client() on the Tk main loop
+        self.client = None
+        self.poll_ms = 50
+        self.after(self.poll_ms, self.poll_client)
+
         # Text box to enter the server URL
         self.add_row("server", TextBoxGroup(self, "Server:", 36))
         self["server"].set_text(self.parent["pyensemble_server"])
@@ -570,10 +855,37 @@ class GroupSession(GEMGUIComponent):
         self.add_row("dv", dv)
 
 
+    # --------------------------------------------------------------------------
+    # deliver the results of finished PyEnsemble requests (Tk main loop)
+    def poll_client(self):
+        if self.client is not None:
+            self.client.poll()
+
+        self.after(self.poll_ms, self.poll_client)
+
+    # --------------------------------------------------------------------------
+    def close_client(self):
+        if self.client is not None:
+            self.client.close()
+        return True
+
+    # --------------------------------------------------------------------------
+    # errback for failed requests: report PyEnsembleErrors as is, anything
+    # else (timeouts, connection errors) generically
+    def report_error(self, err):
+        from GEMPyEnsemble import PyEnsembleError
+
+        if isinstance(err, PyEnsembleError):
+            if err.detail:
+                print(err.detail)
+            showerror(err.title, err.msg)
+        else:
+            print(f"PyEnsemble request failed: {err}")
+            showerror("PyEnsemble Error", f"Request failed: {err}")
+
+    # --------------------------------------------------------------------------
     # Bind this session to the server
     def connect_server(self):
-        success = False
-
         # Get the requisite inputs
         server = self["server"].get_text()
         if not server:
@@ -591,96 +903,35 @@ class GroupSession(GEMGUIComponent):
             showerror("Missing password", "Please enter a PyEnsemble password")
             return
 
-        # Initialize a session object
-        s = requests.Session()
-
-        # Cache the session object
-        self.pyensemble.update({"session": s})
-
-        # Construct the server URL
-        url = self.pyensemble['server'] + self.pyensemble["urls"]["connect"]
-
-        # Construct our headers
-        headers = {'Referer': self.pyensemble['server']}
-
-        # Access the URL
-        # verify=os.path.join(os.environ['GEMROOT'],'GUI/development.crt')
-        resp = s.get(url, verify=self.pyensemble['verify_ssl'])
-        if not resp.ok:
-            showerror("PyEnsemble Error","Problem fetching form")
-
-        # Check whether it is a login form
-        p = re.compile('name="username"')
-        match = p.search(resp.text)
-
-        if match:
-            # Login and redirect to the target url
-            resp = s.post(
-                resp.url, 
-                {
-                'username': username, 
-                'password': password, 
-                'csrfmiddlewaretoken': s.cookies['csrftoken']
-                },
-                headers=headers,
-                verify=self.pyensemble['verify_ssl']
-            )
+        # Initialize a client (and its session object), requests is only
+        # loaded from here on
+        from GEMPyEnsemble import PyEnsembleClient
 
-        # Make sure the request succeeded
-        if not resp.ok:
-            test_str = "CSRF verification failed"
-            p = re.compile(test_str)
-            if p.search(resp.text):
-                showerror(f"Server code: {resp.status_code}", test_str)
-            else:
-                showerror("Alert", f"Server code: {resp.status_code}")
-
-        # Check for invalid username or password
-        test_str = "Please enter a correct username and password"
-        if re.compile(test_str).search(resp.text):
-            showerror("Invalid credentials", test_str)
-
-        # Check whether we are being prompted for the experimenter code
-        p = re.compile('name="experimenter_code"')
-        match = p.search(resp.text)
-
-        if match:
-            # Get the experimenter code from our value field
-            experimenter_code = self["experimenter_code"].get_text()
-
-            if not experimenter_code:
-                showerror("Missing Session Experimenter Code", "Please enter a session experimenter code")
-                return
+        if self.client is not None:
+            self.client.close()
 
-            # Connect to the group session
-            resp = s.post(url, {
-                'experimenter_code': experimenter_code, 
-                'csrfmiddlewaretoken': s.cookies['csrftoken']
-                },
-                headers=headers,
-                verify=self.pyensemble['verify_ssl']
-                )
+        self.client = PyEnsembleClient(server,
+            verify_ssl=self.pyensemble['verify_ssl'],
+            timeout=self.pyensemble['timeout'],
+            retries=self.pyensemble['retries'],
+        )
+        self.client.start()
+        self.parent.register_cleanup("pyensemble_client", self.close_client)
 
-            # Check for success
-            if resp.ok:
-                # Check to see whether we redirected to the status page
-                p = re.compile('id="groupsession_status"')
-                if p.search(resp.text):
-                    success = True
-                else:
-                    test_str = "Failed to retrieve ticket matching this code"
-                    if re.compile(test_str).search(resp.text):
-                        showerror("PyEnsemble Error","Invalid Experimenter Code")
+        # Don't allow a second attempt while this one is in flight
+        self['buttons'].disable("Connect")
 
-                    p = re.compile("The ticket matching this code has expired")
-                    if p.search(resp.text):
-                        showerror("PyEnsemble Error","Group session ticket has expired")
+        self.client.submit(self.client.attach, username, password,
+            self["experimenter_code"].get_text(),
+            callback=lambda result: self.on_connect(result, username),
+            errback=self.on_connect_error,
+        )
 
-        
-        if success:
-            # Disable the button
-            self['buttons'].disable("Connect")
+    def on_connect(self, result, username):
+        for title, msg in result["errors"]:
+            showerror(title, msg)
 
+        if result["success"]:
             # Update the experimenter field in the basic info
             if "experimenter" not in self.parent.basic_info.components.keys():
                 basic_info = self.parent.basic_info
@@ -693,31 +944,29 @@ class GroupSession(GEMGUIComponent):
 
             # Register our cleanup routine
             # self.parent.register_cleanup("pyensemble", self.end_experiment)
-            
-        else:
-            showerror("PyEnsemble Error","Unable to attach to group session")
-
-    def get_pyensemble_participant_list(self):
-        url = self.pyensemble["server"]+self.pyensemble["urls"]["update"]
-        
-        resp = self.pyensemble["session"].get(url, verify=self.pyensemble['verify_ssl'])
-        if not resp.ok:
-            showerror("PyEnsemble Error","Unable to update participant list")
-            return {}
 
-        # Extract our participant info
-        sinfo = resp.json()
+        else:
+            self['buttons'].enable("Connect")
 
-        return sinfo
+            if not result["incomplete"]:
+                showerror("PyEnsemble Error","Unable to attach to group session")
 
+    def on_connect_error(self, err):
+        self['buttons'].enable("Connect")
+        self.report_error(err)
 
     # Update our bound participant list
     def update(self):
+        self.client.submit(self.client.participants,
+            callback=self.on_update,
+            errback=self.report_error,
+        )
+
+    def on_update(self, sinfo):
 
         # Get our basic_info section
         basic_info = self.parent.basic_info
 
-        sinfo = self.get_pyensemble_participant_list()
         subjects = sinfo.keys()
         num_pyensemble_subs = len(subjects)
 
@@ -765,9 +1014,6 @@ class GroupSession(GEMGUIComponent):
         self.parent.basic_info.nsubj = num_gem_subs
 
         # Determine whether we can enable the initialization button
-        # Fetch our current PyEnsemble list for good measure
-        num_pyensemble_subs = len(self.get_pyensemble_participant_list().keys())
-
         if num_gem_subs and num_gem_subs == num_pyensemble_subs:
             self["buttons"].enable("Initialize")
         else:
@@ -775,20 +1021,8 @@ class GroupSession(GEMGUIComponent):
 
 
     def initialize_experiment(self):
-        # Construct our headers
-        headers = {'Referer': self.pyensemble['server']}
-
-        url = self.pyensemble["server"]+self.pyensemble["urls"]["init_experiment"]
-        
-        # Get our session object
-        s = self.pyensemble["session"]
-
-        # GET the form
-        resp = s.get(url, verify=self.pyensemble['verify_ssl'])
-
         # Fill out the form
-        data = {"csrfmiddlewaretoken": s.cookies["csrftoken"]}
-        data.update({
+        data = {
             "tappers_requested": self.parent.presets["tappers_requested"],
             # "metronome_alpha": self.parent.presets["metronome_alpha"],
             # "metronome_tempo": self.parent.presets["metronome_tempo"],
@@ -796,133 +1030,75 @@ class GroupSession(GEMGUIComponent):
             # "windows": self.parent.presets["windows"],
             "audio_feedback": self.parent.presets["audio_feedback"],
             "trial_generator": "fully_random"  ,
-            })
-
-        # POST the form
-        resp = s.post(resp.url, data, headers=headers, verify=self.pyensemble['verify_ssl'])
-
-        # Check for indications of an error in the response
-        p = re.compile("error")
+            }
 
-        if not resp.ok or p.search(resp.text):
-            showerror("PyEnsemble Error","Failed to initialize experiment!")
-            print(f"{resp.text}")
-            return
+        self.client.submit(self.client.init_experiment, data,
+            callback=self.on_initialize_experiment,
+            errback=self.report_error,
+        )
 
+    def on_initialize_experiment(self, result):
         self.pyensemble["initialized_experiment"] = True
 
         # Disable the Update and Initialize buttons
         self['buttons'].disable("Update")
         self['buttons'].disable("Initialize")
-        
-    def end_experiment(self):
-        url = self.pyensemble["server"]+self.pyensemble["urls"]["end_experiment"]
-
-        s = self.pyensemble["session"]
-        resp = s.get(url, verify=self.pyensemble['verify_ssl'])
-
-        return True
-
-
-    def initialize_trial(self, params):
-        # Construct our headers
-        headers = {'Referer': self.pyensemble['server']}
 
-        url = self.pyensemble["server"]+self.pyensemble["urls"]["init_trial"]
-
-        # Grab our session object
-        s = self.pyensemble["session"]     
-
-        # Get our form
-        resp = s.get(url, verify=self.pyensemble['verify_ssl'])
-
-        # Create our payload
-        data = {"csrfmiddlewaretoken": s.cookies["csrftoken"]}
-
-        data.update({"trial_num": params["run_number"]})
-
-        # Set our params
-        data.update({"params": json.dumps({
-                "alpha": params["alpha"],
-                "tempo": params["tempo"],
-                "trial_num": params["run_number"],
-                "start_time": params["start_time"],
-            })
-        })
-
-        # Post our form
-        resp = s.post(resp.url, data, headers=headers, verify=self.pyensemble['verify_ssl'])
-
-        p = re.compile("error")
-        if not resp.ok or p.search(resp.text):
-            err_msg = ""
-            if resp.text:
-                try:
-                    error_details = json.loads(resp.text)
-                    err_msg = json.dumps(error_details, indent=2)
-
-                except:
-                    err_msg = resp.text
-
-            print(err_msg)
-            showerror("PyEnsemble Error","Failed to initialize trial!")
-
-            return False
+    def end_experiment(self):
+        self.client.submit(self.client.end_experiment)
 
         return True
 
-    def start_trial(self):
-        url = self.pyensemble["server"]+self.pyensemble["urls"]["start_trial"]
-
-        # Grab our session object
-        s = self.pyensemble["session"]     
-
-        # Call our endpoint
-        resp = s.get(url, verify=self.pyensemble['verify_ssl'])
-
-        if not resp.ok:
-            showerror("PyEnsemble Error","Failed to start trial!")
+    # fetch the trial form ahead of time, <callback>(form_url) is called once
+    # it has arrived. Failures are not fatal, initialize_trial() fetches the
+    # form itself if it has no <form_url>
+    def prefetch_trial_form(self, callback):
+        def errback(err):
+            print(f"[WARN]: Failed to prefetch trial form - {err}")
+
+        self.client.submit(self.client.fetch_trial_form, callback=callback, errback=errback)
+
+    # initialize and start a trial, <on_success>() is called once PyEnsemble
+    # has accepted the trial, <on_failure>() if it has not
+    def initialize_trial(self, params, on_success, on_failure, form_url=None):
+        def errback(err):
+            self.report_error(err)
+            on_failure()
+
+        self.client.submit(self.client.init_and_start_trial, params, form_url,
+            callback=lambda result: on_success(),
+            errback=errback,
+        )
 
+    # like the original synchronous request, a failure to end the trial is
+    # not reported (no errback)
     def end_trial(self):
-        url = self.pyensemble["server"]+self.pyensemble["urls"]["end_trial"]
-
-        # Grab our session object
-        s = self.pyensemble["session"]     
-
-        # Call our endpoint
-        resp = s.get(url, verify=self.pyensemble['verify_ssl'])
+        self.client.submit(self.client.end_trial)
 
     def exit_loop(self):
-        # Delay sending of this
+        # Delay sending of this (on the client's thread, not the GUI's)
         delay = 2
         print(f'Exiting loop in {delay} seconds')
-        time.sleep(delay)
-
-        url = self.pyensemble["server"]+self.pyensemble["urls"]["exit_loop"]
-
-        # Grab our session object
-        s = self.pyensemble["session"]
 
-        # Call our endpoint
-        resp = s.get(url, verify=self.pyensemble['verify_ssl'])
-
-        if not resp.ok:
-            if resp.text:
-                print(resp.text)
-
-            showerror("PyEnsemble Error","Failed to set EXIT_LOOP")
+        self.client.submit(self.client.exit_loop, errback=self.report_error, delay=delay)
 
 # ==============================================================================
 # Build Main GUI
 # ==============================================================================
 class GEMGUI(Frame):
     def __init__(self, presets):
+        # print a breakdown of imports and initialization once the main loop
+        # is idle for the first time (see GEMStartup)
+        startup.enabled = startup.enabled or presets.get("profile_startup", False)
+        startup.mark("presets module")
+
         self.root = Tk()
         Frame.__init__(self, self.root)
 
         # Window title
         self.root.title("GEM Arduino acquisition system")
         self.grid()
+        startup.mark("Tk root")
 
         # Initialize a dictionary for registering cleanup actions
         self.cleanup = dict()
@@ -933,6 +1109,9 @@ class GEMGUI(Frame):
         # Initializing the Frame presets, gives us access to these directly as self[preset_key]
         self.presets = presets
 
+        # GEMConstants.h is parsed once and shared by every run
+        self.constants = load_constants(self.presets["hfile"])
+
         # Determine whether we are connecting with PyEnsemble
         self.use_pyensemble = self.presets.get("connect_pyensemble", False)
 
@@ -942,27 +1121,16 @@ class GEMGUI(Frame):
 
         # If we are not relying on an external source for run parameters, go ahead and initialize our trial order
         if self["params_src"] == "local":
-            #  Make sure that tempo is a list
-            if self["metronome_tempo"] and type(self["metronome_tempo"]) != list:
-                self.presets["metronome_tempo"] = [self.presets["metronome_tempo"]]
-            
-            # Figure out how many tempos/tempi we have
-            self.presets["num_tempos"] = len(self["metronome_tempo"])
-
-            fixed_run_order = self.presets.get("fixed_run_order", False)
-            if fixed_run_order:
-                # Have to assign tempos and alphas from our fixed order list
-                self.tempos = [run["tempo"] for run in fixed_run_order]
-                self.alphas = [run["alpha"] for run in fixed_run_order]
-
-            else:
-                # Create our list of runs defined by tempo, alpha combination
-                #self.randomize_alphas()
-                self.randomize_runs()
+            # Make sure that tempo is a list, then build the run order from
+            # the fixed order list or from shuffled tempo, alpha combinations
+            GEMSession.normalize_presets(self.presets)
+            self.tempos, self.alphas = GEMSession.run_order(self.presets)
 
             # Get the tempo of our first run
             self.presets["run_duration"] = self["windows"] / self.tempos[0] * 60.0
 
+        startup.mark("constants and run order")
+
         #
         # Add relevant modules to the GUI
         #
@@ -975,6 +1143,10 @@ class GEMGUI(Frame):
         self.exp_control = ExperimentControl(self)
         self.data_viewer = DataViewer(self)
 
+        # live plot, placed in the column to the right of the data viewer
+        self.async_plot = AsynchronyPlot(self)
+        self.async_plot.grid(row=self.data_viewer.grid_info()["row"], column=1, padx=15)
+        startup.mark("widgets")
 
         # thread for passing messages between IO thread and GUI, making this a
         # separate thread prevents the IO thread from getting blocked when
@@ -985,10 +1157,19 @@ class GEMGUI(Frame):
         self.itc.register_listener("data_viewer",
             self.data_viewer.show)
 
-        # register ExperimentControl.update_countdown method as a listener for
-        # run_start signals
+        # register the data_viewer to receive the running statistics that the
+        # IO thread publishes as each window's packet is decoded, only the
+        # latest snapshot matters so queued ones are replaced
+        self.itc.register_listener("run_stats",
+            self.data_viewer.show_stats)
+        self.itc.set_coalesce("run_stats", coalesce_latest)
+
+        # register the live plot for decoded windows (drained as a batch) and
+        # clear it when a new run starts
+        self.itc.register_listener("window_data",
+            self.async_plot.add_windows, batch=True)
         self.itc.register_listener("run_start",
-            self.exp_control.update_countdown)
+            self.async_plot.reset)
 
         print("starting ITC thread")
         self.itc.start()
@@ -996,9 +1177,16 @@ class GEMGUI(Frame):
         # make sure we close the ITC thread has a chance to clean up when the
         # app closes
         self.register_cleanup("itc_thread", self.itc.close)
+        startup.mark("ITC")
 
         self.root.protocol("WM_DELETE_WINDOW", self.on_close)
 
+        self.after_idle(self.report_startup)
+
+    def report_startup(self):
+        startup.mark("first draw")
+        startup.report("total since import")
+
     def __getitem__(self, key):
         if key in self.presets:
             return self.presets[key]
@@ -1020,22 +1208,8 @@ class GEMGUI(Frame):
         np.random.shuffle(self.alphas)
 
     def randomize_runs(self):
-        # Create a list of tuples that are all combinations of tempo and alpha
-        combos = []
-
-        for tempo in self["metronome_tempo"]:
-            for alpha in self["metronome_alpha"]:
-                combos.append({"tempo": tempo, "alpha": alpha})
-
-        # Create a list containing the desired number of repeats
-        runs = np.repeat(combos, self["repeats"])
-
-        # Shuffle the list
-        np.random.shuffle(runs)
-
-        # Read out the tempo and alpha values
-        self.tempos = [run["tempo"] for run in runs]
-        self.alphas = [run["alpha"] for run in runs]
+        self.tempos, self.alphas = GEMSession.randomize_runs(
+            self["metronome_tempo"], self["metronome_alpha"], self["repeats"])
 
     def on_close(self):
         doclose = True
@@ -1046,29 +1220,18 @@ class GEMGUI(Frame):
             self.root.destroy()
 
     def init_data_file(self):
-        data_dir = os.path.join(self["data_dir"], get_date())
-        if not os.path.exists(data_dir):
-            os.makedirs(data_dir)
-
-        d = copy(self.presets)
-        d["subject_ids"] = self.basic_info.get_subjids()
-        d["subject_info"] = self.basic_info.get_subinfo()
-        d["experimenter_id"] = self.basic_info.get_experimenter()
-        d["date"] = get_date()
-        d["time"] = get_time()
-
-        # create file name from presets and subids
-        filepath = os.path.join(data_dir, self["filename"] + "-" +
-            "_".join(d["subject_ids"]) + ".gdf")
+        filepath = GEMSession.data_file_path(self.presets, self.basic_info.get_subjids())
 
         if os.path.exists(filepath):
             if not askyesno("Overwrite file", "The data file already exists, overwrite?"):
                 return ""
 
-        nruns = len(self.alphas)
-
-        self.data_file = GEMDataFile(filepath, nruns)
-        self.data_file.write_file_header(d, nruns)
+        self.data_file = GEMSession.init_data_file(filepath, self.presets,
+            len(self.alphas),
+            self.basic_info.get_subjids(),
+            self.basic_info.get_subinfo(),
+            self.basic_info.get_experimenter(),
+        )
 
         return self.data_file
 
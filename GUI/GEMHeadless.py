@@ -0,0 +1,534 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+# Run a full GEM session from the command line, without Tk
+#   - takes the same presets dict as the GUI, read from a presets module
+#     (e.g. examples/gem_example.py, the module is imported but its __main__
+#     block is not run) or from a .json file
+#   - runs every run of the session in order (fixed_run_order or shuffled
+#     tempo x alpha combinations) into a single .gdf file
+#   - progress is written to stdout as JSON lines, one event per line, all
+#     other output goes to stderr
+#   - with --emulate the metronome is emulated in-process (see GEMEmulator),
+#     --speed runs such a session faster than real time (0: as fast as
+#     possible) and --verify checks the resulting .gdf against the schedule
+#     and the metronome's adaptation rule
+#   - multi-rig mode runs one session per metronome (rig) in parallel, each
+#     with its own acquisition, ITC and disk writer threads and its own data
+#     file (the rig name is appended to the file name). Rigs are given by
+#     metronome serial numbers (--rig-serials), presets["rigs"] or --rigs N
+#     (emulated or spoofed rigs). Events carry a "rig" field and a shared
+#     monitor reports per-rig throughput and framer counters
+#
+# Usage:
+#   python GEMHeadless.py <presets.py|presets.json> [--subjects ID ...]
+#       [--spoof | --emulate [--speed X]] [--verify] [--runs N] [--loops N]
+#       [--overwrite] [--rig-serials SN ... | --rigs N]
+'''
+
+import argparse
+import copy
+import json
+import math
+import os
+import runpy
+import signal
+import sys
+from contextlib import redirect_stdout
+from threading import Thread, Event, Lock
+from time import monotonic, process_time
+
+import numpy as np
+
+from GEMIO import GEMAcquisition, GEMDataFile, get_metronome_ports, load_constants
+from GEMIO import SystemClock, ScaledClock, VirtualClock
+from GEMITC import ITC, coalesce_latest
+import GEMSession
+from GEMSession import get_time, hours_since_trump
+from GEMMetronome import average_adjust, parse_float, tempo_to_ioi
+
+# ==============================================================================
+# load the presets dict from a presets module or a .json file
+def load_presets(path):
+    if path.endswith(".json"):
+        with open(path, "r") as io:
+            return json.load(io)
+
+    presets = runpy.run_path(path, run_name="gem_presets").get("presets")
+    if not isinstance(presets, dict):
+        raise ValueError("\"%s\" does not define a presets dict!" % path)
+
+    return presets
+
+# ==============================================================================
+# replace values that json cannot represent (NaN, inf) with None
+def json_safe(x):
+    if isinstance(x, dict):
+        return {k: json_safe(v) for k, v in x.items()}
+    elif isinstance(x, (list, tuple)):
+        return [json_safe(v) for v in x]
+    elif isinstance(x, float) and not math.isfinite(x):
+        return None
+    return x
+
+# ==============================================================================
+# returns an emit(event, **fields) function that writes JSON lines to <io>,
+# lines from several threads (rigs) are not interleaved
+def json_lines(io):
+    lock = Lock()
+
+    def emit(event, **fields):
+        fields = json_safe(fields)
+        fields["event"] = event
+        line = json.dumps(fields) + "\n"
+        with lock:
+            io.write(line)
+            io.flush()
+
+    return emit
+
+# ==============================================================================
+# run every run of a session with <presets>, progress events go to <emit>
+# in: <subject_ids>/<pad_ids> one per tapper, <nruns> limits the number of runs
+#     (default: all), <filepath> overrides the default data file path, <clock>
+#     is handed to each GEMAcquisition, <on_run>(acq) is called as each run's
+#     acquisition is created and setting <stop> aborts the session like Ctrl-C
+# out: (filepath, tempos, alphas) the data file and the schedule that was run
+def run_session(presets, subject_ids, pad_ids, experimenter_id, emit,
+        nruns=None, filepath=None, overwrite=False, progress_interval=1.0, clock=None,
+        on_run=None, stop=None):
+
+    GEMSession.normalize_presets(presets)
+    tempos, alphas = GEMSession.run_order(presets)
+    if nruns is not None:
+        tempos, alphas = tempos[:nruns], alphas[:nruns]
+
+    filepath = filepath or GEMSession.data_file_path(presets, subject_ids)
+    if os.path.exists(filepath) and not overwrite:
+        raise ValueError("Data file \"%s\" already exists!" % filepath)
+
+    constants = load_constants(presets["hfile"])
+
+    itc = ITC()
+    itc.register_listener("data_viewer", lambda msg: emit("message", text=str(msg)))
+
+    # run_stats snapshots are sent with every window, only the latest matters
+    itc.set_coalesce("run_stats", coalesce_latest)
+    itc.start()
+
+    subject_info = [{"id": i, "pad": p} for i, p in zip(subject_ids, pad_ids)]
+    data_file = GEMSession.init_data_file(filepath, presets, len(alphas),
+        subject_ids, subject_info, experimenter_id)
+
+    emit("session_start", file=filepath, nruns=len(alphas), tempos=tempos, alphas=alphas)
+
+    acq = None
+    try:
+        for krun in range(0, len(alphas)):
+            params = {
+                "run_number": krun+1,
+                "start_time": get_time(),
+                "alpha": alphas[krun],
+                "tempo": tempos[krun],
+            }
+
+            presets["run_duration"] = presets["windows"] / params["tempo"] * 60.0
+            presets["ioi"] = int(60000 / params["tempo"])
+
+            data_file.write_header(krun, params)
+
+            acq = GEMAcquisition(data_file, itc, presets, params["alpha"], params["tempo"], constants, clock)
+            if on_run is not None:
+                on_run(acq)
+
+            itc.set_done(False)
+            emit("run_start", **params)
+
+            acq.start()
+            while acq.is_alive():
+                acq.join(progress_interval)
+                if stop is not None and stop.is_set():
+                    itc.set_done(True)
+                elif acq.is_alive():
+                    emit("progress", run_number=krun+1, **acq.lifecycle.snapshot())
+
+            result = acq.result or {"state": "error"}
+            emit("run_end", run_number=krun+1, **result)
+
+            if stop is not None and stop.is_set():
+                raise KeyboardInterrupt
+
+    except KeyboardInterrupt:
+        itc.set_done(True)
+        if acq is not None:
+            acq.join()
+
+        emit("session_abort", file=filepath)
+        raise
+
+    finally:
+        itc.close()
+        data_file.close()
+
+    emit("session_end", file=filepath)
+
+    return filepath, tempos, alphas
+
+# ==============================================================================
+# check a recorded session against its schedule: run order, complete and
+# contiguous windows, next_met_adjust following the metronome's averaging rule
+# for the run's alpha, and met_time advancing by ioi + adjust
+# out: a list of problems (empty if the file is as expected)
+def verify_session(filepath, tempos, alphas, windows):
+    problems = []
+
+    df = GEMDataFile(filepath, mode="rb", memmap=True)
+    if df.nruns != len(alphas):
+        problems.append(f"{df.nruns} runs in file, expected {len(alphas)}")
+
+    nrecorded = 0
+    for krun, hdr, data in df.iter_runs():
+        nrecorded += 1
+        tag = f"run {krun+1}"
+
+        if krun >= len(alphas):
+            continue
+
+        if (hdr["alpha"], hdr["tempo"]) != (alphas[krun], tempos[krun]):
+            problems.append(f"{tag}: alpha/tempo {hdr['alpha']}/{hdr['tempo']}, expected {alphas[krun]}/{tempos[krun]}")
+
+        if data.size != windows:
+            problems.append(f"{tag}: {data.size} windows, expected {windows}")
+
+        if not np.array_equal(data["window_num"], np.arange(1, data.size+1)):
+            problems.append(f"{tag}: windows are not contiguous")
+
+        adjust = average_adjust(data["asynchronies"], parse_float(str(hdr["alpha"])))
+        if not np.array_equal(adjust, data["next_met_adjust"]):
+            problems.append(f"{tag}: next_met_adjust does not follow the averaging rule")
+
+        step = np.diff(data["met_time"].astype(np.int64))
+        expected = tempo_to_ioi(hdr["tempo"]) + data["next_met_adjust"][:-1].astype(np.int64)
+        if not np.array_equal(step, expected):
+            problems.append(f"{tag}: met_time does not advance by ioi + adjust")
+
+    if nrecorded != len(alphas):
+        problems.append(f"{nrecorded} runs recorded, expected {len(alphas)}")
+
+    df.close()
+
+    return problems
+
+# ==============================================================================
+# periodically emits a "monitor" event with each rig's throughput and framer
+# counters, summed over the rig's runs so far
+class RigMonitor(Thread):
+    FIELDS = ("bytes", "cpu", "packets", "dropped", "duplicated", "discarded_bytes")
+
+    def __init__(self, emit, interval=1.0):
+        Thread.__init__(self, daemon=True)
+
+        self.emit = emit
+        self.interval = interval
+
+        self.lock = Lock()
+        self.finished = {}
+        self.current = {}
+        self.last = {}
+        self.stopped = Event()
+
+    # --------------------------------------------------------------------------
+    def add_rig(self, rig):
+        with self.lock:
+            self.finished[rig] = dict.fromkeys(self.FIELDS, 0)
+            self.current[rig] = None
+            self.last[rig] = 0
+
+    # --------------------------------------------------------------------------
+    # <acq> is the rig's new acquisition, the previous one's counters are final
+    def attach(self, rig, acq):
+        with self.lock:
+            prev = self.current[rig]
+            if prev is not None:
+                for k, v in prev.counters().items():
+                    self.finished[rig][k] += v
+            self.current[rig] = acq
+
+    # --------------------------------------------------------------------------
+    def totals(self, rig):
+        d = dict(self.finished[rig])
+        if self.current[rig] is not None:
+            for k, v in self.current[rig].counters().items():
+                d[k] += v
+        return d
+
+    # --------------------------------------------------------------------------
+    def sample(self, dt):
+        rigs = {}
+        with self.lock:
+            for rig in self.finished:
+                d = self.totals(rig)
+                d["bytes_per_s"] = (d["bytes"] - self.last[rig]) / dt
+                self.last[rig] = d["bytes"]
+                rigs[rig] = d
+
+        return rigs
+
+    # --------------------------------------------------------------------------
+    def run(self):
+        t, cpu = monotonic(), process_time()
+        while True:
+            # one last sample with the final totals once stopped
+            stopped = self.stopped.wait(self.interval)
+
+            t_now, cpu_now = monotonic(), process_time()
+            dt = max(t_now - t, 1e-9)
+
+            self.emit("monitor", rigs=self.sample(dt), cpu_percent=100 * (cpu_now - cpu) / dt)
+            t, cpu = t_now, cpu_now
+
+            if stopped:
+                break
+
+    # --------------------------------------------------------------------------
+    def close(self):
+        self.stopped.set()
+        self.join()
+
+# ==============================================================================
+# rig specs for a multi-rig session
+# in: <serial_nums> metronome serial numbers (one rig each, ports are found
+#     with a single scan), otherwise presets["rigs"], otherwise <nrigs> copies
+#     of the presets' serial/emulator settings (for --spoof/--emulate)
+# out: list of dicts with a "name" and the preset keys that rig overrides
+def make_rigs(presets, serial_nums=None, nrigs=None):
+    if serial_nums:
+        ports = get_metronome_ports(serial_nums)
+        missing = [sn for sn, port in ports.items() if port is None]
+        if missing:
+            raise ValueError("No metronome found for serial number(s) %s" % ", ".join(missing))
+
+        return [{"name": sn, "serial": dict(presets["serial"], port=port, serial_num=sn)}
+            for sn, port in ports.items()]
+
+    if presets.get("rigs"):
+        return [dict(rig, name=rig.get("name", "rig%d" % (k+1))) for k, rig in enumerate(presets["rigs"])]
+
+    return [{"name": "rig%d" % (k+1)} for k in range(0, nrigs or 1)]
+
+# ==============================================================================
+# the presets of one rig: a copy of <presets> with the rig's overrides and the
+# rig name appended to the data file name. Emulated rigs get distinct seeds
+def rig_presets(presets, rig, krig):
+    p = copy.deepcopy(presets)
+    p.pop("rigs", None)
+
+    for k, v in rig.items():
+        if k == "name":
+            continue
+        p[k] = dict(p.get(k) or {}, **v) if isinstance(v, dict) else v
+
+    p["filename"] = p["filename"] + "-" + rig["name"]
+
+    if p.get("emulator") is not None and p["emulator"].get("seed") is not None and "emulator" not in rig:
+        p["emulator"]["seed"] += krig
+
+    return p
+
+# ==============================================================================
+# run a session on every rig in parallel, progress events carry a "rig" field
+# and <monitor> (a RigMonitor, optional) follows every rig's acquisitions
+# in: <clock_factory>() returns a clock for one rig (rigs must not share a
+#     VirtualClock)
+# out: dict mapping rig names to (filepath, tempos, alphas), or to the
+#      exception that ended that rig's session
+def run_rigs(presets, rigs, subject_ids, pad_ids, experimenter_id, emit,
+        suffix="", monitor=None, clock_factory=None, **kwargs):
+
+    stop = Event()
+    results = {}
+
+    def run_rig(krig, rig):
+        name = rig["name"]
+        p = rig_presets(presets, rig, krig)
+
+        def rig_emit(event, **fields):
+            emit(event, rig=name, **fields)
+
+        on_run = None
+        if monitor is not None:
+            on_run = lambda acq: monitor.attach(name, acq)
+
+        try:
+            filepath = GEMSession.data_file_path(p, subject_ids)
+            filepath = filepath[:-len(".gdf")] + suffix + ".gdf"
+
+            results[name] = run_session(p, subject_ids, pad_ids, experimenter_id, rig_emit,
+                filepath=filepath,
+                clock=clock_factory() if clock_factory else None,
+                on_run=on_run,
+                stop=stop,
+                **kwargs)
+
+        except BaseException as err:
+            results[name] = err
+            if not isinstance(err, KeyboardInterrupt):
+                rig_emit("error", text=str(err))
+
+    threads = []
+    for krig, rig in enumerate(rigs):
+        if monitor is not None:
+            monitor.add_rig(rig["name"])
+        threads.append(Thread(target=run_rig, args=(krig, rig), name="rig-" + rig["name"]))
+
+    for t in threads:
+        t.start()
+
+    try:
+        for t in threads:
+            while t.is_alive():
+                t.join(0.5)
+
+    except KeyboardInterrupt:
+        stop.set()
+        for t in threads:
+            t.join()
+        raise
+
+    return {rig["name"]: results[rig["name"]] for rig in rigs}
+
+# ==============================================================================
+def main():
+    parser = argparse.ArgumentParser(description="Run a GEM session without the GUI")
+    parser.add_argument("presets", help="presets module (.py) or .json file")
+    parser.add_argument("--subjects", nargs="+", default=None,
+        help="subject IDs, one per tapper (default: <session id>hl<k>)")
+    parser.add_argument("--pads", nargs="+", default=None,
+        help="pad numbers, one per tapper (default: 1 2 ...)")
+    parser.add_argument("--experimenter", default="headless",
+        help="experimenter ID (default: headless)")
+    parser.add_argument("--data-dir", default=None,
+        help="override the presets' data_dir")
+    parser.add_argument("--spoof", action="store_true",
+        help="use the spoof serial device instead of the metronome")
+    parser.add_argument("--emulate", action="store_true",
+        help="use an in-process metronome emulator (options from presets[\"emulator\"])")
+    parser.add_argument("--speed", type=float, default=None,
+        help="run the emulator X times faster than real time, 0 for as fast as possible (implies --emulate)")
+    parser.add_argument("--verify", action="store_true",
+        help="check each data file against the schedule once the session is done")
+    parser.add_argument("--runs", type=int, default=None,
+        help="only run the first N runs of the session")
+    parser.add_argument("--loops", type=int, default=1,
+        help="repeat the whole session N times, one data file each (soak tests)")
+    parser.add_argument("--overwrite", action="store_true",
+        help="overwrite existing data files")
+    parser.add_argument("--progress-interval", type=float, default=1.0,
+        help="seconds between progress events (default: 1)")
+    parser.add_argument("--rig-serials", nargs="+", default=None,
+        help="run one rig per metronome serial number, in parallel")
+    parser.add_argument("--rigs", type=int, default=None,
+        help="run N rigs in parallel (with --spoof or --emulate)")
+    parser.add_argument("--monitor-interval", type=float, default=1.0,
+        help="seconds between multi-rig monitor events (default: 1)")
+
+    args = parser.parse_args()
+
+    # keep stdout for the JSON lines
+    emit = json_lines(sys.stdout)
+
+    with redirect_stdout(sys.stderr):
+        presets = load_presets(args.presets)
+
+        if args.data_dir:
+            presets["data_dir"] = args.data_dir
+        if args.spoof:
+            presets["spoof_mode"] = True
+
+        if args.emulate or args.speed is not None:
+            presets["emulator"] = presets.get("emulator", {})
+
+        # one clock per rig, rigs must not share a VirtualClock
+        def make_clock():
+            if args.speed == 0:
+                return VirtualClock()
+            elif args.speed is not None:
+                return ScaledClock(args.speed)
+            return SystemClock()
+
+        ntapper = presets["tappers_requested"]
+        hst = hours_since_trump()
+
+        subject_ids = args.subjects or [hst + "hl" + str(k+1) for k in range(0, ntapper)]
+        pad_ids = args.pads or [str(k+1) for k in range(0, ntapper)]
+        if len(subject_ids) != ntapper or len(pad_ids) != ntapper:
+            parser.error(f"need {ntapper} subject IDs and pad numbers")
+
+        # SIGTERM (e.g. from a soak test harness) aborts like Ctrl-C
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+        multirig = bool(args.rig_serials or args.rigs or presets.get("rigs"))
+        monitor = None
+
+        failed = False
+        try:
+            if multirig:
+                rigs = make_rigs(presets, args.rig_serials, args.rigs)
+                emit("rigs", rigs=[r["name"] for r in rigs])
+
+                monitor = RigMonitor(emit, args.monitor_interval)
+                monitor.start()
+
+            for loop in range(0, args.loops):
+                suffix = "-loop" + str(loop+1) if args.loops > 1 else ""
+
+                options = {
+                    "nruns": args.runs,
+                    "overwrite": args.overwrite,
+                    "progress_interval": args.progress_interval,
+                }
+
+                if multirig:
+                    results = run_rigs(presets, rigs, subject_ids, pad_ids, args.experimenter, emit,
+                        suffix=suffix, monitor=monitor, clock_factory=make_clock, **options)
+                else:
+                    filepath = None
+                    if suffix:
+                        filepath = GEMSession.data_file_path(presets, subject_ids)
+                        filepath = filepath[:-len(".gdf")] + suffix + ".gdf"
+
+                    results = {None: run_session(presets, subject_ids, pad_ids, args.experimenter, emit,
+                        filepath=filepath, clock=make_clock(), **options)}
+
+                for rig, result in results.items():
+                    tag = {"rig": rig} if rig is not None else {}
+
+                    if isinstance(result, KeyboardInterrupt):
+                        raise result
+                    elif isinstance(result, BaseException):
+                        failed = True
+                        continue
+
+                    if args.verify:
+                        filepath, tempos, alphas = result
+                        problems = verify_session(filepath, tempos, alphas, presets["windows"])
+                        emit("verify", file=filepath, ok=not problems, problems=problems, **tag)
+                        failed = failed or bool(problems)
+
+        except KeyboardInterrupt:
+            sys.exit(130)
+
+        except ValueError as err:
+            emit("error", text=str(err))
+            sys.exit(1)
+
+        finally:
+            if monitor is not None:
+                monitor.close()
+
+        if failed:
+            sys.exit(2)
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,33 @@
-from threading import Thread
-from time import time, sleep
+from threading import Thread, Condition, Lock
+from time import time, sleep, thread_time, monotonic
+from collections import deque
 import serial
 import json
 import re
+import os
+import mmap
 import codecs, struct
+import hashlib
 
-import serial.tools.list_ports
+import numpy as np
 
 GEM_MAX_TAPPERS = 4 # should match value specified in GEM/GEMConstants.h
 
+# longest time (seconds) a blocking serial read waits for data during a run,
+# this is the upper bound on how long the IO thread takes to notice an abort
+GEM_ABORT_LATENCY = 0.050
+
+# ==============================================================================
+# numpy record layout of a single GEM_DTP_RAW packet (see GEM_dtp.md), the
+# fields are packed so the itemsize matches GEM_PACKET_SIZE (17 bytes)
+GEM_PACKET_DTYPE = np.dtype([
+    ("dtp_id", "u1"),
+    ("window_num", "<u2"),
+    ("met_time", "<u4"),
+    ("asynchronies", "<i2", (GEM_MAX_TAPPERS,)),
+    ("next_met_adjust", "<i2"),
+])
+
 # ==============================================================================
 # convert a python int to a bytestring
 def uint64(n):
@@ -24,6 +43,35 @@ def parse_uint(val):
         v = val
     return v
 
+# ==============================================================================
+# decode a block of raw packets into a structured array (see GEM_PACKET_DTYPE)
+# in: <buf> a bytes-like object, trailing partial packets are ignored
+# out: a numpy structured array with one record per window
+def decode_packets(buf):
+    n = len(buf) // GEM_PACKET_DTYPE.itemsize
+    return np.frombuffer(buf, dtype=GEM_PACKET_DTYPE, count=n)
+
+# ==============================================================================
+# convert a structured packet array into the list-of-dicts form returned by
+# GEMDataFile.read_run_data
+def packets_to_dicts(packets):
+    return [
+        {
+            "dtp_id": bytes([dtp_id]),
+            "window_num": window_num,
+            "met_time": met_time,
+            "asynchronies": asynchronies,
+            "next_met_adjust": next_met_adjust,
+        }
+        for dtp_id, window_num, met_time, asynchronies, next_met_adjust in zip(
+            packets["dtp_id"].tolist(),
+            packets["window_num"].tolist(),
+            packets["met_time"].tolist(),
+            packets["asynchronies"].tolist(),
+            packets["next_met_adjust"].tolist(),
+        )
+    ]
+
 # ==============================================================================
 # remove c/c++ style comments from a string
 def remove_comments(src):
@@ -39,12 +87,96 @@ def parse_constants(hfile):
         src = remove_comments(io.read())
 
     d = dict()
-    pattern = re.compile(r"\#define\s+(?P<name>\w+)\s+(?P<val>\w+)")
+    pattern = re.compile(r"\#define\s+(?P<name>\w+)\s+(?P<val>-?\w+)")
     for match in pattern.finditer(src):
         d[match.group("name")] = parse_uint(match.group("val"))
 
     return d
 
+# ==============================================================================
+# cached constants: parsed headers keyed on (path, mtime, size), and the
+# frozen module generated by freeze_constants
+GEM_CONSTANTS_HFILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "GEM", "GEMConstants.h")
+GEM_CONSTANTS_MODULE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "GEMConstants.py")
+
+_constants_cache = {}
+
+# ==============================================================================
+def header_digest(hfile):
+    with open(hfile, "rb") as io:
+        return hashlib.sha1(io.read()).hexdigest()
+
+# ==============================================================================
+# the constants of the frozen module if it was generated from a header with
+# the same contents as <hfile>, otherwise None
+def frozen_constants(hfile):
+    try:
+        import GEMConstants
+    except ImportError:
+        return None
+
+    if GEMConstants.SOURCE_DIGEST != header_digest(hfile):
+        return None
+
+    return GEMConstants.CONSTANTS
+
+# ==============================================================================
+# parse_constants with caching: the header is only parsed again if its mtime
+# or size changed, and not at all if the frozen module matches it
+# out: a copy of the constants dict (callers are free to modify it)
+def load_constants(hfile):
+    path = os.path.realpath(hfile)
+    st = os.stat(path)
+    key = (st.st_mtime_ns, st.st_size)
+
+    cached = _constants_cache.get(path)
+    if cached is None or cached[0] != key:
+        constants = frozen_constants(path)
+        if constants is None:
+            constants = parse_constants(path)
+        cached = _constants_cache[path] = (key, constants)
+
+    return dict(cached[1])
+
+# ==============================================================================
+# the value of define <name> in the constants header, from the frozen module
+# if the header is not available
+def header_constant(name, hfile=GEM_CONSTANTS_HFILE):
+    try:
+        constants = load_constants(hfile)
+    except OSError:
+        from GEMConstants import CONSTANTS as constants
+
+    return constants[name]
+
+# marks a tapper that did not respond in a window
+NO_RESPONSE = int(header_constant("NO_RESPONSE"))
+
+# ==============================================================================
+# write a python module with the constants of <hfile>: one module level name
+# per define plus a CONSTANTS dict with the same values parse_constants returns
+# (bytes for hex codes, strings otherwise). SOURCE_DIGEST ties the module to
+# the header's contents, load_constants ignores it once the header changes
+def freeze_constants(hfile=GEM_CONSTANTS_HFILE, outpath=GEM_CONSTANTS_MODULE):
+    constants = parse_constants(hfile)
+
+    lines = [
+        "# Generated from GEM/GEMConstants.h by GEMIO.freeze_constants, do not edit.",
+        "# Regenerate after changing the header with: python GEMIO.py",
+        "",
+        "SOURCE_DIGEST = %r" % header_digest(hfile),
+        "",
+    ]
+    lines += ["%s = %r" % (name, val) for name, val in constants.items()]
+    lines += ["", "CONSTANTS = {"]
+    lines += ["    %r: %s," % (name, name) for name in constants]
+    lines += ["}", ""]
+
+    with open(outpath, "w") as io:
+        io.write("\n".join(lines))
+
+    print(f"[INFO]: Wrote {len(constants)} constants to {outpath}")
+
 # ==============================================================================
 # Function to get the relevant USB port
 #
@@ -54,6 +186,9 @@ def parse_constants(hfile):
 # ID of "Generic CDC".
 
 def get_metronome_port(usb_adapter="Generic CDC", serial_num=None):
+    # imported here, the port scan is only needed when a port is opened
+    import serial.tools.list_ports
+
     ports = list(serial.tools.list_ports.comports())
     for p in ports:
         # If we've specified the serial number we are looking for, use that
@@ -68,13 +203,49 @@ def get_metronome_port(usb_adapter="Generic CDC", serial_num=None):
                 pid = str(p)
                 return pid.split(' ')[0]
 
+# ==============================================================================
+# ports of several metronomes with a single scan (for multi-rig sessions)
+# in: <serial_nums> list of metronome Arduino serial numbers
+# out: dict mapping each serial number to its port (None if not connected)
+def get_metronome_ports(serial_nums):
+    import serial.tools.list_ports
+
+    ports = {sn: None for sn in serial_nums}
+    for p in serial.tools.list_ports.comports():
+        for sn in serial_nums:
+            if ports[sn] is None and re.search(r'SER='+sn, p.hwid):
+                ports[sn] = p.device
+
+    return ports
+
+# ==============================================================================
+# the serial port to open for presets["serial"] <ifo>: ifo["port"] if given,
+# otherwise the port of the metronome with ifo["serial_num"] (or the first
+# ifo["usb_adapter"] device), which is then stored as ifo["port"] so the ports
+# are only scanned once per session
+def resolve_port(ifo):
+    if not ifo.get("port"):
+        port = get_metronome_port(ifo.get("usb_adapter", "Generic CDC"), ifo.get("serial_num"))
+        if port is None:
+            raise ValueError("No metronome found (serial number %s)" % ifo.get("serial_num"))
+
+        ifo["port"] = port
+
+    return ifo["port"]
 
 # ==============================================================================
 # class to wrap common data file IO operations (writing headers etc.)
 class GEMDataFile:
-    def __init__(self, filepath, nrun, mode="wb+"):
+    # NOTE: with <memmap> True the file is opened read-only and mapped into
+    # memory, only the file header and run offset table are read on open, run
+    # data is paged in on demand by read_run_array / read_run_data
+    def __init__(self, filepath, nrun=0, mode="wb+", memmap=False):
         self.filepath = filepath
 
+        if memmap and mode != "rb":
+            raise ValueError("memory-mapped data files must be opened with mode \"rb\"")
+
+        self.mode = mode
         self._io = open(filepath, mode)
         self.is_open = True
         self.ptr = 0
@@ -89,6 +260,13 @@ class GEMDataFile:
 
         self.current_run = 0
 
+        self.memmap = memmap
+        self._map = None
+
+        if self.memmap:
+            self._map = mmap.mmap(self._io.fileno(), 0, access=mmap.ACCESS_READ)
+            self.read_file_header()
+
     def close(self):
         if self.is_open:
             self.ptr = self._io.tell()
@@ -96,9 +274,14 @@ class GEMDataFile:
             self._io = None
             self.is_open = False
 
+        # NOTE: arrays returned by read_run_array are views into the map, so we
+        # only drop our reference here and let the map close once the last
+        # view is garbage collected
+        self._map = None
+
     def reopen(self):
         if not self.is_open:
-            self._io = open(self.filepath, "r+b")
+            self._io = open(self.filepath, "rb" if self.mode == "rb" else "r+b")
             self._io.seek(self.ptr, 0)
             self.is_open = True
 
@@ -148,15 +331,27 @@ class GEMDataFile:
         self._io.write(uint64(offset))
         self._io.seek(ptr, 0)
 
-    def read_header(self, offset):
+    def read_bytes(self, offset, n):
+        if self._map is not None:
+            return self._map[offset:offset+n]
+
         self.reopen()
         self._io.seek(offset, 0)
+        return self._io.read(n)
+
+    def file_size(self):
+        if self._map is not None:
+            return len(self._map)
 
+        self.reopen()
+        return os.fstat(self._io.fileno()).st_size
+
+    def read_header(self, offset):
         # Read the header length, stored as a uint64
-        nel_uint64 = int.from_bytes(self._io.read(8),"little")
+        nel_uint64 = int.from_bytes(self.read_bytes(offset, 8),"little")
 
         # Read the header
-        hdr_str = self._io.read(nel_uint64)
+        hdr_str = self.read_bytes(offset+8, nel_uint64)
 
         # Convert to a dict
         hdr_dict = json.loads(hdr_str)
@@ -168,17 +363,25 @@ class GEMDataFile:
         self.file_hdr = self.read_header(offset)
 
         # Determine the number of runs
-        if "nruns" not in self.file_hdr.keys():
+        if "nruns" in self.file_hdr.keys():
+            self.nruns = self.file_hdr["nruns"]
+
+        elif self.file_hdr.get("fixed_run_order", False):
+            self.nruns = len(self.file_hdr["fixed_run_order"])
+
+        else:
             self.nruns = len(self.file_hdr["metronome_alpha"])*len(self.file_hdr["metronome_tempo"])*self.file_hdr["repeats"]
 
         # Read the run offset information
-        self.idx_map_offset = self._io.tell()
+        self.idx_map_offset = offset + 8 + int.from_bytes(self.read_bytes(offset, 8), "little")
+
+        idx_map = self.read_bytes(self.idx_map_offset, 8*self.nruns)
 
         self.run_offsets = []
         self.run_info = []
 
         for r in range(0, self.nruns):
-            self.run_offsets.append(int.from_bytes(self._io.read(8), "little"))
+            self.run_offsets.append(int.from_bytes(idx_map[8*r:8*(r+1)], "little"))
             self.run_info.append({})
 
 
@@ -194,40 +397,44 @@ class GEMDataFile:
 
         return hdr_dict
 
-    def read_run_data(self, krun):
-        run_data = []
+    def run_data_bounds(self, krun):
+        offset = self.run_offsets[krun]
 
-        # Seek to the start of the run
-        self._io.seek(self.run_offsets[krun], 0)
+        # Runs that were never started have a 0 offset in the idx_map
+        if offset <= 0:
+            return 0, 0
 
-        # Read the header length, stored as a uint64
-        nel_uint64 = int.from_bytes(self._io.read(8),"little")
+        # The data block starts immediately after the run header
+        start = offset + 8 + int.from_bytes(self.read_bytes(offset, 8), "little")
+
+        # An aborted run may hold fewer than <windows> packets, so never read
+        # past the start of the next run (or the end of the file)
+        end = start + self.file_hdr['windows'] * GEM_PACKET_DTYPE.itemsize
+        for o in self.run_offsets:
+            if offset < o < end:
+                end = o
 
-        # Seek to the start of the run data
-        self._io.seek(self.run_offsets[krun]+8+nel_uint64, 0)
+        return start, min(end, self.file_size())
 
-        # Iterate over windows
-        for window_idx in range(0, self.file_hdr['windows']):
-            window_data = {}
+    def read_packets(self, start, n):
+        if self._map is not None:
+            # Zero-copy view onto only the requested pages
+            return np.frombuffer(self._map, dtype=GEM_PACKET_DTYPE, count=n, offset=start)
 
-            # Get the packet content identifier
-            window_data['dtp_id'] = self._io.read(1)
+        return decode_packets(self.read_bytes(start, n * GEM_PACKET_DTYPE.itemsize))
 
-            # Get the serial number of the metronome tone
-            window_data['window_num'] = int.from_bytes(self._io.read(2), "little")
+    def read_run_array(self, krun):
+        start, end = self.run_data_bounds(krun)
 
-            # Get the time of the metronome tone
-            window_data['met_time'] = int.from_bytes(self._io.read(4), "little")
+        # Read the whole data block for this run in one go
+        run_data = self.read_packets(start, (end - start) // GEM_PACKET_DTYPE.itemsize)
 
-            # Get the tapper asynchronies
-            window_data['asynchronies'] = []
-            for tapper in range(0, GEM_MAX_TAPPERS):
-                window_data['asynchronies'].append(int.from_bytes(self._io.read(2), "little", signed=True))
+        self.run_info[krun]['array'] = run_data
 
-            # Read the nex metronome adjustment
-            window_data['next_met_adjust'] = int.from_bytes(self._io.read(2), "little", signed=True)
+        return run_data
 
-            run_data.append(window_data)
+    def read_run_data(self, krun):
+        run_data = packets_to_dicts(self.read_run_array(krun))
 
         self.run_info[krun]['data'] = run_data
 
@@ -249,22 +456,470 @@ class GEMDataFile:
         self.close()
 
 
+    # --------------------------------------------------------------------------
+    # generator over the runs in the file, yields (krun, hdr, data) for each run
+    # that was recorded. Unlike read_file nothing is cached in <run_info>, so
+    # memory use is bounded by the size of a single run
+    def iter_runs(self):
+        if not self.file_hdr:
+            self.read_file_header()
+
+        for krun in range(0, self.nruns):
+            start, end = self.run_data_bounds(krun)
+            if end <= start:
+                continue
+
+            hdr = self.read_header(self.run_offsets[krun])
+            data = self.read_packets(start, (end - start) // GEM_PACKET_DTYPE.itemsize)
+
+            yield krun, hdr, data
+
+    # --------------------------------------------------------------------------
+    # generator over the windows of run <krun>, yields one packet record per
+    # window while reading at most <chunk> windows from the file at a time
+    def iter_windows(self, krun, chunk=256):
+        if not self.file_hdr:
+            self.read_file_header()
+
+        start, end = self.run_data_bounds(krun)
+        nwin = (end - start) // GEM_PACKET_DTYPE.itemsize
+
+        for kwin in range(0, nwin, chunk):
+            n = min(chunk, nwin - kwin)
+            yield from self.read_packets(start + kwin * GEM_PACKET_DTYPE.itemsize, n)
+
+# ==============================================================================
+# streaming framer for the metronome's data stream: assembles GEM_PACKET_SIZE
+# packets across arbitrary chunk boundaries, resyncs on the GEM_DTP_RAW marker
+# after garbage bytes and checks window_num continuity
+#
+# A packet whose window_num is the one we expect is accepted once the byte
+# after it is a marker, so a truncated packet filled up by the start of the
+# next one is not taken as valid. Any other window_num is only trusted once
+# the whole following packet confirms it (marker present and window_num + 1).
+# Otherwise the marker is assumed to be a stray 0xf0 byte and we resync from
+# the next byte. Confirmed windows behind the expected one are counted as
+# duplicates and discarded, confirmed windows ahead of it count the windows in
+# between as dropped, windows past the last one of the run are discarded. The
+# metronome keeps sending windows until it is stopped, so the last window is
+# confirmed by the window after it, or by flush_final() once the stream has
+# gone quiet.
+class PacketFramer:
+    def __init__(self, last_window, dtp_id=0xf0, first_window=1):
+        self.size = GEM_PACKET_DTYPE.itemsize
+        self.dtp_id = dtp_id
+
+        # window_num of the final packet of the run
+        self.last_window = last_window
+
+        # window_num we expect to see next
+        self.expected_window = first_window
+
+        self.buffer = bytearray()
+
+        # counters
+        self.packets = 0
+        self.dropped = 0
+        self.duplicated = 0
+        self.discarded_bytes = 0
+
+    # --------------------------------------------------------------------------
+    def window_at(self, i):
+        return int.from_bytes(self.buffer[i+1:i+3], "little")
+
+    # --------------------------------------------------------------------------
+    # add received bytes, returns the bytes of all newly accepted packets (a
+    # multiple of the packet size, decode with decode_packets)
+    def feed(self, data):
+        self.buffer += data
+
+        out = bytearray()
+        buf = self.buffer
+        i = 0
+
+        while len(buf) - i >= self.size:
+            if buf[i] != self.dtp_id:
+                # skip garbage up to the next packet marker
+                j = buf.find(self.dtp_id, i+1)
+                if j < 0:
+                    j = len(buf)
+                self.discarded_bytes += j - i
+                i = j
+                continue
+
+            window = self.window_at(i)
+
+            if window == self.expected_window:
+                # the next packet must start right after this one
+                if len(buf) - i < self.size + 1:
+                    break
+
+                if buf[i + self.size] != self.dtp_id:
+                    self.discarded_bytes += 1
+                    i += 1
+                    continue
+
+            else:
+                # need the following packet to confirm we are in sync
+                if len(buf) - i < 2 * self.size:
+                    break
+
+                k = i + self.size
+                if buf[k] != self.dtp_id or self.window_at(k) != window + 1:
+                    self.discarded_bytes += 1
+                    i += 1
+                    continue
+
+            if window < self.expected_window:
+                self.duplicated += 1
+
+            elif window > self.last_window:
+                self.discarded_bytes += self.size
+
+            else:
+                self.dropped += window - self.expected_window
+                self.expected_window = window + 1
+                self.packets += 1
+                out += buf[i:i+self.size]
+
+            i += self.size
+
+        del buf[:i]
+
+        return bytes(out)
+
+    # --------------------------------------------------------------------------
+    # accept the run's last window when no following packet can confirm it
+    # (the stream went quiet): only if the buffer holds exactly one whole
+    # packet with the marker and the last window_num
+    # out: the packet's bytes, or b"" if there is nothing to accept
+    def flush_final(self):
+        buf = self.buffer
+        if (len(buf) != self.size or buf[0] != self.dtp_id
+                or self.window_at(0) != self.last_window
+                or self.expected_window > self.last_window):
+            return b""
+
+        self.dropped += self.last_window - self.expected_window
+        self.expected_window = self.last_window + 1
+        self.packets += 1
+
+        out = bytes(buf)
+        del buf[:]
+
+        return out
+
+    # --------------------------------------------------------------------------
+    # true once the final window of the run has been received
+    def complete(self):
+        return self.expected_window > self.last_window
+
+    # --------------------------------------------------------------------------
+    def counters(self):
+        return {
+            "packets": self.packets,
+            "dropped": self.dropped,
+            "duplicated": self.duplicated,
+            "discarded_bytes": self.discarded_bytes,
+        }
+
+# ==============================================================================
+# running per-tapper statistics for the run that is currently being acquired,
+# updated in O(1) per window (Welford's online mean/variance) so the cost of
+# an update does not grow with the length of the run
+class RunStatistics:
+    def __init__(self, ntapper=GEM_MAX_TAPPERS):
+        self.ntapper = ntapper
+
+        # number of windows seen so far
+        self.windows = 0
+
+        # values from the most recent window
+        self.window_num = 0
+        self.met_time = 0
+        self.next_met_adjust = 0
+
+        # cumulative metronome adjustment over the run (ms)
+        self.cum_adjust = 0
+
+        # per-tapper response counts and Welford accumulators
+        self.n = [0] * ntapper
+        self.mean = [0.0] * ntapper
+        self.m2 = [0.0] * ntapper
+
+    # --------------------------------------------------------------------------
+    def update(self, window_num, met_time, asynchronies, next_met_adjust):
+        self.windows += 1
+        self.window_num = window_num
+        self.met_time = met_time
+        self.next_met_adjust = next_met_adjust
+        self.cum_adjust += next_met_adjust
+
+        for k in range(0, self.ntapper):
+            x = asynchronies[k]
+            if x == NO_RESPONSE:
+                continue
+
+            self.n[k] += 1
+            delta = x - self.mean[k]
+            self.mean[k] += delta / self.n[k]
+            self.m2[k] += delta * (x - self.mean[k])
+
+    # --------------------------------------------------------------------------
+    # update from a structured packet array (see decode_packets)
+    def update_packets(self, packets):
+        for window_num, met_time, asynchronies, next_met_adjust in zip(
+            packets["window_num"].tolist(),
+            packets["met_time"].tolist(),
+            packets["asynchronies"].tolist(),
+            packets["next_met_adjust"].tolist(),
+        ):
+            self.update(window_num, met_time, asynchronies, next_met_adjust)
+
+    # --------------------------------------------------------------------------
+    def sd(self, k):
+        return (self.m2[k] / (self.n[k] - 1)) ** 0.5 if self.n[k] > 1 else float("nan")
+
+    # --------------------------------------------------------------------------
+    def response_rate(self, k):
+        return self.n[k] / self.windows if self.windows else float("nan")
+
+    # --------------------------------------------------------------------------
+    # plain dict copy of the current state, safe to hand to another thread
+    def snapshot(self):
+        return {
+            "windows": self.windows,
+            "window_num": self.window_num,
+            "met_time": self.met_time,
+            "next_met_adjust": self.next_met_adjust,
+            "cum_adjust": self.cum_adjust,
+            "tappers": [
+                {
+                    "n": self.n[k],
+                    "mean": self.mean[k] if self.n[k] else float("nan"),
+                    "sd": self.sd(k),
+                    "response_rate": self.response_rate(k),
+                }
+                for k in range(0, self.ntapper)
+            ],
+        }
+
 # ==============================================================================
-# class for debuging GEMIO systems w/o Arduino connection
+# lifecycle of the run that is currently being acquired, driven by the packets
+# that arrive rather than by a wall-clock estimate:
+#   idle -> starting (GEM_START sent) -> running (first window received)
+#   -> finished (last expected window) | stalled (no window for
+#      <stall_timeout> seconds) | aborted | failed (data could not be saved)
+# The acquisition thread updates it, snapshot() can be called from any thread
+class RunLifecycle:
+    IDLE = "idle"
+    STARTING = "starting"
+    RUNNING = "running"
+    FINISHED = "finished"
+    STALLED = "stalled"
+    ABORTED = "aborted"
+    FAILED = "failed"
+
+    # <ioi> is the nominal inter-onset interval (ms), used until windows have
+    # been observed. <stall_timeout> defaults to 4 IOIs, but at least 2s
+    def __init__(self, windows, ioi, stall_timeout=None, clock=monotonic):
+        self.windows = windows
+        self.ioi = ioi
+        self.stall_timeout = stall_timeout or max(2.0, 4 * ioi / 1000)
+        self.clock = clock
+
+        self.lock = Lock()
+
+        self.state = self.IDLE
+        self.t_start = None
+        self.t_last = None
+
+        # first and most recent (window_num, met_time) pairs observed
+        self.first = None
+        self.last = None
+
+    # --------------------------------------------------------------------------
+    def start(self):
+        with self.lock:
+            self.state = self.STARTING
+            self.t_start = self.t_last = self.clock()
+
+    # --------------------------------------------------------------------------
+    def update(self, window_num, met_time):
+        with self.lock:
+            if self.done():
+                return
+
+            self.t_last = self.clock()
+
+            if self.first is None:
+                self.first = (window_num, met_time)
+            self.last = (window_num, met_time)
+
+            self.state = self.FINISHED if window_num >= self.windows else self.RUNNING
+
+    # --------------------------------------------------------------------------
+    # update from a structured packet array (see decode_packets)
+    def update_packets(self, packets):
+        if packets.size:
+            self.update(int(packets["window_num"][-1]), int(packets["met_time"][-1]))
+
+    # --------------------------------------------------------------------------
+    # check for a stall, returns True once the run is over
+    def check(self):
+        with self.lock:
+            if self.state in (self.STARTING, self.RUNNING):
+                if self.clock() - self.t_last > self.stall_timeout:
+                    self.state = self.STALLED
+
+            return self.done()
+
+    # --------------------------------------------------------------------------
+    def abort(self):
+        with self.lock:
+            if not self.done():
+                self.state = self.ABORTED
+
+    # --------------------------------------------------------------------------
+    # the run's data could not be saved, this overrides finished as well
+    def fail(self):
+        with self.lock:
+            self.state = self.FAILED
+
+    # --------------------------------------------------------------------------
+    def done(self):
+        return self.state in (self.FINISHED, self.STALLED, self.ABORTED, self.FAILED)
+
+    # --------------------------------------------------------------------------
+    # IOI (ms) observed from the metronome's own clock, the nominal IOI until
+    # two windows have arrived
+    def observed_ioi(self):
+        if self.first is None or self.last[0] == self.first[0]:
+            return self.ioi
+
+        return (self.last[1] - self.first[1]) / (self.last[0] - self.first[0])
+
+    # --------------------------------------------------------------------------
+    # seconds until the last expected window, extrapolated from the most
+    # recent window at the observed IOI
+    def time_remaining(self):
+        if self.state == self.IDLE:
+            return self.windows * self.ioi / 1000
+
+        if self.done():
+            return 0.0
+
+        nleft = self.windows - (self.last[0] if self.last else 0)
+        elapsed = self.clock() - self.t_last
+
+        return max(0.0, nleft * self.observed_ioi() / 1000 - elapsed)
+
+    # --------------------------------------------------------------------------
+    def snapshot(self):
+        with self.lock:
+            return {
+                "state": self.state,
+                "window_num": self.last[0] if self.last else 0,
+                "windows": self.windows,
+                "ioi": self.observed_ioi(),
+                "time_remaining": self.time_remaining(),
+            }
+
+# ==============================================================================
+# clocks used for everything that waits on the metronome (parameter sends,
+# serial timeouts, stall detection), so that an emulated session can run
+# faster than real time. SystemClock is the real (monotonic) clock
+class SystemClock:
+    def time(self):
+        return monotonic()
+
+    def sleep(self, secs):
+        if secs > 0:
+            sleep(secs)
+
+    def wait_until(self, t):
+        self.sleep(t - self.time())
+
+# ------------------------------------------------------------------------------
+# runs <speed> times faster than real time
+class ScaledClock(SystemClock):
+    def __init__(self, speed):
+        self.speed = speed
+        self.t0 = monotonic()
+
+    def time(self):
+        return self.t0 + (monotonic() - self.t0) * self.speed
+
+    def sleep(self, secs):
+        if secs > 0:
+            sleep(secs / self.speed)
+
+# ------------------------------------------------------------------------------
+# time only moves when someone sleeps: as fast as possible, and deterministic
+# as long as a single thread drives it (the acquisition thread)
+class VirtualClock(SystemClock):
+    def __init__(self, t0=0.0):
+        self.now = t0
+        self.lock = Lock()
+
+    def time(self):
+        return self.now
+
+    def sleep(self, secs):
+        if secs > 0:
+            with self.lock:
+                self.now += secs
+
+# ==============================================================================
+# class for debuging GEMIO systems w/o Arduino connection: after GEM_START is
+# written a valid GEM_DTP_RAW packet becomes available every <interval>
+# seconds, reads block (up to <timeout>) like a pyserial port
 class SerialSpoof:
-    def __init__(self):
-        self.in_waiting = 17
-        self.x = 0
+    def __init__(self, interval=0.4):
+        self.interval = interval
+        self.timeout = None
+
+        self.window = 0
+        self.next_packet = None
+        self.buffer = b""
 
     def write(self, msg):
-        foo = "Serial write: "
-        for c in msg:
-            foo += str(ord(c)) + ","
-        print(foo)
+        print("Serial write: " + ",".join(str(c) for c in msg))
+
+        # GEM_START, begin sending windows
+        if msg == b"\x01":
+            self.next_packet = time() + self.interval
+
+    def produce(self):
+        while self.next_packet is not None and time() >= self.next_packet:
+            self.window += 1
+            self.buffer += struct.pack("<BHI4hh", 0xf0, self.window,
+                int(self.next_packet * 1000) & 0xffffffff, -5, 5, NO_RESPONSE, NO_RESPONSE, 0)
+            self.next_packet += self.interval
+
+    @property
+    def in_waiting(self):
+        self.produce()
+        return len(self.buffer)
 
     def read(self, n):
-        sleep(0.4)
-        return '\xff' + '\x01\x00' + '\x02\x00\x00\x00' + '\x03\x00' + '\x04\x00' + '\x05\x00' + '\x06\x00' + '\x07\x00'
+        deadline = None if self.timeout is None else time() + self.timeout
+
+        self.produce()
+        while len(self.buffer) < n:
+            now = time()
+            if deadline is not None and now >= deadline:
+                break
+
+            wake = deadline
+            if self.next_packet is not None and (wake is None or self.next_packet < wake):
+                wake = self.next_packet
+
+            sleep(max(0, wake - now) if wake is not None else self.interval)
+            self.produce()
+
+        msg, self.buffer = self.buffer[:n], self.buffer[n:]
+        return msg
 
     def readline(self):
         sleep(.050)
@@ -275,42 +930,250 @@ class SerialSpoof:
     def isOpen(self):
         return True
 
+# ==============================================================================
+# disk writer stage for acquisition: the IO thread copies received packets into
+# one of a pool of preallocated buffers and hands them to this thread, which
+# writes all queued buffers in one batch and periodically flushes (and fsyncs)
+# the file, so a slow disk never stalls serial reads
+#
+# The pool holds <nbuffers> buffers of <buffer_size> bytes. If the disk falls
+# so far behind that the pool runs dry, write() allocates an extra buffer
+# rather than block and counts it in <overflow>, the <high_water> mark records
+# the deepest the queue has been. Past <max_overflow> extra buffers write()
+# waits up to <overflow_wait> seconds for one to be returned, then drops the
+# data, counts it in <dropped_bytes> and records an error
+#
+# An exception raised while writing is stored in <error> rather than lost with
+# the thread, from then on writes are dropped. The acquisition thread polls
+# error() and fails the run
+class GEMDiskWriter(Thread):
+    def __init__(self, io, nbuffers=64, buffer_size=4096, flush_interval=1.0, fsync=True,
+            max_overflow=64, overflow_wait=GEM_ABORT_LATENCY):
+        Thread.__init__(self)
+
+        self.io = io
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.max_overflow = max_overflow
+        self.overflow_wait = overflow_wait
+
+        # pool of free buffers, and queue of (buffer, nbytes) waiting to be
+        # written, both guarded by <cv>
+        self.free = deque(bytearray(buffer_size) for k in range(0, nbuffers))
+        self.queue = deque()
+        self.cv = Condition()
+
+        self.closing = False
+
+        # exception that ended the writer, or the reason data was dropped
+        self.exception = None
+
+        # metrics
+        self.high_water = 0
+        self.overflow = 0
+        self.dropped_bytes = 0
+        self.bytes_written = 0
+        self.batches = 0
+        self.flushes = 0
+        self.max_batch_time = 0.0
+
+    # --------------------------------------------------------------------------
+    # queue <data> to be written (called from the IO thread, never blocks on
+    # the disk for longer than <overflow_wait>)
+    def write(self, data):
+        view = memoryview(data)
+        with self.cv:
+            for k in range(0, len(view), self.buffer_size):
+                chunk = view[k:k+self.buffer_size]
+
+                if not self.free and self.overflow >= self.max_overflow and self.exception is None:
+                    self.cv.wait_for(lambda: self.free or self.exception is not None, self.overflow_wait)
+
+                if self.exception is not None:
+                    self.dropped_bytes += len(chunk)
+                    continue
+
+                if self.free:
+                    buf = self.free.popleft()
+                elif self.overflow < self.max_overflow:
+                    buf = bytearray(self.buffer_size)
+                    self.overflow += 1
+                else:
+                    self.dropped_bytes += len(chunk)
+                    self.exception = OSError("Disk writer fell behind, no free buffer after %d extra buffers" % self.overflow)
+                    print(f"[WARN]: {self.exception}, dropping data")
+                    continue
+
+                buf[:len(chunk)] = chunk
+                self.queue.append((buf, len(chunk)))
+
+            self.high_water = max(self.high_water, len(self.queue))
+            self.cv.notify()
+
+    # --------------------------------------------------------------------------
+    def flush_file(self):
+        self.io.flush()
+        if self.fsync:
+            os.fsync(self.io.fileno())
+        self.flushes += 1
+
+    # --------------------------------------------------------------------------
+    # override Thread.run()
+    def run(self):
+        try:
+            self.write_queued()
+        except Exception as err:
+            print(f"[WARN]: Disk writer failed - {err}")
+            with self.cv:
+                self.exception = err
+                self.queue.clear()
+                self.cv.notify_all()
+
+    # --------------------------------------------------------------------------
+    # write queued buffers in batches until closed
+    def write_queued(self):
+        last_flush = monotonic()
+        done = False
+        while not done:
+            with self.cv:
+                if not self.queue and not self.closing:
+                    self.cv.wait(self.flush_interval)
+
+                batch = list(self.queue)
+                self.queue.clear()
+                done = self.closing
+
+            if batch:
+                tstart = monotonic()
+                data = b"".join(memoryview(buf)[:n] for buf, n in batch)
+                self.io.write(data)
+                self.bytes_written += len(data)
+
+                self.batches += 1
+                self.max_batch_time = max(self.max_batch_time, monotonic() - tstart)
+
+                # return the buffers to the pool
+                with self.cv:
+                    self.free.extend(buf for buf, n in batch)
+                    self.cv.notify_all()
+
+            if done or monotonic() - last_flush >= self.flush_interval:
+                self.flush_file()
+                last_flush = monotonic()
+
+    # --------------------------------------------------------------------------
+    # write everything that is still queued, flush and end the thread
+    # out: the writer's error (see error()), None if all data was written
+    def close(self):
+        with self.cv:
+            self.closing = True
+            self.cv.notify_all()
+        self.join()
+
+        return self.error()
+
+    # --------------------------------------------------------------------------
+    # the exception that ended the writer or caused data to be dropped, None
+    # while all data is being written
+    def error(self):
+        return self.exception
+
+    # --------------------------------------------------------------------------
+    def counters(self):
+        return {
+            "bytes_written": self.bytes_written,
+            "batches": self.batches,
+            "flushes": self.flushes,
+            "high_water": self.high_water,
+            "overflow": self.overflow,
+            "dropped_bytes": self.dropped_bytes,
+            "max_batch_time": self.max_batch_time,
+            "error": None if self.exception is None else str(self.exception),
+        }
+
 # ==============================================================================
 # GEMIO resource manager: allow for automatic resource clean up when used in
 # a with statement
 class GEMIOManager:
     # --------------------------------------------------------------------------
-    def __init__(self, serial_ifo, datafile, is_spoof):
+    # <emulator> (a dict of GEMEmulator.EmulatedSerial options) replaces the
+    # serial port with an in-process metronome emulator driven by <clock>
+    def __init__(self, serial_ifo, datafile, is_spoof, emulator=None, clock=None):
         self.ifo = serial_ifo
         self.datafile = datafile
         self.is_spoof = is_spoof
+        self.emulator = emulator
+        self.clock = clock
+        self.io = None
 
     # --------------------------------------------------------------------------
-    def __enter__(self):
+    # open the resource ahead of the with statement (e.g. to stage a run), a
+    # later __enter__ returns the already open resource
+    def open(self):
+        if self.io is not None:
+            return self.io
+
         # ======================================================================
         # the actual GEMIO resource
         class GEMIOResource:
-            def __init__(self, ifo, datafile, is_spoof):
+            def __init__(self, ifo, datafile, is_spoof, emulator, clock):
+
+                if is_spoof:
+                    self.com = SerialSpoof()
 
-                if not is_spoof:
+                elif emulator is not None:
+                    # imported here as GEMEmulator itself depends on GEMIO
+                    from GEMEmulator import EmulatedSerial
+                    self.com = EmulatedSerial(clock=clock,
+                        timeout=ifo.get("timeout", 5), **emulator)
+
+                else:
                     self.com = serial.Serial(
-                        port=ifo["port"],
+                        port=resolve_port(ifo),
                         baudrate=ifo["baud_rate"],
                         timeout=ifo["timeout"]
                     )
 
-                else:
-                    self.com = SerialSpoof()
-
                 if self.com.isOpen():
                     print("serial is open!")
 
+                # the data file can be attached later (see attach_file()) so
+                # that the port can be opened before the file exists
+                self.file = None
+                if datafile is not None:
+                    self.attach_file(datafile)
+
+                # disk writer stage, see start_writer()
+                self.writer = None
+
+            def attach_file(self, datafile):
                 self.file = datafile
                 self.file.reopen()
 
             def close(self):
                 self.com.close()
-                self.file.close()
+                self.stop_writer()
+                if self.file is not None:
+                    self.file.close()
+
+            # hand writes off to a GEMDiskWriter thread from now on
+            def start_writer(self, **kwargs):
+                self.writer = GEMDiskWriter(self.file._io, **kwargs)
+                self.writer.start()
+
+            # out: the writer's error, None if all data was written
+            def stop_writer(self):
+                error = None
+                if self.writer is not None:
+                    error = self.writer.close()
+                    print("[INFO]: Disk writer: {bytes_written} bytes in {batches} batches, {flushes} flushes, high water {high_water} buffers, {overflow} overflow, {dropped_bytes} bytes dropped".format(**self.writer.counters()))
+                    self.writer = None
+
+                return error
+
+            def writer_error(self):
+                return self.writer.error() if self.writer is not None else None
 
             def send(self, msg):
                 self.com.write(msg)
@@ -322,6 +1185,27 @@ class GEMIOManager:
             def commit(self, n):
                 self.file._io.write(self.com.read(n))
 
+            def read(self, n):
+                return self.com.read(n)
+
+            def write(self, data):
+                if self.writer is not None:
+                    self.writer.write(data)
+                else:
+                    self.file._io.write(data)
+
+            # block until at least one byte arrives or the read timeout
+            # expires, then return everything that is waiting
+            def read_available(self):
+                msg = self.com.read(1)
+                n = self.com.in_waiting
+                if n > 0:
+                    msg += self.com.read(n)
+                return msg
+
+            def set_timeout(self, timeout):
+                self.com.timeout = timeout
+
             def commit_debug(self, n):
                 msg = self.com.read(n)
                 self.file._io.write(msg)
@@ -332,50 +1216,160 @@ class GEMIOManager:
 
         # ======================================================================
 
-        self.io = GEMIOResource(self.ifo, self.datafile, self.is_spoof)
+        self.io = GEMIOResource(self.ifo, self.datafile, self.is_spoof,
+            self.emulator, self.clock)
 
         return self.io
+
+    # --------------------------------------------------------------------------
+    def close(self):
+        if self.io is not None:
+            self.io.close()
+            self.io = None
+
+    # --------------------------------------------------------------------------
+    def __enter__(self):
+        return self.open()
+
     # --------------------------------------------------------------------------
     def __exit__(self, err_type, err_value, traceback):
-        self.io.close()
+        self.close()
 
 # ==============================================================================
 #
 class GEMAcquisition(Thread):
-    def __init__(self, datafile, itc, presets, alpha, tempo):
+    # <datafile> may be None while the run is staged, it has to be set before
+    # the thread is started. <constants> are the parsed GEMConstants.h values,
+    # loaded from presets["hfile"] if not given. Waits follow <clock>
+    # (default: SystemClock), see presets["emulator"] for running against an
+    # in-process metronome emulator
+    def __init__(self, datafile, itc, presets, alpha, tempo, constants=None, clock=None):
 
         Thread.__init__(self)
 
         self.datafile = datafile
         self.itc = itc
 
-        self.constants = parse_constants(presets["hfile"])
+        if constants is None:
+            constants = load_constants(presets["hfile"])
+
+        self.constants = constants
         self.serial_ifo = presets["serial"]
         self.run_duration = presets["run_duration"]
 
         self.windows = presets["windows"]
 
+        self.clock = clock or SystemClock()
+
+        # ends the run on the last window or when the metronome stalls, the
+        # firmware's IOI is computed with integer division
+        self.lifecycle = RunLifecycle(self.windows, 60000 // int(tempo),
+            presets.get("stall_timeout"), self.clock.time)
+
         self.tempo = self.constants["GEM_METRONOME_TEMPO"] + bytes(str(int(tempo)), 'utf-8') 
 
         self.alpha = self.constants["GEM_METRONOME_ALPHA"] + bytes(str(alpha),'utf-8')
 
         self.is_spoof = presets.get("spoof_mode", False)
 
+        # optional GEMDiskWriter settings (nbuffers, buffer_size,
+        # flush_interval, fsync)
+        self.writer_opts = presets.get("disk_writer", {})
+
+        # the port is opened by prepare(), either on a staging thread (see
+        # stage()) or at the start of run()
+        self.manager = GEMIOManager(self.serial_ifo, None, self.is_spoof,
+            presets.get("emulator"), self.clock)
+        self.stager = None
+        self.prepared = False
+
+        # monotonic time at which the run was requested (e.g. the Start Run
+        # button press), used to report the start latency
+        self.start_requested = None
+
+        # summary of the finished run (see run()), for callers that do not
+        # listen to the ITC messages
+        self.result = None
+
+        # live counters while the run is in progress, see counters()
+        self.framer = None
+        self.bytes_received = 0
+        self.cpu = 0.0
+
+    # --------------------------------------------------------------------------
+    # bytes received, IO thread CPU time and framer counters of the run so
+    # far, safe to poll from another thread (e.g. to monitor several rigs)
+    def counters(self):
+        d = {"bytes": self.bytes_received, "cpu": self.cpu}
+        if self.framer is not None:
+            d.update(self.framer.counters())
+        else:
+            d.update({"packets": 0, "dropped": 0, "duplicated": 0, "discarded_bytes": 0})
+
+        return d
+
+    # --------------------------------------------------------------------------
+    # open the port, wait out the metronome's reset/handshake and send the run
+    # parameters, leaving the metronome idle until run() starts it
+    def prepare(self):
+        io = self.manager.open()
+
+        # allow some time for handshake!
+        io.com.readline()
+
+        # send relevant parameters to arduino
+        self.itc.send_message("data_viewer", "Sending tempo to arduino: " + self.tempo[1:].decode('utf-8'))
+        io.send(self.tempo)
+        self.clock.sleep(0.100)
+
+        self.itc.send_message("data_viewer", "Sending alpha to arduino: " + self.alpha[1:].decode('utf-8'))
+        io.send(self.alpha)
+        self.clock.sleep(0.100)
+
+        self.prepared = True
+
+    # --------------------------------------------------------------------------
+    # prepare() on a background thread, so that starting the run only has to
+    # trigger the metronome. If staging fails, run() tries again
+    def stage(self):
+        def target():
+            try:
+                self.prepare()
+            except Exception as err:
+                print(f"[WARN]: Failed to stage run - {err}")
+                self.manager.close()
+
+        self.stager = Thread(target=target, daemon=True)
+        self.stager.start()
+
+    # --------------------------------------------------------------------------
+    # true while the staging thread is still preparing the run
+    def staging(self):
+        return self.stager is not None and self.stager.is_alive()
+
+    # --------------------------------------------------------------------------
+    # close the port of a staged run that is never going to be started, waits
+    # for the staging thread (poll staging() to avoid blocking)
+    def release(self):
+        if self.stager is not None:
+            self.stager.join()
+
+        if self.ident is None:
+            self.manager.close()
+
+    # --------------------------------------------------------------------------
     # override Thread.run()
     def run(self):
-        with GEMIOManager(self.serial_ifo, self.datafile, self.is_spoof) as io:
+        # wait for the staging thread if it is still busy
+        if self.stager is not None:
+            self.stager.join()
 
-            # allow some time for handshake!
-            io.com.readline()
+        with self.manager as io:
 
-            # send relevant parameters to arduino
-            self.itc.send_message("data_viewer", "Sending tempo to arduino: " + self.tempo[1:].decode('utf-8'))
-            io.send(self.tempo)
-            sleep(0.100)
+            if not self.prepared:
+                self.prepare()
 
-            self.itc.send_message("data_viewer", "Sending alpha to arduino: " + self.alpha[1:].decode('utf-8'))
-            io.send(self.alpha)
-            sleep(0.100)
+            io.attach_file(self.datafile)
 
             #
             # # TODO: wait for metronome to tell us it's ready
@@ -388,38 +1382,122 @@ class GEMAcquisition(Thread):
             # no message is needed (defaults to "")
             self.itc.send_message("run_start")
             io.send(self.constants["GEM_START"])
+            self.lifecycle.start()
+
+            if self.start_requested is not None:
+                latency = 1000 * (monotonic() - self.start_requested)
+                print(f"[INFO]: Start latency {latency:.1f} ms")
+                self.itc.send_message("data_viewer", f"Start latency: {latency:.1f} ms")
 
             # track bytes received for debugging
             total = 0
-            expected = int(self.constants["GEM_PACKET_SIZE"]) * self.windows
 
-            print(f"[INFO]: Expecting {expected} bytes total")
+            # assembles and validates packets, only complete packets in window
+            # order are written to the data file
+            framer = PacketFramer(self.windows, self.constants["GEM_DTP_RAW"][0])
+            self.framer = framer
 
-            tstart = time()
-            done = self.itc.check_done()
-            while (not done) and (total < expected):
+            # running statistics, updated as each complete packet arrives
+            stats = RunStatistics()
 
-                n = io.available()
-                if n > 0:
-                    io.commit(n)
+            print(f"[INFO]: Expecting {self.windows} windows")
+
+            # NOTE: rather than polling io.available() we block in the serial
+            # read until data arrives, so the thread sleeps between packets.
+            # The read gives up after GEM_ABORT_LATENCY seconds, which bounds
+            # how long it takes us to notice an abort
+            io.set_timeout(GEM_ABORT_LATENCY)
 
-                    # notify data viewer that we've received some data
-                    self.itc.send_message("data_viewer", n)
+            # file writes happen on their own thread from here on
+            io.start_writer(**self.writer_opts)
 
+            tstart = time()
+            cpu_start = thread_time()
+            lifecycle = self.lifecycle
+            # time the last data arrived, the final window is accepted without
+            # confirmation once nothing has followed it for 1.5 IOIs
+            last_rx = self.clock.time()
+            final_timeout = 1.5 * lifecycle.ioi / 1000
+            while not lifecycle.done():
+
+                msg = io.read_available()
+                if msg:
                     # NOTE: echo incoming data to the data-viewer for debugging
                     # msg *SHOULD* be a byte-string... so I think we can just
                     # display as is in the data viewer
-                    # msg = io.commit_debug(n)
                     # self.itc.send_message("data_viewer", msg)
 
+                    last_rx = self.clock.time()
+                    packets = framer.feed(msg)
+
                     # update byte count
-                    total += n
+                    total += len(msg)
+                    self.bytes_received = total
                     # print(f"[INFO]: {total} bytes received so far")
 
-                # Check for an abort
-                done = self.itc.check_done()
+                elif self.clock.time() - last_rx > final_timeout:
+                    packets = framer.flush_final()
+
+                else:
+                    packets = b""
+
+                if packets:
+                    io.write(packets)
+
+                    decoded = decode_packets(packets)
+                    stats.update_packets(decoded)
+                    lifecycle.update_packets(decoded)
+
+                    # notify data viewer of the updated run statistics
+                    self.itc.send_message("run_stats", stats.snapshot())
+
+                    # publish the decoded windows for live plotting
+                    self.itc.send_message("window_data", decoded)
+
+                self.cpu = thread_time() - cpu_start
+
+                # Check for an abort, a failed disk writer or a stalled
+                # metronome
+                if self.itc.check_done():
+                    lifecycle.abort()
+                if io.writer_error() is not None:
+                    lifecycle.fail()
+                lifecycle.check()
 
             io.send(self.constants["GEM_STOP"])
 
+            # the last writes are only on disk once the writer is closed
+            writer_error = io.stop_writer()
+            if writer_error is not None:
+                lifecycle.fail()
+                self.itc.send_message("data_viewer", f"Run failed: {writer_error}")
+
+            if lifecycle.state == lifecycle.STALLED:
+                self.itc.send_message("data_viewer",
+                    f"Run stalled: no window for {lifecycle.stall_timeout:.1f}s")
+
+            counts = framer.counters()
+            self.itc.send_message("data_viewer",
+                "Received {packets} windows ({dropped} dropped, {duplicated} duplicated, {discarded_bytes} bytes discarded)".format(**counts))
+
+            elapsed = time() - tstart
+            cpu = thread_time() - cpu_start
+
+            self.result = {
+                "state": lifecycle.state,
+                "bytes": total,
+                "elapsed": elapsed,
+                "cpu": cpu,
+                "framer": counts,
+                "stats": stats.snapshot(),
+            }
+
             print(f"[INFO]: Received {total} bytes of data during this run")
+            print(f"[INFO]: IO thread used {cpu:.3f}s CPU over {elapsed:.3f}s ({100 * cpu / max(elapsed, 1e-9):.1f}%)")
             print("IO thread terminated")
+
+# ==============================================================================
+# regenerate the frozen constants module: python GEMIO.py [GEMConstants.h]
+if __name__ == "__main__":
+    import sys
+    freeze_constants(*sys.argv[1:2])
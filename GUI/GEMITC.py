@@ -1,32 +1,64 @@
-from threading import Thread, Lock, Condition
+from threading import Thread, Lock, Condition, Event
 from collections import deque
+from time import monotonic
+
+# ==============================================================================
+# coalescing functions for ITC.set_coalesce(): given the message that is still
+# waiting in the queue and a new message for the same signal, return the merged
+# message, or None if the two cannot be merged
+
+# only the most recent message matters (e.g. state snapshots)
+def coalesce_latest(old, new):
+    return new
 
 # ==============================================================================
 # Inter-thread-communicator
+#
+# Messages are held in a FIFO queue of at most <maxsize> entries, so no message
+# is lost when senders outpace the dispatch thread. Backpressure is defined as:
+#   1. if the signal has a coalescing function and a message for that signal
+#      is still queued, the new message is merged into it (never blocks)
+#   2. otherwise, if the queue is full, the sender waits up to <put_timeout>
+#      seconds for the dispatch thread to make room
+#   3. if the queue is still full the oldest queued message is dropped and
+#      counted in <dropped>
+# The dispatch thread drains the whole queue on each wake up. Listeners
+# registered with batch=True are called once per drain with the list of all
+# messages for their signal, other listeners are called once per message.
 class ITC(Thread):
     # --------------------------------------------------------------------------
-    def __init__(self):
+    def __init__(self, maxsize=1024, put_timeout=0.1):
 
         Thread.__init__(self)
 
-        # lock for <isdone>
-        self.done_lock = Lock()
-
         # single purpose flag for sending bool "finish" message to the IO thread
-        self.isdone = False
+        self.isdone = Event()
 
         # condition var for messages and master end flag
         self.cv = Condition()
 
         self.listener_lock = Lock()
 
-        # dict mapping recipient names to callback function for immediate
-        # processing upon receiving a message
+        # dict mapping recipient names to a list of (callback, batch) tuples
+        # for immediate processing upon receiving a message
         self.listeners = dict()
 
-        # buffers to hold the most recent message and signal/recipient name
-        self.buffer = ""
-        self.signal = ""
+        # queue of [signal, message] entries waiting to be dispatched, and a
+        # dict mapping coalescable signals to their queued entry
+        self.queue = deque()
+        self.maxsize = maxsize
+        self.put_timeout = put_timeout
+        self.pending = dict()
+
+        # dict mapping signal names to coalescing functions
+        self.coalesce = dict()
+
+        # counters
+        self.sent = 0
+        self.delivered = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.max_depth = 0
 
         # master flag set by close() to abort and message waiting that is
         # happening when it's time to close the application
@@ -39,30 +71,52 @@ class ITC(Thread):
             self.cv.acquire()
 
             # wait until a message is available or someone called close()
-            while (not self.signal) and (not self.end):
+            while (not self.queue) and (not self.end):
                 self.cv.wait()
 
             if not self.end:
-                self.listener_lock.acquire()
-
-                # if <to> is a signal (i.e. has listeners) then call all
-                # callbacks that have registered with that signal, otherwise,
-                # if <to> has a registered queue add the msg to the queue
-                if self.signal in self.listeners:
-                    for receiver in self.listeners[self.signal]:
-                        # print("sending signal: %s, msg: %s" % (self.signal, str(self.buffer)))
-                        receiver(self.buffer)
+                # take everything that is queued in one go
+                batch = list(self.queue)
+                self.queue.clear()
+                self.pending.clear()
 
-                self.listener_lock.release()
-
-                self.signal = ""
-                self.buffer = ""
+                # wake up any sender waiting for room
+                self.cv.notify_all()
             else:
                 done = True
                 print("ITC thread received close")
 
             self.cv.release()
+
+            if not done:
+                self.dispatch(batch)
+
         print("ITC thread terminated")
+
+    # --------------------------------------------------------------------------
+    # call all callbacks that have registered with each message's signal
+    def dispatch(self, batch):
+        self.listener_lock.acquire()
+
+        batched = dict()
+        for signal, msg in batch:
+            if signal in self.listeners:
+                for receiver, is_batch in self.listeners[signal]:
+                    if is_batch:
+                        batched.setdefault(receiver, []).append(msg)
+                    else:
+                        # print("sending signal: %s, msg: %s" % (signal, str(msg)))
+                        receiver(msg)
+
+        for receiver, msgs in batched.items():
+            receiver(msgs)
+
+        self.listener_lock.release()
+
+        self.cv.acquire()
+        self.delivered += len(batch)
+        self.cv.release()
+
     # --------------------------------------------------------------------------
     # full scale abort: kill message waiting, send done to IO thread
     def close(self):
@@ -82,38 +136,89 @@ class ITC(Thread):
         return True
 
     # --------------------------------------------------------------------------
-    # register a callback for named signals
-    def register_listener(self, signal, callback):
+    # register a callback for named signals, with <batch> True the callback
+    # receives a list of messages (see class notes)
+    def register_listener(self, signal, callback, batch=False):
         print("registering listener for signal: " + signal)
         self.listener_lock.acquire()
         if not signal in self.listeners:
             self.listeners[signal] = list()
 
-        self.listeners[signal].append(callback)
+        self.listeners[signal].append((callback, batch))
         self.listener_lock.release()
 
+    # --------------------------------------------------------------------------
+    # allow queued messages for <signal> to be merged using <func>
+    def set_coalesce(self, signal, func):
+        self.cv.acquire()
+        self.coalesce[signal] = func
+        self.cv.release()
+
     # --------------------------------------------------------------------------
     # send a message to all entities that have registered with the name <to>
     def send_message(self, to, msg=""):
         self.cv.acquire()
         # print("buffering signal: %s, msg: %s " % (to, str(msg)))
-        self.signal = to
-        self.buffer = msg
-        self.cv.notify()
+        self.sent += 1
+
+        # merge into a queued message for the same signal if we can
+        if to in self.pending:
+            merged = self.coalesce[to](self.pending[to][1], msg)
+            if merged is not None:
+                self.pending[to][1] = merged
+                self.coalesced += 1
+                self.cv.release()
+                return
+
+        # wait (briefly) for room, then drop the oldest message
+        deadline = monotonic() + self.put_timeout
+        while len(self.queue) >= self.maxsize and not self.end:
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                oldest = self.queue.popleft()
+                if self.pending.get(oldest[0]) is oldest:
+                    self.pending.pop(oldest[0])
+                self.dropped += 1
+                break
+            self.cv.wait(remaining)
+
+        entry = [to, msg]
+        self.queue.append(entry)
+        if to in self.coalesce:
+            self.pending[to] = entry
+
+        self.max_depth = max(self.max_depth, len(self.queue))
+
+        self.cv.notify_all()
+        self.cv.release()
+
+    # --------------------------------------------------------------------------
+    # queue depth and message counters, every message sent is either
+    # delivered, coalesced, dropped or still queued:
+    #   sent == delivered + coalesced + dropped + depth
+    def counters(self):
+        self.cv.acquire()
+        ret = {
+            "depth": len(self.queue),
+            "max_depth": self.max_depth,
+            "sent": self.sent,
+            "delivered": self.delivered,
+            "coalesced": self.coalesced,
+            "dropped": self.dropped,
+        }
         self.cv.release()
+        return ret
 
     # --------------------------------------------------------------------------
     # toggle the isdone state to true: effectivly tell IO thread to end
     def set_done(self, val=True):
         print(f"Setting done {val}")
-        self.done_lock.acquire()
-        self.isdone = val
-        self.done_lock.release()
+        if val:
+            self.isdone.set()
+        else:
+            self.isdone.clear()
 
     # --------------------------------------------------------------------------
-    # check the state of the isdone flag
+    # check the state of the isdone flag (lock free)
     def check_done(self):
-        self.done_lock.acquire()
-        ret = self.isdone
-        self.done_lock.release()
-        return ret
+        return self.isdone.is_set()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+# Vectorized synchronization metrics for decoded GEM run data
+#   - runs are structured packet arrays as returned by
+#     GEMDataFile.read_run_array / iter_runs (see GEMIO.GEM_PACKET_DTYPE)
+#   - NO_RESPONSE entries are masked (as NaN) before any metric is computed
+#   - every metric works on all runs and tappers at once and returns an array
+#     of shape (nrun, GEM_MAX_TAPPERS)
+'''
+
+import numpy as np
+
+from GEMIO import GEM_PACKET_DTYPE, NO_RESPONSE
+
+# ==============================================================================
+# replace NO_RESPONSE entries with NaN
+# in: <asyncs> an integer array of asynchronies of any shape
+# out: a float array of the same shape
+def mask_no_response(asyncs):
+    asyncs = np.asarray(asyncs, dtype=float)
+    return np.where(asyncs == NO_RESPONSE, np.nan, asyncs)
+
+# ==============================================================================
+# stack one or more runs into a single masked asynchrony array
+# in: <runs> a structured packet array (one run) or a list of them
+# out: (asyncs, nwin) where <asyncs> has shape (nrun, max_windows, ntapper)
+#      with NaN for NO_RESPONSE and for padding of shorter runs, and <nwin>
+#      holds the number of recorded windows in each run. No runs give
+#      arrays of shape (0, 0, GEM_MAX_TAPPERS) and (0,)
+def stack_runs(runs):
+    if isinstance(runs, np.ndarray):
+        runs = [runs]
+
+    nwin = np.array([r.size for r in runs], dtype=int)
+    dtype = runs[0].dtype if len(runs) else GEM_PACKET_DTYPE
+    ntap = dtype["asynchronies"].shape[0]
+
+    asyncs = np.full((len(runs), nwin.max(initial=0), ntap), np.nan)
+    for k, r in enumerate(runs):
+        asyncs[k, :r.size] = mask_no_response(r["asynchronies"])
+
+    return asyncs, nwin
+
+# ==============================================================================
+# stack the next_met_adjust values of one or more runs (NaN padded)
+def stack_adjustments(runs):
+    if isinstance(runs, np.ndarray):
+        runs = [runs]
+
+    adjust = np.full((len(runs), max([r.size for r in runs], default=0)), np.nan)
+    for k, r in enumerate(runs):
+        adjust[k, :r.size] = r["next_met_adjust"]
+
+    return adjust
+
+# ==============================================================================
+# proportion of recorded windows in which each tapper responded
+def response_rate(asyncs, nwin):
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.sum(~np.isnan(asyncs), axis=1) / nwin[:, np.newaxis]
+
+# ==============================================================================
+def mean_asynchrony(asyncs):
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.nansum(asyncs, axis=1) / np.sum(~np.isnan(asyncs), axis=1)
+
+# ==============================================================================
+def mean_abs_asynchrony(asyncs):
+    return mean_asynchrony(np.abs(asyncs))
+
+# ==============================================================================
+# sample standard deviation (ddof=1) of asynchrony, NaN with < 2 responses
+def asynchrony_sd(asyncs):
+    n = np.sum(~np.isnan(asyncs), axis=1)
+    dev = asyncs - mean_asynchrony(asyncs)[:, np.newaxis, :]
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        sd = np.sqrt(np.nansum(dev**2, axis=1) / (n - 1))
+
+    return np.where(n > 1, sd, np.nan)
+
+# ==============================================================================
+# lag-1 autocorrelation of asynchrony, computed over pairs of consecutive
+# windows in which the tapper responded in both
+def lag1_autocorrelation(asyncs):
+    dev = asyncs - mean_asynchrony(asyncs)[:, np.newaxis, :]
+
+    # NaN products (i.e. a missing response in either window) drop out of the
+    # lagged sum
+    num = np.nansum(dev[:, 1:] * dev[:, :-1], axis=1)
+    den = np.nansum(dev**2, axis=1)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        r = num / den
+
+    npair = np.sum(~np.isnan(dev[:, 1:] * dev[:, :-1]), axis=1)
+
+    return np.where(npair > 0, r, np.nan)
+
+# ==============================================================================
+# compute all metrics for one or more runs
+# out: a dict mapping metric names to arrays of shape (nrun, ntapper)
+def run_metrics(runs):
+    asyncs, nwin = stack_runs(runs)
+
+    return {
+        "mean_asynchrony": mean_asynchrony(asyncs),
+        "mean_abs_asynchrony": mean_abs_asynchrony(asyncs),
+        "sd_asynchrony": asynchrony_sd(asyncs),
+        "lag1_autocorrelation": lag1_autocorrelation(asyncs),
+        "response_rate": response_rate(asyncs, nwin),
+    }
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+# Python port of the GEM library's Metronome (GEM/GEM.cpp)
+#   - reproduces the firmware's integer arithmetic: on the Uno an int is 16
+#     bits, float is 32 bits and the IOI is a uint16_t, so the averaging rule
+#     in Metronome::scheduleNext truncates (integer division) before it is
+#     scaled by alpha and floored
+#   - average_adjust() is vectorized over any number of leading axes so the
+#     same rule can drive single windows (emulator) or many runs at once
+#     (simulation, replay)
+'''
+
+import numpy as np
+
+from GEMIO import NO_RESPONSE
+
+# the only adaptation heuristic implemented by the firmware
+GEM_METRONOME_HEURISTIC_AVERAGE = 0x10
+
+# ==============================================================================
+# wrap integers to the range of a 16-bit int (two's complement)
+def to_int16(x):
+    return ((np.asarray(x, dtype=np.int64) + 0x8000) % 0x10000) - 0x8000
+
+# ==============================================================================
+# IOI (ms) for a tempo (bpm): floor(60000 / bpm) with integer division, stored
+# in a uint16_t (Metronome::setIOI)
+def tempo_to_ioi(bpm):
+    return (60000 // int(bpm)) & 0xffff
+
+# ==============================================================================
+# value of alpha as parsed by the firmware (Stream::parseFloat): digits are
+# accumulated into an integer and the fraction is built by repeatedly
+# multiplying by 0.1 in single precision, which is not always the float32
+# closest to the decimal string
+def parse_float(text):
+    value = 0
+    fraction = np.float32(1.0)
+    is_negative = False
+    is_fraction = False
+
+    for c in str(text).strip():
+        if c == "-" and value == 0 and not is_fraction:
+            is_negative = True
+        elif c == ".":
+            if is_fraction:
+                break
+            is_fraction = True
+        elif c.isdigit():
+            value = value * 10 + int(c)
+            if is_fraction:
+                fraction = np.float32(fraction * np.float32(0.1))
+        else:
+            break
+
+    if is_negative:
+        value = -value
+
+    if is_fraction:
+        return np.float32(np.float32(value) * fraction)
+
+    return np.float32(value)
+
+# ==============================================================================
+# metronome adjustment (ms) from one window of asynchronies using the average
+# heuristic, exactly as Metronome::scheduleNext computes it:
+#   floor((int16 sum / int16 count) * alpha)
+# in: <asynchronies> array of shape (..., ntapper), NO_RESPONSE where a tapper
+#     did not respond. <alpha> a scalar or an array broadcastable to the
+#     leading shape. <active> optional bool mask of connected tappers,
+#     broadcastable to <asynchronies>
+# out: int array with the leading shape of <asynchronies> (0 if nobody
+#      responded)
+def average_adjust(asynchronies, alpha, active=None):
+    asyncs = np.asarray(asynchronies, dtype=np.int64)
+
+    valid = asyncs != NO_RESPONSE
+    if active is not None:
+        valid &= np.asarray(active, dtype=bool)
+
+    total = to_int16(np.where(valid, asyncs, 0).sum(axis=-1))
+    n = valid.sum(axis=-1)
+
+    # C integer division truncates toward zero
+    quot = np.trunc(total / np.maximum(n, 1))
+
+    adjust = np.floor(quot.astype(np.float32) * np.asarray(alpha, dtype=np.float32))
+
+    return np.where(n > 0, adjust, 0).astype(np.int64)
+
+# ==============================================================================
+# candidate heuristics that are not (yet) in the firmware, for replay and
+# simulation. Like the average rule they reduce the window to an int (ms),
+# truncated toward zero, before it is scaled by alpha and floored
+#
+# valid responses of a window, honoring the optional <active> mask
+def _valid_responses(asynchronies, active):
+    asyncs = np.asarray(asynchronies, dtype=np.int64)
+
+    valid = asyncs != NO_RESPONSE
+    if active is not None:
+        valid = valid & np.asarray(active, dtype=bool)
+
+    return asyncs, valid
+
+# ==============================================================================
+def _scale(quot, n, alpha):
+    adjust = np.floor(np.trunc(quot).astype(np.float32) * np.asarray(alpha, dtype=np.float32))
+    return np.where(n > 0, adjust, 0).astype(np.int64)
+
+# ==============================================================================
+# median of the window's responses (mean of the middle two for an even count)
+def median_adjust(asynchronies, alpha, active=None):
+    asyncs, valid = _valid_responses(asynchronies, active)
+    n = valid.sum(axis=-1)
+
+    # responses sort to the front, NO_RESPONSE/inactive entries to the back
+    ordered = np.sort(np.where(valid, asyncs, np.iinfo(np.int64).max), axis=-1)
+
+    lo = np.take_along_axis(ordered, np.maximum(n - 1, 0)[..., np.newaxis] // 2, axis=-1)[..., 0]
+    hi = np.take_along_axis(ordered, (n // 2)[..., np.newaxis], axis=-1)[..., 0]
+
+    return _scale(np.where(n > 0, (lo + hi) / 2, 0), n, alpha)
+
+# ==============================================================================
+# weighted average of the window's responses
+# in: <weights> one weight per tapper (broadcastable to <asynchronies>),
+#     default: equal weights
+def weighted_adjust(asynchronies, alpha, active=None, weights=None):
+    asyncs, valid = _valid_responses(asynchronies, active)
+    n = valid.sum(axis=-1)
+
+    w = np.ones(asyncs.shape) if weights is None else np.broadcast_to(np.asarray(weights, dtype=float), asyncs.shape)
+    w = np.where(valid, w, 0)
+
+    wsum = w.sum(axis=-1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        quot = np.where(wsum > 0, (w * asyncs).sum(axis=-1) / wsum, 0)
+
+    return _scale(quot, np.where(wsum > 0, n, 0), alpha)
+
+# adjustment rules by name, all called as f(asynchronies, alpha, active=None)
+HEURISTICS = {
+    "average": average_adjust,
+    "median": median_adjust,
+    "weighted": weighted_adjust,
+}
+
+# ==============================================================================
+# the metronome's timing state (GEM.h / GEM.cpp)
+class Metronome:
+    def __init__(self, alpha=0.3, bpm=120):
+        self.alpha = np.float32(alpha)
+        self.next = 0
+        self.played = False
+        self.set_tempo(bpm)
+
+    # --------------------------------------------------------------------------
+    def set_tempo(self, bpm):
+        self.bpm = int(bpm)
+        self.ioi = tempo_to_ioi(self.bpm) if self.bpm else 0
+
+    # --------------------------------------------------------------------------
+    # schedule the next metronome event from the window's asynchronies
+    # in: <asynchronies> GEM_MAX_TAPPERS ints, <active> bool per tapper
+    # out: the adjustment that was applied (ms)
+    def schedule_next(self, asynchronies, active, heuristic=GEM_METRONOME_HEURISTIC_AVERAGE):
+        if heuristic == GEM_METRONOME_HEURISTIC_AVERAGE:
+            adjust = int(average_adjust(asynchronies, self.alpha, active))
+        else:
+            adjust = 0
+
+        # uint16_t ioi + int is evaluated as a 16-bit unsigned int before it
+        # is added to the unsigned long <next>
+        self.next = (self.next + ((self.ioi + adjust) & 0xffff)) & 0xffffffff
+        self.played = False
+
+        return adjust
@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+# Non-blocking client for PyEnsemble group sessions
+#   - all HTTP requests run on a single worker thread using a pooled
+#     requests.Session with per-call timeouts and retry with backoff
+#   - results are handed back through callbacks that run wherever poll() is
+#     called (the GUI calls it from a Tk after() tick, so callbacks can safely
+#     touch Tk widgets)
+'''
+
+import json
+import re
+from queue import Queue, Empty
+from threading import Thread, Event
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# PyEnsemble endpoints, relative to the server URL
+URLS = {
+    "connect": "/group/session/attach/experimenter/",
+    "update": "/group/session/participants/get/",
+    "init_experiment": "/experiments/gem_control/control/experiment/init/",
+    "end_experiment": "/experiments/gem_control/control/experiment/end/",
+    "init_trial": "/experiments/gem_control/control/trial/init/",
+    "start_trial": "/experiments/gem_control/control/trial/start/",
+    "end_trial": "/experiments/gem_control/control/trial/end/",
+    "exit_loop": "/experiments/gem_control/control/loop/exit/",
+}
+
+# ==============================================================================
+class PyEnsembleError(Exception):
+    def __init__(self, title, msg, detail=""):
+        Exception.__init__(self, msg)
+        self.title = title
+        self.msg = msg
+        self.detail = detail
+
+# ==============================================================================
+class PyEnsembleClient(Thread):
+    # --------------------------------------------------------------------------
+    # <timeout> is a (connect, read) tuple in seconds applied to every request,
+    # failed connections (and GETs that hit a 5xx gateway error) are retried
+    # up to <retries> times with exponential <backoff>
+    def __init__(self, server, verify_ssl=True, timeout=(3.05, 10), retries=3, backoff=0.5, pool_size=4):
+        Thread.__init__(self, daemon=True)
+
+        self.server = server
+        self.verify_ssl = verify_ssl
+        self.timeout = timeout
+
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            backoff_factor=backoff,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(["GET"]),
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        # jobs waiting for the worker, and finished jobs waiting for poll()
+        self.jobs = Queue()
+        self.results = Queue()
+
+        self.closing = Event()
+
+    # --------------------------------------------------------------------------
+    # override Thread.run()
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+
+            func, args, callback, errback, delay = job
+
+            # delayed jobs (e.g. exit_loop) wait here rather than on the GUI
+            # thread, close() cuts the wait short
+            if delay and self.closing.wait(delay):
+                break
+
+            try:
+                result = func(*args)
+            except Exception as err:
+                self.results.put((errback, err))
+            else:
+                self.results.put((callback, result))
+
+        self.session.close()
+
+    # --------------------------------------------------------------------------
+    # queue <func>(*args) to run on the worker thread, <callback>(result) or
+    # <errback>(exception) is called from poll() once it finishes
+    def submit(self, func, *args, callback=None, errback=None, delay=0):
+        self.jobs.put((func, args, callback, errback, delay))
+
+    # --------------------------------------------------------------------------
+    # run the callbacks of all finished jobs, call from the thread that owns
+    # the GUI
+    def poll(self):
+        while True:
+            try:
+                callback, result = self.results.get_nowait()
+            except Empty:
+                break
+
+            if callback is not None:
+                callback(result)
+
+    # --------------------------------------------------------------------------
+    def close(self):
+        self.closing.set()
+        self.jobs.put(None)
+
+    # ==========================================================================
+    # HTTP helpers (worker thread only)
+    # ==========================================================================
+    def url(self, name):
+        return self.server + URLS[name]
+
+    def csrftoken(self):
+        return self.session.cookies.get("csrftoken", "")
+
+    def get(self, url):
+        return self.session.get(url, verify=self.verify_ssl, timeout=self.timeout)
+
+    def post(self, url, data):
+        headers = {"Referer": self.server}
+        return self.session.post(url, data, headers=headers, verify=self.verify_ssl, timeout=self.timeout)
+
+    # ==========================================================================
+    # PyEnsemble operations (worker thread only, use with submit())
+    # ==========================================================================
+    # log in (if needed) and attach to the group session
+    # out: dict with "success" and a list of (title, msg) "errors" to report,
+    #      "incomplete" is True if we stopped before trying to attach
+    def attach(self, username, password, experimenter_code):
+        errors = []
+
+        url = self.url("connect")
+
+        # Access the URL
+        resp = self.get(url)
+        if not resp.ok:
+            errors.append(("PyEnsemble Error", "Problem fetching form"))
+
+        # Check whether it is a login form
+        if re.search('name="username"', resp.text):
+            # Login and redirect to the target url
+            resp = self.post(resp.url, {
+                "username": username,
+                "password": password,
+                "csrfmiddlewaretoken": self.csrftoken(),
+            })
+
+        # Make sure the request succeeded
+        if not resp.ok:
+            test_str = "CSRF verification failed"
+            if re.search(test_str, resp.text):
+                errors.append((f"Server code: {resp.status_code}", test_str))
+            else:
+                errors.append(("Alert", f"Server code: {resp.status_code}"))
+
+        # Check for invalid username or password
+        test_str = "Please enter a correct username and password"
+        if re.search(test_str, resp.text):
+            errors.append(("Invalid credentials", test_str))
+
+        success = False
+
+        # Check whether we are being prompted for the experimenter code
+        if re.search('name="experimenter_code"', resp.text):
+            if not experimenter_code:
+                errors.append(("Missing Session Experimenter Code", "Please enter a session experimenter code"))
+                return {"success": False, "errors": errors, "incomplete": True}
+
+            # Connect to the group session
+            resp = self.post(url, {
+                "experimenter_code": experimenter_code,
+                "csrfmiddlewaretoken": self.csrftoken(),
+            })
+
+            # Check for success
+            if resp.ok:
+                # Check to see whether we redirected to the status page
+                if re.search('id="groupsession_status"', resp.text):
+                    success = True
+                else:
+                    if re.search("Failed to retrieve ticket matching this code", resp.text):
+                        errors.append(("PyEnsemble Error", "Invalid Experimenter Code"))
+
+                    if re.search("The ticket matching this code has expired", resp.text):
+                        errors.append(("PyEnsemble Error", "Group session ticket has expired"))
+
+        return {"success": success, "errors": errors, "incomplete": False}
+
+    # --------------------------------------------------------------------------
+    # out: dict mapping subject ids to participant info
+    def participants(self):
+        resp = self.get(self.url("update"))
+        if not resp.ok:
+            raise PyEnsembleError("PyEnsemble Error", "Unable to update participant list")
+
+        return resp.json()
+
+    # --------------------------------------------------------------------------
+    def init_experiment(self, form_data):
+        # GET the form
+        resp = self.get(self.url("init_experiment"))
+
+        # Fill out and POST the form
+        data = {"csrfmiddlewaretoken": self.csrftoken()}
+        data.update(form_data)
+
+        resp = self.post(resp.url, data)
+
+        # Check for indications of an error in the response
+        if not resp.ok or re.search("error", resp.text):
+            raise PyEnsembleError("PyEnsemble Error", "Failed to initialize experiment!", resp.text)
+
+        return True
+
+    # --------------------------------------------------------------------------
+    def end_experiment(self):
+        self.get(self.url("end_experiment"))
+        return True
+
+    # --------------------------------------------------------------------------
+    # GET the trial initialization form, returns the URL to POST it to
+    def fetch_trial_form(self):
+        return self.get(self.url("init_trial")).url
+
+    # --------------------------------------------------------------------------
+    # POST the trial parameters, <form_url> defaults to fetching a new form
+    def init_trial(self, params, form_url=None):
+        if form_url is None:
+            form_url = self.fetch_trial_form()
+
+        # Create our payload
+        data = {"csrfmiddlewaretoken": self.csrftoken()}
+
+        data.update({"trial_num": params["run_number"]})
+
+        # Set our params
+        data.update({"params": json.dumps({
+                "alpha": params["alpha"],
+                "tempo": params["tempo"],
+                "trial_num": params["run_number"],
+                "start_time": params["start_time"],
+            })
+        })
+
+        # Post our form
+        resp = self.post(form_url, data)
+
+        if not resp.ok or re.search("error", resp.text):
+            err_msg = ""
+            if resp.text:
+                try:
+                    error_details = json.loads(resp.text)
+                    err_msg = json.dumps(error_details, indent=2)
+
+                except ValueError:
+                    err_msg = resp.text
+
+            raise PyEnsembleError("PyEnsemble Error", "Failed to initialize trial!", err_msg)
+
+        return True
+
+    # --------------------------------------------------------------------------
+    def start_trial(self):
+        resp = self.get(self.url("start_trial"))
+        if not resp.ok:
+            raise PyEnsembleError("PyEnsemble Error", "Failed to start trial!")
+
+        return True
+
+    # --------------------------------------------------------------------------
+    # initialize and then start a trial in one job
+    def init_and_start_trial(self, params, form_url=None):
+        self.init_trial(params, form_url)
+        return self.start_trial()
+
+    # --------------------------------------------------------------------------
+    def end_trial(self):
+        self.get(self.url("end_trial"))
+        return True
+
+    # --------------------------------------------------------------------------
+    def exit_loop(self):
+        resp = self.get(self.url("exit_loop"))
+        if not resp.ok:
+            raise PyEnsembleError("PyEnsemble Error", "Failed to set EXIT_LOOP", resp.text)
+
+        return True
@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+# Counterfactual replay of recorded GEM runs (.gdf)
+#   - every recorded window is run through alternative adjustment rules (see
+#     GEMMetronome.HEURISTICS) and alphas, and the metronome is moved the way
+#     the firmware would have moved it (uint16 ioi + adjust per window)
+#   - by default the recorded asynchronies drive the rule (open loop). With
+#     --closed-loop the taps are held at their recorded times and re-registered
+#     against the replayed metronome each window, so the rule sees the
+#     asynchronies it would have produced
+#   - all runs of all files are stacked and replayed at once; the recorded
+#     alpha with the average heuristic must reproduce next_met_adjust, runs
+#     where it does not are reported
+#   - the result is a CSV table with one row per run per scenario
+#
+# Usage:
+#   python GEMReplay.py <data_dir|file.gdf> ... [--alphas recorded 0 0.5]
+#       [--heuristics average median weighted] [--weights 1 1 1 1]
+#       [--closed-loop] [--out replay.csv] [--workers N]
+'''
+
+import argparse
+import csv
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
+
+import numpy as np
+
+from GEMIO import GEMDataFile, NO_RESPONSE
+from GEMAnalysis import find_data_files
+from GEMMetronome import HEURISTICS, parse_float, tempo_to_ioi
+
+# replay table columns in the order they are written
+COLUMNS = [
+    "file", "run_number", "tempo", "recorded_alpha", "alpha", "heuristic", "closed_loop",
+    "windows", "mean_adjust", "drift_ms", "tempo_bpm", "offset_ms",
+    "mean_abs_asynchrony", "matches_recorded",
+]
+
+# ==============================================================================
+# read every recorded run of a .gdf file
+# out: list of (filepath, run header dict, structured packet array)
+def load_file(filepath):
+    df = GEMDataFile(filepath, mode="rb", memmap=True)
+
+    runs = [(filepath, hdr, np.array(data)) for krun, hdr, data in df.iter_runs() if data.size]
+
+    df.close()
+
+    return runs
+
+# ==============================================================================
+# read the runs of all .gdf files in <paths> (files or directories) across a
+# process pool, in file order
+def load_runs(paths, workers=None):
+    files = []
+    for p in paths:
+        files.extend(find_data_files(p) if os.path.isdir(p) else [p])
+
+    print(f"[INFO]: Loading {len(files)} file(s)")
+
+    loaded = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        jobs = {pool.submit(load_file, f): f for f in files}
+
+        for job in as_completed(jobs):
+            try:
+                loaded[jobs[job]] = job.result()
+            except Exception as err:
+                print(f"[WARN]: Failed to read file \"{jobs[job]}\" - {err}")
+
+    return [run for f in files for run in loaded.get(f, [])]
+
+# ==============================================================================
+# stack runs into padded integer arrays
+# in: <runs> list of (filepath, hdr, packets) as returned by load_runs
+# out: dict with
+#      asynchronies (nrun, max_windows, ntapper), NO_RESPONSE padded
+#      met_time, next_met_adjust (nrun, max_windows), 0 padded
+#      valid (nrun, max_windows) bool, true for recorded windows
+#      nwin, ioi, tempo, alpha (nrun,) with alpha as parsed by the firmware
+#      file, run_number lists
+def stack_packets(runs):
+    nrun = len(runs)
+    nwin = np.array([r[2].size for r in runs], dtype=int)
+    maxwin = nwin.max(initial=0)
+    ntap = runs[0][2].dtype["asynchronies"].shape[0] if nrun else 0
+
+    batch = {
+        "asynchronies": np.full((nrun, maxwin, ntap), NO_RESPONSE, dtype=np.int64),
+        "met_time": np.zeros((nrun, maxwin), dtype=np.int64),
+        "next_met_adjust": np.zeros((nrun, maxwin), dtype=np.int64),
+        "valid": np.arange(maxwin) < nwin[:, np.newaxis],
+        "nwin": nwin,
+        "tempo": np.array([r[1]["tempo"] for r in runs], dtype=float),
+        "ioi": np.array([tempo_to_ioi(r[1]["tempo"]) for r in runs], dtype=np.int64),
+        "alpha": np.array([parse_float(str(r[1]["alpha"])) for r in runs], dtype=np.float32),
+        "recorded_alpha": [r[1]["alpha"] for r in runs],
+        "file": [r[0] for r in runs],
+        "run_number": [r[1].get("run_number") for r in runs],
+    }
+
+    for k, (f, hdr, data) in enumerate(runs):
+        batch["asynchronies"][k, :data.size] = data["asynchronies"]
+        batch["met_time"][k, :data.size] = data["met_time"]
+        batch["next_met_adjust"][k, :data.size] = data["next_met_adjust"]
+
+    return batch
+
+# ==============================================================================
+# replay a batch of runs under one adjustment rule
+# in: <batch> from stack_packets, <alpha> a scalar or one alpha per run,
+#     <heuristic> a name in GEMMetronome.HEURISTICS, <weights> per tapper
+#     weights for the weighted heuristic
+# out: dict with the replayed next_met_adjust and met_time (nrun, max_windows)
+#      and the asynchronies of the recorded taps to the replayed metronome
+def replay(batch, alpha, heuristic="average", closed_loop=False, weights=None):
+    rule = HEURISTICS[heuristic]
+    if heuristic == "weighted":
+        rule = partial(rule, weights=weights)
+
+    valid = batch["valid"]
+    ioi = batch["ioi"][:, np.newaxis]
+    recorded = batch["asynchronies"]
+    responded = recorded != NO_RESPONSE
+
+    nrun, maxwin = valid.shape
+    alpha = np.broadcast_to(np.asarray(alpha, dtype=np.float32), (nrun,))
+
+    # absolute tap times, the replayed metronome starts at the first recorded
+    # event
+    taps = batch["met_time"][:, :, np.newaxis] + recorded
+    start = batch["met_time"][:, :1]
+
+    if not closed_loop:
+        adjust = np.where(valid, rule(recorded, alpha[:, np.newaxis]), 0)
+        step = (ioi + adjust) & 0xffff
+        met = start + np.concatenate([np.zeros((nrun, 1), dtype=np.int64), np.cumsum(step[:, :-1], axis=1)], axis=1)
+
+    else:
+        half = ioi // 2
+        adjust = np.zeros((nrun, maxwin), dtype=np.int64)
+        met = np.zeros((nrun, maxwin), dtype=np.int64)
+
+        current = start[:, 0]
+        for k in range(0, maxwin):
+            met[:, k] = current
+
+            # taps that fall outside the replayed window are not registered
+            asyncs = taps[:, k] - current[:, np.newaxis]
+            registered = responded[:, k] & (asyncs >= -half) & (asyncs < half)
+
+            adjust[:, k] = np.where(valid[:, k], rule(np.where(registered, asyncs, NO_RESPONSE), alpha), 0)
+            current = current + ((ioi[:, 0] + adjust[:, k]) & 0xffff)
+
+    asyncs = np.where(responded & valid[:, :, np.newaxis], taps - met[:, :, np.newaxis], NO_RESPONSE)
+
+    return {"next_met_adjust": adjust, "met_time": met, "asynchronies": asyncs}
+
+# ==============================================================================
+# runs whose recorded next_met_adjust is not reproduced by the average rule at
+# the recorded alpha
+# out: indices into the batch
+def check_reproduced(batch):
+    result = replay(batch, batch["alpha"], "average")
+    same = (result["next_met_adjust"] == batch["next_met_adjust"]) | ~batch["valid"]
+
+    return np.flatnonzero(~same.all(axis=1))
+
+# ==============================================================================
+# per-run summary of a replay
+# out: dict of (nrun,) arrays
+def summarize_replay(batch, result):
+    valid = batch["valid"]
+    nwin = batch["nwin"]
+    rows = np.arange(valid.shape[0])
+    last = np.maximum(nwin - 1, 0)
+
+    met = result["met_time"]
+    adjust = np.where(valid, result["next_met_adjust"], 0)
+
+    # how far the metronome moved relative to its nominal ioi by the last
+    # recorded event, and where that event ended up relative to the recording
+    elapsed = met[rows, last] - met[:, 0]
+    drift = elapsed - last * batch["ioi"]
+    offset = met[rows, last] - batch["met_time"][rows, last]
+
+    asyncs = result["asynchronies"]
+    responded = asyncs != NO_RESPONSE
+    nresp = responded.sum(axis=(1, 2))
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return {
+            "windows": nwin,
+            "mean_adjust": adjust.sum(axis=1) / nwin,
+            "drift_ms": drift,
+            "tempo_bpm": np.where(last > 0, 60000 * last / elapsed, np.nan),
+            "offset_ms": offset,
+            "mean_abs_asynchrony": np.where(responded, np.abs(asyncs), 0).sum(axis=(1, 2)) / nresp,
+            "matches_recorded": ((adjust == batch["next_met_adjust"]) | ~valid).all(axis=1),
+        }
+
+# ==============================================================================
+# replay every run under every alpha x heuristic scenario
+# in: <alphas> floats or "recorded" (each run's own alpha)
+# out: list of row dicts with keys from COLUMNS
+def replay_scenarios(batch, alphas, heuristics, closed_loop=False, weights=None):
+    rows = []
+    for a in alphas:
+        alpha = batch["alpha"] if a == "recorded" else parse_float(str(a))
+
+        for h in heuristics:
+            summary = summarize_replay(batch, replay(batch, alpha, h, closed_loop, weights))
+
+            for k in range(0, batch["nwin"].size):
+                row = {
+                    "file": batch["file"][k],
+                    "run_number": batch["run_number"][k],
+                    "tempo": batch["tempo"][k],
+                    "recorded_alpha": batch["recorded_alpha"][k],
+                    "alpha": batch["recorded_alpha"][k] if a == "recorded" else a,
+                    "heuristic": h,
+                    "closed_loop": closed_loop,
+                }
+                row.update({name: v[k] for name, v in summary.items()})
+                rows.append(row)
+
+            print(f"[INFO]: alpha {a}, {h}: mean drift {np.mean(summary['drift_ms']):.1f} ms, "
+                f"mean |asynchrony| {np.nanmean(summary['mean_abs_asynchrony']):.1f} ms")
+
+    return rows
+
+# ==============================================================================
+# write replay rows to a CSV file
+def write_table(rows, outpath):
+    with open(outpath, "w", newline="") as io:
+        writer = csv.DictWriter(io, fieldnames=COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+# ==============================================================================
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded GEM runs under alternative metronome rules")
+    parser.add_argument("paths", nargs="+", help=".gdf files or directories to search (recursively)")
+    parser.add_argument("--alphas", nargs="+", default=["recorded"],
+        help="alphas to replay, \"recorded\" for each run's own alpha (default: recorded)")
+    parser.add_argument("--heuristics", nargs="+", default=["average"], choices=sorted(HEURISTICS),
+        help="adjustment rules to replay (default: average)")
+    parser.add_argument("--weights", type=float, nargs="+", default=None,
+        help="per tapper weights for the weighted heuristic (default: equal)")
+    parser.add_argument("--closed-loop", action="store_true",
+        help="re-register the recorded taps against the replayed metronome")
+    parser.add_argument("--out", default="gem_replay.csv",
+        help="path of the output CSV table (default: gem_replay.csv)")
+    parser.add_argument("--workers", type=int, default=None,
+        help="number of worker processes for reading files (default: number of CPUs)")
+
+    args = parser.parse_args()
+
+    for a in args.alphas:
+        if a != "recorded":
+            try:
+                float(a)
+            except ValueError:
+                parser.error(f"invalid alpha \"{a}\"")
+
+    runs = load_runs(args.paths, args.workers)
+    if not runs:
+        parser.error("no recorded runs found")
+
+    batch = stack_packets(runs)
+
+    if args.weights is not None and len(args.weights) != batch["asynchronies"].shape[2]:
+        parser.error(f"need {batch['asynchronies'].shape[2]} weights")
+
+    mismatched = check_reproduced(batch)
+    print(f"[INFO]: Replaying {len(runs)} run(s), recorded adjustments reproduced in "
+        f"{len(runs) - mismatched.size}")
+    for k in mismatched:
+        print(f"[WARN]: \"{batch['file'][k]}\" run {batch['run_number'][k]}: recorded next_met_adjust "
+            f"is not reproduced by the average rule")
+
+    rows = replay_scenarios(batch, args.alphas, args.heuristics, args.closed_loop, args.weights)
+    write_table(rows, args.out)
+
+    print(f"[INFO]: Wrote {len(rows)} row(s) to {args.out}")
+
+if __name__ == "__main__":
+    main()
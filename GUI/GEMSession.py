@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+# Session set up shared by the GUI and the headless runner (no Tk required)
+#   - normalizes the presets and builds the run order, either from
+#     "fixed_run_order" or by shuffling every tempo x alpha combination
+#   - creates the session's .gdf data file and writes its file header
+'''
+
+import os
+import time
+from copy import copy
+from datetime import date, datetime
+
+import numpy as np
+
+from GEMIO import GEMDataFile
+
+# ==============================================================================
+def get_date():
+    return date.today().strftime("%Y%m%d")
+
+def get_time():
+    return datetime.now().strftime("%H:%M:%S")
+
+def hours_since_trump():
+    now = time.time()
+    now_hr = now - np.fmod(now, 60**2)
+    now_str = "%06d" % int((now_hr - 1484910000) / (60**2))
+    return now_str
+
+# ==============================================================================
+# make sure presets["metronome_tempo"] is a list and record "num_tempos"
+def normalize_presets(presets):
+    if presets["metronome_tempo"] and type(presets["metronome_tempo"]) != list:
+        presets["metronome_tempo"] = [presets["metronome_tempo"]]
+
+    # Figure out how many tempos/tempi we have
+    presets["num_tempos"] = len(presets["metronome_tempo"])
+
+    return presets
+
+# ==============================================================================
+# shuffle all tempo x alpha combinations, each repeated <repeats> times
+# out: (tempos, alphas) lists giving the parameters of each run
+def randomize_runs(tempos, alphas, repeats):
+    # Create a list of tuples that are all combinations of tempo and alpha
+    combos = []
+
+    for tempo in tempos:
+        for alpha in alphas:
+            combos.append({"tempo": tempo, "alpha": alpha})
+
+    # Create a list containing the desired number of repeats
+    runs = np.repeat(combos, repeats)
+
+    # Shuffle the list
+    np.random.shuffle(runs)
+
+    # Read out the tempo and alpha values
+    return [run["tempo"] for run in runs], [run["alpha"] for run in runs]
+
+# ==============================================================================
+# out: (tempos, alphas) for the runs of a session with <presets>
+def run_order(presets):
+    fixed_run_order = presets.get("fixed_run_order", False)
+    if fixed_run_order:
+        # Have to assign tempos and alphas from our fixed order list
+        tempos = [run["tempo"] for run in fixed_run_order]
+        alphas = [run["alpha"] for run in fixed_run_order]
+
+        return tempos, alphas
+
+    return randomize_runs(presets["metronome_tempo"], presets["metronome_alpha"], presets["repeats"])
+
+# ==============================================================================
+# path of the session's data file: <data_dir>/<yyyymmdd>/<filename>-<ids>.gdf
+def data_file_path(presets, subject_ids):
+    data_dir = os.path.join(presets["data_dir"], get_date())
+
+    return os.path.join(data_dir, presets["filename"] + "-" +
+        "_".join(subject_ids) + ".gdf")
+
+# ==============================================================================
+# create the data file at <filepath> and write the file header: the presets
+# plus the subject and session info
+def init_data_file(filepath, presets, nruns, subject_ids, subject_info, experimenter_id):
+    data_dir = os.path.dirname(filepath)
+    if not os.path.exists(data_dir):
+        os.makedirs(data_dir)
+
+    d = copy(presets)
+    d["subject_ids"] = subject_ids
+    d["subject_info"] = subject_info
+    d["experimenter_id"] = experimenter_id
+    d["date"] = get_date()
+    d["time"] = get_time()
+    d["nruns"] = nruns
+
+    data_file = GEMDataFile(filepath, nruns)
+    data_file.write_file_header(d, nruns)
+
+    return data_file
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+# Monte Carlo simulation of GEM runs for choosing alpha/tempo grids
+#   - the metronome follows Metronome::scheduleNext exactly (average
+#     heuristic with the firmware's integer arithmetic, see GEMMetronome)
+#   - tappers follow a linear phase correction model with Wing-Kristofferson
+#     timekeeper and motor noise:
+#       t[n+1] = t[n] + period - correction * (A[n] - bias) + T[n] + M[n+1] - M[n]
+#     where A[n] = t[n] - m[n] is the asynchrony to metronome event m[n],
+#     taps are registered as whole milliseconds and taps that miss the window
+#     (or are dropped with probability <miss>) are NO_RESPONSE
+#   - every run in a batch is simulated at once (vectorized over runs and
+#     tappers, one step per window) and batches are spread over a process pool
+#   - the result is a table with the distribution over runs of each run
+#     metric for every alpha, tempo and group size
+#
+# Usage:
+#   python GEMSimulate.py --alphas 0 0.3 1 --tempos 80 120 150 --group-sizes 2 4
+#       [--runs 100000] [--windows 60] [--workers N] [--out simulation.csv]
+'''
+
+import argparse
+import csv
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from GEMIO import NO_RESPONSE
+from GEMMetronome import average_adjust, parse_float, tempo_to_ioi
+
+# default tapper model parameters (ms, except the correction gain and miss
+# probability)
+DEFAULT_TAPPER = {
+    "correction": 0.25,
+    "bias": -20.0,
+    "timekeeper_sd": 12.0,
+    "motor_sd": 5.0,
+    "period_sd": 5.0,
+    "miss": 0.02,
+}
+
+# per-run metrics, summarized over runs
+METRICS = ["mean_asynchrony", "sd_asynchrony", "response_rate", "mean_adjust", "tempo_drift_bpm"]
+
+QUANTILES = [5, 25, 50, 75, 95]
+
+# summary table columns in the order they are written
+COLUMNS = ["alpha", "tempo", "group_size", "runs", "metric", "mean", "sd"] + ["p%d" % q for q in QUANTILES]
+
+# ==============================================================================
+# simulate <nrun> runs of <windows> windows
+# in: <tapper> dict of tapper model parameters (see DEFAULT_TAPPER)
+# out: dict mapping each name in METRICS to an array of <nrun> values
+def simulate_runs(alpha, tempo, ntap, nrun, windows, tapper, seed=None):
+    rng = np.random.default_rng(seed)
+
+    ioi = tempo_to_ioi(tempo)
+    half = ioi // 2
+    alpha = parse_float(str(alpha))
+
+    shape = (nrun, ntap)
+
+    # each tapper's own period, and the first taps around the first event
+    period = ioi + rng.normal(0, tapper["period_sd"], shape)
+    met = np.zeros(nrun)
+    taps = rng.normal(tapper["bias"], tapper["timekeeper_sd"], shape)
+    motor = rng.normal(0, tapper["motor_sd"], shape)
+
+    # per-run accumulators over windows and tappers
+    n = np.zeros(nrun)
+    total = np.zeros(nrun)
+    total_sq = np.zeros(nrun)
+    adjust_total = np.zeros(nrun)
+
+    for k in range(0, windows):
+        asynch = taps - met[:, np.newaxis]
+
+        # the firmware registers (millis() - met.next) for taps in the window
+        registered = np.floor(asynch)
+        missed = (rng.random(shape) < tapper["miss"]) | (registered < -half) | (registered >= half)
+        recorded = np.where(missed, NO_RESPONSE, registered).astype(np.int64)
+
+        adjust = average_adjust(recorded, alpha)
+
+        valid = ~missed
+        n += valid.sum(axis=1)
+        total += np.where(valid, registered, 0).sum(axis=1)
+        total_sq += np.where(valid, registered**2, 0).sum(axis=1)
+        adjust_total += adjust
+
+        # schedule the next event (uint16 ioi + adjust, as on the Uno)
+        met = met + ((ioi + adjust) & 0xffff)
+
+        # each tapper corrects part of its asynchrony to the last event
+        motor_next = rng.normal(0, tapper["motor_sd"], shape)
+        taps = (taps + period - tapper["correction"] * (asynch - tapper["bias"])
+            + rng.normal(0, tapper["timekeeper_sd"], shape) + motor_next - motor)
+        motor = motor_next
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = total / n
+        sd = np.sqrt((total_sq - n * mean**2) / (n - 1))
+
+    # tempo the metronome settled on relative to its nominal (integer) IOI
+    mean_ioi = met / windows
+
+    return {
+        "mean_asynchrony": mean,
+        "sd_asynchrony": np.where(n > 1, sd, np.nan),
+        "response_rate": n / (windows * ntap),
+        "mean_adjust": adjust_total / windows,
+        "tempo_drift_bpm": 60000 / mean_ioi - 60000 / ioi,
+    }
+
+# ==============================================================================
+# summarize per-run metric arrays into table rows
+def summarize(alpha, tempo, ntap, metrics):
+    rows = []
+    for name in METRICS:
+        x = metrics[name]
+        x = x[~np.isnan(x)]
+
+        row = {"alpha": alpha, "tempo": tempo, "group_size": ntap, "runs": x.size, "metric": name}
+        if x.size:
+            row.update({"mean": x.mean(), "sd": x.std(ddof=1) if x.size > 1 else np.nan})
+            row.update({"p%d" % q: v for q, v in zip(QUANTILES, np.percentile(x, QUANTILES))})
+
+        rows.append(row)
+
+    return rows
+
+# ==============================================================================
+# simulate every alpha x tempo x group size cell with <runs> runs each, split
+# into batches of at most <batch> runs across a process pool
+# out: list of row dicts with keys from COLUMNS
+def simulate_grid(alphas, tempos, group_sizes, runs, windows, tapper=None,
+        batch=50000, workers=None, seed=None):
+
+    tapper = dict(DEFAULT_TAPPER, **(tapper or {}))
+
+    cells = [(a, t, g) for a in alphas for t in tempos for g in group_sizes]
+    nbatch = -(-runs // batch)
+
+    # independent random streams for every batch
+    seeds = np.random.SeedSequence(seed).spawn(len(cells) * nbatch)
+
+    print(f"[INFO]: Simulating {len(cells)} cell(s) x {runs} runs in {len(cells) * nbatch} batch(es)")
+
+    results = {cell: [] for cell in cells}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        jobs = {}
+        for kcell, cell in enumerate(cells):
+            for kbatch in range(0, nbatch):
+                nrun = min(batch, runs - kbatch * batch)
+                job = pool.submit(simulate_runs, *cell, nrun, windows, tapper, seeds[kcell * nbatch + kbatch])
+                jobs[job] = cell
+
+        for job in as_completed(jobs):
+            results[jobs[job]].append(job.result())
+
+    rows = []
+    for cell in cells:
+        metrics = {k: np.concatenate([r[k] for r in results[cell]]) for k in METRICS}
+        rows.extend(summarize(*cell, metrics))
+
+    return rows
+
+# ==============================================================================
+# write summary rows to a CSV file
+def write_table(rows, outpath):
+    with open(outpath, "w", newline="") as io:
+        writer = csv.DictWriter(io, fieldnames=COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+# ==============================================================================
+def main():
+    parser = argparse.ArgumentParser(description="Monte Carlo simulation of adaptive metronome runs")
+    parser.add_argument("--alphas", type=float, nargs="+", default=[0, 0.3, 1],
+        help="metronome alphas to simulate (default: 0 0.3 1)")
+    parser.add_argument("--tempos", type=float, nargs="+", default=[120],
+        help="metronome tempos (bpm) to simulate (default: 120)")
+    parser.add_argument("--group-sizes", type=int, nargs="+", default=[4],
+        help="numbers of tappers to simulate (default: 4)")
+    parser.add_argument("--runs", type=int, default=100000,
+        help="runs per alpha x tempo x group size (default: 100000)")
+    parser.add_argument("--windows", type=int, default=60,
+        help="windows per run (default: 60)")
+    parser.add_argument("--batch", type=int, default=50000,
+        help="runs per batch (default: 50000)")
+    parser.add_argument("--workers", type=int, default=None,
+        help="number of worker processes (default: number of CPUs)")
+    parser.add_argument("--seed", type=int, default=None, help="random seed")
+    parser.add_argument("--out", default="gem_simulation.csv",
+        help="path of the output CSV table (default: gem_simulation.csv)")
+
+    for k, v in DEFAULT_TAPPER.items():
+        parser.add_argument("--" + k.replace("_", "-"), type=float, default=v,
+            help=f"tapper model {k} (default: {v})")
+
+    args = parser.parse_args()
+
+    tapper = {k: getattr(args, k) for k in DEFAULT_TAPPER}
+
+    rows = simulate_grid(args.alphas, args.tempos, args.group_sizes, args.runs, args.windows,
+        tapper, args.batch, args.workers, args.seed)
+    write_table(rows, args.out)
+
+    print(f"[INFO]: Wrote {len(rows)} row(s) to {args.out}")
+
+if __name__ == "__main__":
+    main()
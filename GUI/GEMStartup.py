@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+# Startup timing for the GUI
+#   - GEMGUI times its imports and each step of its initialization in the
+#     shared <startup> profile, recording is always on (a perf_counter call per
+#     step) but the breakdown is only printed when profiling is enabled
+#   - enable with GEM_PROFILE_STARTUP=1 in the environment or
+#     presets["profile_startup"] = True, e.g.:
+#       GEM_PROFILE_STARTUP=1 python examples/gem_example.py
+#   - only depends on the standard library so it can be imported first
+'''
+
+import os
+from contextlib import contextmanager
+from time import perf_counter
+
+# ==============================================================================
+# named, timed steps in the order they ran
+class StartupProfile:
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.t0 = perf_counter()
+        self.last = self.t0
+        self.steps = []
+        self.reported = False
+
+    # --------------------------------------------------------------------------
+    @contextmanager
+    def step(self, name):
+        t = perf_counter()
+        try:
+            yield
+        finally:
+            self.last = perf_counter()
+            self.steps.append((name, self.last - t))
+
+    # --------------------------------------------------------------------------
+    # record the time since the previous step or mark as step <name>
+    def mark(self, name):
+        t = perf_counter()
+        self.steps.append((name, t - self.last))
+        self.last = t
+
+    # --------------------------------------------------------------------------
+    # print the breakdown once (if enabled), <total_label> names the time
+    # since this profile was created
+    def report(self, total_label="startup"):
+        if not self.enabled or self.reported:
+            return
+
+        self.reported = True
+
+        total = perf_counter() - self.t0
+        width = max([len(name) for name, secs in self.steps] + [len(total_label)])
+
+        print("[INFO]: Startup profile (ms)")
+        for name, secs in self.steps:
+            print(f"[INFO]:   {name:<{width}} {secs * 1000:8.1f}")
+        print(f"[INFO]:   {total_label:<{width}} {total * 1000:8.1f}")
+
+# the profile of this process, started when GEMStartup is first imported
+startup = StartupProfile(os.environ.get("GEM_PROFILE_STARTUP", "") not in ("", "0"))
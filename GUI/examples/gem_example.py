@@ -17,17 +17,15 @@ if not os.environ.get('GEMROOT', None):
 
 sys.path.append(os.path.join(os.environ['GEMROOT'],'GUI'))
 
-from GEMGUI import GEMGUI
-from GEMIO import get_metronome_port
-
 # Indicate the serial# of the metronome Arduino.
 # This is used to search for the correct port information
 metronome_serial_num = "9543731333535131D171"
 
 # Define experimental presets
 presets = {
-    # metronome serial port info
-    "serial": {"port": get_metronome_port(serial_num=metronome_serial_num), "baud_rate": 115200, "timeout": 5},
+    # metronome serial port info, the port of the metronome with this serial
+    # number is looked up when the port is first opened
+    "serial": {"serial_num": metronome_serial_num, "baud_rate": 115200, "timeout": 5},
 
     # beginning of output file string for output data files
     "filename": "GEM_example",
@@ -72,6 +70,7 @@ presets = {
 
 # Run the experiment through the GUI
 if __name__ == "__main__":
+    from GEMGUI import GEMGUI
 
     g = GEMGUI(presets)
     g.mainloop()
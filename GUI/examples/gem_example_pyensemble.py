@@ -17,9 +17,6 @@ if not os.environ.get('GEMROOT', None):
 
 sys.path.append(os.path.join(os.environ['GEMROOT'],'GUI'))
 
-from GEMGUI import GEMGUI
-from GEMIO import get_metronome_port
-
 import urllib3
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
@@ -32,8 +29,9 @@ presets = {
     # Useful to set verify_ssl to False if debugging
     "verify_ssl": False,
 
-    # metronome serial port info
-    "serial": {"port": get_metronome_port(serial_num=metronome_serial_num), "baud_rate": 115200, "timeout": 5},
+    # metronome serial port info, the port of the metronome with this serial
+    # number is looked up when the port is first opened
+    "serial": {"serial_num": metronome_serial_num, "baud_rate": 115200, "timeout": 5},
 
     # beginning of output file string for output data files
     "filename": "GEM_pyensemble_example",
@@ -79,6 +77,7 @@ presets = {
 
 # Run the experiment through the GUI
 if __name__ == "__main__":
+    from GEMGUI import GEMGUI
 
     g = GEMGUI(presets)
     g.mainloop()
@@ -0,0 +1,386 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+# Check of GEMPyEnsemble.PyEnsembleClient against a local stub server
+#   - the stub answers the PyEnsemble endpoints GEM uses (see
+#     GEMPyEnsemble.URLS) with just enough HTML/JSON for the client: a login
+#     form, the experimenter code form, the group session status page, the
+#     participant list and the trial forms
+#   - endpoints can be told to answer the next requests with an error status
+#     or to answer slowly, which exercises the client's retry on 502/503/504
+#     and its per request timeout
+#   - jobs are also run through submit()/poll() to check that callbacks and
+#     errbacks only run on the thread that calls poll()
+#   - every check prints ok or FAILED, the exit status is the number of
+#     failed checks
+#
+# Usage:
+#   python pyensemble_stub.py [--timeout 0.5] [--retries 3]
+'''
+
+import argparse
+import json
+import os
+import sys
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread, Lock, current_thread
+from time import monotonic, sleep
+from urllib.parse import parse_qs
+
+import requests
+
+GEMROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+sys.path.insert(0, os.path.join(GEMROOT, "GUI"))
+
+from GEMPyEnsemble import PyEnsembleClient, PyEnsembleError, URLS
+
+USERNAME = "experimenter"
+PASSWORD = "secret"
+EXPERIMENTER_CODE = "1234"
+
+PARTICIPANTS = {
+    "085401ab1": {"pad": 1},
+    "085401cd2": {"pad": 2},
+}
+
+# ==============================================================================
+# state shared by the stub's request handlers
+class StubState:
+    def __init__(self):
+        self.lock = Lock()
+
+        # statuses to answer the next requests to a path with, and seconds to
+        # wait before answering a path
+        self.fail = {}
+        self.delay = {}
+
+        # requests received per path, and the trial parameters posted
+        self.hits = {}
+        self.trials = []
+
+    # --------------------------------------------------------------------------
+    def reset(self):
+        with self.lock:
+            self.fail.clear()
+            self.delay.clear()
+            self.hits.clear()
+
+    # --------------------------------------------------------------------------
+    # count a request to <path>, returns an error status to answer with or None
+    def hit(self, path):
+        with self.lock:
+            self.hits[path] = self.hits.get(path, 0) + 1
+
+            pending = self.fail.get(path)
+            if pending:
+                return pending.pop(0)
+
+        return None
+
+# ==============================================================================
+class StubHandler(BaseHTTPRequestHandler):
+    state = None
+
+    # --------------------------------------------------------------------------
+    def log_message(self, fmt, *args):
+        pass
+
+    # --------------------------------------------------------------------------
+    def reply(self, status=200, body="", content_type="text/html", cookies=()):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for c in cookies:
+            self.send_header("Set-Cookie", c)
+        self.end_headers()
+        self.wfile.write(data)
+
+    # --------------------------------------------------------------------------
+    def logged_in(self):
+        return "sessionid=ok" in self.headers.get("Cookie", "")
+
+    # --------------------------------------------------------------------------
+    def form(self):
+        n = int(self.headers.get("Content-Length", 0))
+        return {k: v[0] for k, v in parse_qs(self.rfile.read(n).decode("utf-8")).items()}
+
+    # --------------------------------------------------------------------------
+    # answer with an injected error or delay, returns True if the request has
+    # been answered
+    def inject(self):
+        delay = self.state.delay.get(self.path, 0)
+        if delay:
+            sleep(delay)
+
+        status = self.state.hit(self.path)
+        if status is not None:
+            self.reply(status, "stub error")
+            return True
+
+        return False
+
+    # --------------------------------------------------------------------------
+    def do_GET(self):
+        if self.inject():
+            return
+
+        path = self.path
+        if path == URLS["connect"]:
+            if not self.logged_in():
+                self.reply(200, '<form><input name="username"><input name="password"></form>',
+                    cookies=["csrftoken=stubtoken; Path=/"])
+            else:
+                self.reply(200, '<form><input name="experimenter_code"></form>')
+
+        elif path == URLS["update"]:
+            self.reply(200, json.dumps(PARTICIPANTS), "application/json")
+
+        elif path in (URLS["init_experiment"], URLS["init_trial"]):
+            self.reply(200, '<form method="post"></form>')
+
+        elif path == URLS["start_trial"]:
+            self.reply(200, "started")
+
+        elif path in (URLS["end_trial"], URLS["end_experiment"], URLS["exit_loop"]):
+            self.reply(200, "ok")
+
+        else:
+            self.reply(404, "not found")
+
+    # --------------------------------------------------------------------------
+    def do_POST(self):
+        if self.inject():
+            return
+
+        path = self.path
+        data = self.form()
+
+        if data.get("csrfmiddlewaretoken") != "stubtoken":
+            self.reply(403, "CSRF verification failed")
+
+        elif path == URLS["connect"] and "username" in data:
+            if data["username"] == USERNAME and data["password"] == PASSWORD:
+                self.reply(200, '<form><input name="experimenter_code"></form>',
+                    cookies=["sessionid=ok; Path=/"])
+            else:
+                self.reply(200, "Please enter a correct username and password")
+
+        elif path == URLS["connect"]:
+            if data.get("experimenter_code") == EXPERIMENTER_CODE:
+                self.reply(200, '<div id="groupsession_status"></div>')
+            else:
+                self.reply(200, "Failed to retrieve ticket matching this code")
+
+        elif path == URLS["init_experiment"]:
+            self.reply(200, "initialized")
+
+        elif path == URLS["init_trial"]:
+            self.state.trials.append(json.loads(data["params"]))
+            self.reply(200, "initialized")
+
+        else:
+            self.reply(404, "not found")
+
+# ==============================================================================
+# clients that time out hang up before a slow reply is written, that is
+# expected and not worth a traceback
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            ThreadingHTTPServer.handle_error(self, request, client_address)
+
+# ==============================================================================
+# the stub on a free port of localhost, serving from a daemon thread
+def start_stub():
+    state = StubState()
+    handler = type("Handler", (StubHandler,), {"state": state})
+
+    server = StubServer(("127.0.0.1", 0), handler)
+    Thread(target=server.serve_forever, daemon=True).start()
+
+    return server, state
+
+# ==============================================================================
+# the checks, each returns None on success or a reason for failing
+def check_attach(client, state):
+    result = client.attach(USERNAME, PASSWORD, EXPERIMENTER_CODE)
+    if not result["success"]:
+        return f"attach failed: {result['errors']}"
+
+# ------------------------------------------------------------------------------
+def check_participants(client, state):
+    if client.participants() != PARTICIPANTS:
+        return "unexpected participant list"
+
+# ------------------------------------------------------------------------------
+def check_retry(client, state):
+    path = URLS["update"]
+    for status in (502, 503, 504):
+        state.reset()
+        state.fail[path] = [status, status]
+
+        if client.participants() != PARTICIPANTS:
+            return f"no participant list after two {status} responses"
+
+        if state.hits.get(path) != 3:
+            return f"expected 3 requests after two {status} responses, got {state.hits.get(path)}"
+
+# ------------------------------------------------------------------------------
+def check_retry_exhausted(client, state, retries):
+    path = URLS["update"]
+    state.reset()
+    state.fail[path] = [503] * (retries + 2)
+
+    try:
+        client.participants()
+    except requests.exceptions.RequestException:
+        pass
+    else:
+        return "no error after the retries were used up"
+
+    if state.hits.get(path) != retries + 1:
+        return f"expected {retries + 1} requests, got {state.hits.get(path)}"
+
+# ------------------------------------------------------------------------------
+def check_no_retry_on_error(client, state):
+    path = URLS["exit_loop"]
+    state.reset()
+    state.fail[path] = [500]
+
+    try:
+        client.exit_loop()
+    except PyEnsembleError:
+        pass
+    else:
+        return "no PyEnsembleError for a 500 response"
+
+    if state.hits.get(path) != 1:
+        return f"a 500 response was retried ({state.hits.get(path)} requests)"
+
+# ------------------------------------------------------------------------------
+def check_timeout(client, state, timeout, retries):
+    path = URLS["end_trial"]
+    state.reset()
+    state.delay[path] = 3 * timeout
+
+    t = monotonic()
+    try:
+        client.end_trial()
+    except requests.exceptions.RequestException:
+        pass
+    else:
+        return "a slow endpoint did not time out"
+
+    # each attempt gives up after the read timeout, not after the delay
+    elapsed = monotonic() - t
+    if elapsed > (retries + 1) * 2 * timeout:
+        return f"timing out took {elapsed:.2f}s"
+
+# ------------------------------------------------------------------------------
+def check_trial(client, state):
+    state.reset()
+    ntrial = len(state.trials)
+    params = {"run_number": 1, "alpha": 0.3, "tempo": 120, "start_time": "12:00:00"}
+
+    form_url = client.fetch_trial_form()
+    client.init_and_start_trial(params, form_url)
+
+    if len(state.trials) != ntrial + 1 or state.trials[-1]["alpha"] != 0.3:
+        return "trial parameters were not posted"
+
+    if state.hits.get(URLS["start_trial"]) != 1:
+        return "trial was not started"
+
+# ------------------------------------------------------------------------------
+# submit jobs to the running worker, callbacks must only run from poll()
+def check_submit(client, state):
+    state.reset()
+    state.fail[URLS["exit_loop"]] = [500]
+
+    results = []
+    def record(kind):
+        return lambda result: results.append((kind, result, current_thread()))
+
+    client.submit(client.participants, callback=record("callback"), errback=record("errback"))
+    client.submit(client.exit_loop, callback=record("callback"), errback=record("errback"))
+    client.submit(client.end_trial)
+    client.submit(client.end_experiment, callback=record("delayed"), delay=0.2)
+
+    t = monotonic()
+    while len(results) < 3 and monotonic() - t < 5:
+        sleep(0.05)
+        client.poll()
+
+    kinds = [r[0] for r in results]
+    if kinds != ["callback", "errback", "delayed"]:
+        return f"unexpected callbacks {kinds}"
+
+    if any(r[2] is not current_thread() for r in results):
+        return "a callback ran outside poll()"
+
+    if results[0][1] != PARTICIPANTS or not isinstance(results[1][1], PyEnsembleError):
+        return "unexpected callback arguments"
+
+# ==============================================================================
+def main():
+    parser = argparse.ArgumentParser(description="Check the PyEnsemble client against a local stub server")
+    parser.add_argument("--timeout", type=float, default=0.5,
+        help="client read timeout in seconds (default: 0.5)")
+    parser.add_argument("--retries", type=int, default=3,
+        help="client retries (default: 3)")
+
+    args = parser.parse_args()
+
+    server, state = start_stub()
+    url = "http://127.0.0.1:%d" % server.server_address[1]
+    print(f"[INFO]: Stub PyEnsemble server at {url}")
+
+    client = PyEnsembleClient(url, timeout=(args.timeout, args.timeout), retries=args.retries, backoff=0)
+
+    checks = [
+        ("attach", lambda: check_attach(client, state)),
+        ("participants", lambda: check_participants(client, state)),
+        ("retry on 502/503/504", lambda: check_retry(client, state)),
+        ("retries exhausted", lambda: check_retry_exhausted(client, state, args.retries)),
+        ("no retry on 500", lambda: check_no_retry_on_error(client, state)),
+        ("timeout", lambda: check_timeout(client, state, args.timeout, args.retries)),
+        ("init and start trial", lambda: check_trial(client, state)),
+    ]
+
+    failed = 0
+    for name, check in checks:
+        try:
+            reason = check()
+        except Exception as err:
+            reason = f"{type(err).__name__}: {err}"
+
+        if reason is None:
+            print(f"[INFO]: ok      {name}")
+        else:
+            print(f"[WARN]: FAILED  {name} - {reason}")
+            failed += 1
+
+    # the worker thread is only started for the submit/poll check, the checks
+    # above call the operations directly
+    client.start()
+
+    reason = check_submit(client, state)
+    if reason is None:
+        print("[INFO]: ok      submit/poll callbacks")
+    else:
+        print(f"[WARN]: FAILED  submit/poll callbacks - {reason}")
+        failed += 1
+
+    client.close()
+    server.shutdown()
+
+    print(f"[INFO]: {failed} check(s) failed")
+
+    sys.exit(failed)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,368 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+# Host side of the serial throughput test (see throughput.ino)
+#   - sends GEM_START, then consumes the sketch's packets:
+#       1 byte n (255), 4 byte millis(), n payload bytes (255 - k), 4 byte
+#       millis()
+#     and sends GEM_STOP once --duration seconds have passed
+#   - the packets are pushed through the same stages as an acquisition: read
+#     from the port, frame, write to disk (GEMDiskWriter) and dispatch over
+#     the ITC, each stage is timed separately (the read stage includes the
+#     time spent blocked waiting for data)
+#   - with --emulate the sketch is emulated on a pty (paced to the baud rate)
+#     so the host side can be benchmarked without an Arduino
+#   - results (bytes/s, latency percentiles, per-stage costs) are printed and
+#     written to a JSON file so that runs on different versions can be compared
+#
+# Usage:
+#   python throughput.py --port /dev/cu.usbmodem... [--duration 10] [--out results.json]
+#   python throughput.py --emulate [--rate BYTES_PER_S] [--duration 10]
+'''
+
+import argparse
+import json
+import os
+import platform
+import select
+import struct
+import subprocess
+import sys
+import tempfile
+import tty
+from datetime import datetime
+from threading import Thread, Event
+from time import monotonic, perf_counter, sleep
+
+import numpy as np
+import serial
+
+GEMROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+sys.path.insert(0, os.path.join(GEMROOT, "GUI"))
+
+from GEMIO import GEMDiskWriter, GEM_CONSTANTS_HFILE, load_constants
+from GEMITC import ITC
+
+# packet payload as written by throughput.ino
+PACKET_N = 255
+PAYLOAD = bytes(255 - k for k in range(0, PACKET_N))
+PACKET_SIZE = 1 + 4 + PACKET_N + 4
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+# ==============================================================================
+# splits the byte stream back into packets, resyncing on the length byte. Only
+# frames carrying the known payload are accepted, <corrupt> counts rejected
+# candidates
+class ThroughputFramer:
+    def __init__(self):
+        self.buf = bytearray()
+        self.packets = 0
+        self.corrupt = 0
+        self.discarded_bytes = 0
+
+    # out: list of (millis at start, millis at end) of each complete packet
+    def feed(self, data):
+        self.buf += data
+
+        out = []
+        start = 0
+        buf = self.buf
+        while len(buf) - start >= PACKET_SIZE:
+            if buf[start] != PACKET_N:
+                start += 1
+                self.discarded_bytes += 1
+                continue
+
+            # a marker byte without the known payload behind it is not a
+            # frame, resync from the next byte
+            if buf[start+5:start+5+PACKET_N] != PAYLOAD:
+                self.corrupt += 1
+                start += 1
+                self.discarded_bytes += 1
+                continue
+
+            t_start, = struct.unpack_from("<I", buf, start + 1)
+            t_end, = struct.unpack_from("<I", buf, start + 5 + PACKET_N)
+
+            self.packets += 1
+            out.append((t_start, t_end))
+            start += PACKET_SIZE
+
+        del buf[:start]
+
+        return out
+
+# ==============================================================================
+# throughput.ino on a pty: streams packets after GEM_START until any other
+# byte arrives, paced to <rate> bytes/s (0: as fast as the pty allows)
+class ThroughputEmulator(Thread):
+    def __init__(self, start_code, rate):
+        Thread.__init__(self, daemon=True)
+
+        self.start_code = start_code
+        self.rate = rate
+
+        self.master, slave = os.openpty()
+        tty.setraw(slave)
+        self.device = os.ttyname(slave)
+        os.close(slave)
+
+        self.stopped = Event()
+
+    # --------------------------------------------------------------------------
+    def run(self):
+        t0 = monotonic()
+        def millis():
+            return int((monotonic() - t0) * 1000) & 0xffffffff
+
+        poller = select.poll()
+        poller.register(self.master, select.POLLIN)
+
+        running = False
+        sent = 0
+        t_stream = None
+        while not self.stopped.is_set():
+            events = poller.poll(0 if running else 50)
+            if any(ev & select.POLLIN for fd, ev in events):
+                try:
+                    msg = os.read(self.master, 64)
+                except OSError:
+                    msg = b""
+                if msg:
+                    running = msg[-1] == self.start_code
+                    sent = 0
+                    t_stream = monotonic()
+
+            if not running:
+                continue
+
+            packet = bytes([PACKET_N]) + struct.pack("<I", millis()) + PAYLOAD
+            packet += struct.pack("<I", millis())
+
+            try:
+                os.write(self.master, packet)
+            except OSError:
+                running = False
+                continue
+
+            # serial line pacing, then the sketch's delay(1)
+            sent += len(packet)
+            if self.rate:
+                ahead = t_stream + sent / self.rate - monotonic()
+                if ahead > 0:
+                    sleep(ahead)
+            sleep(0.001)
+
+    # --------------------------------------------------------------------------
+    def close(self):
+        self.stopped.set()
+        self.join()
+        os.close(self.master)
+
+# ==============================================================================
+# timing samples of one pipeline stage
+class Stage:
+    def __init__(self):
+        self.samples = []
+
+    def add(self, secs):
+        self.samples.append(secs)
+
+    def summary(self):
+        x = np.asarray(self.samples) * 1e6
+        if x.size == 0:
+            return {"calls": 0}
+
+        d = {"calls": int(x.size), "total_s": float(x.sum() / 1e6), "mean_us": float(x.mean())}
+        d.update({f"p{p}_us": float(v) for p, v in zip(PERCENTILES, np.percentile(x, PERCENTILES))})
+        d["max_us"] = float(x.max())
+        return d
+
+# ==============================================================================
+def percentiles(x):
+    x = np.asarray(x, dtype=float)
+    if x.size == 0:
+        return {}
+
+    d = {f"p{p}": float(v) for p, v in zip(PERCENTILES, np.percentile(x, PERCENTILES))}
+    d.update({"min": float(x.min()), "mean": float(x.mean()), "max": float(x.max())})
+    return d
+
+# ==============================================================================
+def git_revision():
+    try:
+        return subprocess.run(["git", "-C", GEMROOT, "describe", "--always", "--dirty"],
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# ==============================================================================
+# stream for <duration> seconds from <com> (a pyserial port)
+def benchmark(com, constants, duration, datapath, read_timeout=0.05):
+    framer = ThroughputFramer()
+
+    stages = {k: Stage() for k in ("read", "frame", "disk_write", "itc_send", "itc_delivery")}
+
+    # ITC: measure what it costs the reader to send, and how long it takes
+    # until the listener sees the message
+    itc = ITC()
+    def on_packets(sent_at):
+        stages["itc_delivery"].add(perf_counter() - sent_at)
+    itc.register_listener("packets", on_packets)
+    itc.start()
+
+    io = open(datapath, "wb")
+    writer = GEMDiskWriter(io)
+    writer.start()
+
+    com.timeout = read_timeout
+    com.reset_input_buffer()
+
+    # host receive time (ms) and the sketch's stamps for every packet
+    t_host = []
+    t_start = []
+    t_end = []
+
+    nbytes = 0
+    com.write(constants["GEM_START"])
+
+    t_open = perf_counter()
+    t_first = None
+    while perf_counter() - t_open < duration:
+        t = perf_counter()
+        data = com.read(1)
+        n = com.in_waiting
+        if n:
+            data += com.read(n)
+        t_read = perf_counter()
+        stages["read"].add(t_read - t)
+
+        if not data:
+            continue
+
+        if t_first is None:
+            t_first = t_read
+        nbytes += len(data)
+
+        t = perf_counter()
+        packets = framer.feed(data)
+        stages["frame"].add(perf_counter() - t)
+
+        t = perf_counter()
+        writer.write(data)
+        stages["disk_write"].add(perf_counter() - t)
+
+        if packets:
+            t = perf_counter()
+            itc.send_message("packets", t)
+            stages["itc_send"].add(perf_counter() - t)
+
+            host_ms = (t_read - t_open) * 1000
+            for a, b in packets:
+                t_host.append(host_ms)
+                t_start.append(a)
+                t_end.append(b)
+
+    t_last = perf_counter()
+    com.write(constants["GEM_STOP"])
+
+    writer.close()
+    io.close()
+    itc.close()
+
+    # one-way latency relative to the fastest packet: the sketch's millis()
+    # and the host clock are not synchronized, so only their difference
+    # above its minimum is meaningful
+    offset = np.asarray(t_host) - np.asarray(t_end, dtype=float)
+    latency = offset - offset.min() if offset.size else offset
+
+    elapsed = (t_last - t_first) if t_first is not None else 0.0
+
+    return {
+        "bytes": nbytes,
+        "elapsed_s": elapsed,
+        "bytes_per_s": nbytes / elapsed if elapsed else 0.0,
+        "packets": framer.packets,
+        "packets_per_s": framer.packets / elapsed if elapsed else 0.0,
+        "corrupt_packets": framer.corrupt,
+        "discarded_bytes": framer.discarded_bytes,
+        "latency_ms": percentiles(latency),
+        "packet_write_ms": percentiles(np.asarray(t_end, dtype=float) - np.asarray(t_start, dtype=float)),
+        "stages": {k: v.summary() for k, v in stages.items()},
+        "disk_writer": writer.counters(),
+        "itc": itc.counters(),
+    }
+
+# ==============================================================================
+def main():
+    parser = argparse.ArgumentParser(description="Host side serial throughput benchmark (throughput.ino)")
+    parser.add_argument("--port", default=None, help="serial port of the Arduino running throughput.ino")
+    parser.add_argument("--emulate", action="store_true", help="emulate throughput.ino on a pty instead")
+    parser.add_argument("--baud", type=int, default=115200, help="baud rate (default: 115200)")
+    parser.add_argument("--rate", type=float, default=None,
+        help="emulated line rate in bytes/s (default: baud / 10, 0: unthrottled)")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to stream (default: 10)")
+    parser.add_argument("--reset-wait", type=float, default=2.0,
+        help="seconds to wait for the Arduino to reset after opening the port (default: 2)")
+    parser.add_argument("--hfile", default=GEM_CONSTANTS_HFILE,
+        help="path to GEMConstants.h")
+    parser.add_argument("--data-file", default=None,
+        help="where the disk write stage writes to (default: a temporary file)")
+    parser.add_argument("--out", default="throughput_results.json", help="JSON results file")
+
+    args = parser.parse_args()
+
+    if not (args.port or args.emulate):
+        parser.error("need --port or --emulate")
+
+    constants = load_constants(args.hfile)
+
+    emulator = None
+    port = args.port
+    if args.emulate:
+        rate = args.baud / 10 if args.rate is None else args.rate
+        emulator = ThroughputEmulator(constants["GEM_START"][0], rate)
+        emulator.start()
+        port = emulator.device
+
+    datapath = args.data_file or os.path.join(tempfile.mkdtemp(), "throughput.dat")
+
+    com = serial.Serial(port=port, baudrate=args.baud, timeout=1)
+    if not args.emulate:
+        sleep(args.reset_wait)
+
+    try:
+        results = benchmark(com, constants, args.duration, datapath)
+    finally:
+        com.close()
+        if emulator is not None:
+            emulator.close()
+
+    results["config"] = {
+        "port": "emulated" if args.emulate else port,
+        "baud": args.baud,
+        "rate": rate if args.emulate else None,
+        "duration": args.duration,
+    }
+    results["version"] = {
+        "git": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "date": datetime.now().isoformat(timespec="seconds"),
+    }
+
+    with open(args.out, "w") as io:
+        json.dump(results, io, indent=2)
+
+    print(f"[INFO]: {results['bytes']} bytes, {results['packets']} packets in {results['elapsed_s']:.2f}s "
+        f"({results['bytes_per_s']:.0f} bytes/s, {results['corrupt_packets']} corrupt)")
+    print("[INFO]: latency (ms) " + ", ".join(f"{k} {v:.2f}" for k, v in results["latency_ms"].items()))
+    for k, v in results["stages"].items():
+        if v["calls"]:
+            print(f"[INFO]: {k:>12}: {v['calls']} calls, mean {v['mean_us']:.1f}us, p99 {v['p99_us']:.1f}us, total {v['total_s']:.3f}s")
+    print(f"[INFO]: Wrote {args.out}")
+
+if __name__ == "__main__":
+    main()